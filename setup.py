@@ -4,8 +4,16 @@
 Setup script for Statik, the static web site generator.
 """
 
+import os.path
+import re
+
 from setuptools import setup
 
+# the version is only defined in the package itself (which can't be imported
+# before its requirements are installed)
+with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'statik', '__init__.py'), 'rt') as f:
+    VERSION = re.search(r'^__version__ = "([^"]+)"', f.read(), re.MULTILINE).group(1)
+
 INSTALL_REQUIREMENTS = [
     "jinja2==2.8",
     "PyYAML==3.11",
@@ -15,12 +23,15 @@ INSTALL_REQUIREMENTS = [
 
 setup(
     name="statik",
-    version="0.2.5",
+    version=VERSION,
     description="General-purpose static web site generator",
     author="Thane Thomson",
     author_email="connect@thanethomson.com",
     url="https://github.com/thanethomson/statik",
     install_requires=INSTALL_REQUIREMENTS,
+    extras_require={
+        'columnar': ["numpy"],
+    },
     entry_points={
         'console_scripts': [
             'statik = statik.cmdline:main',
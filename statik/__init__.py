@@ -1,3 +1,6 @@
 # -*- coding:utf-8 -*-
-from statik.generator import generate
+
+__version__ = "0.2.5"
+
+from statik.generator import generate, StatikBuildFarm
 from statik.cmdline import main
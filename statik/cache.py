@@ -0,0 +1,140 @@
+# -*- coding:utf-8 -*-
+
+import os
+import os.path
+import hashlib
+import pickle
+import shutil
+import markdown
+
+from statik import __version__
+from statik.common import MARKDOWN_EXTENSIONS
+from statik.markdownyaml import MarkdownYamlMetaExtension
+
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    'StatikCache',
+    'calculate_cache_signature',
+]
+
+
+def calculate_cache_signature(*extra):
+    """Calculates a signature for all of the things that affect the way in
+    which data files are parsed (the Statik version and the Markdown
+    extension set). Cached data is only valid for the same signature.
+
+    Args:
+        extra: Any additional values that affect the parsed output.
+    """
+    parts = [__version__, markdown.version] + \
+        ['%s.%s' % (ext.__module__, ext.__name__) for ext in [MarkdownYamlMetaExtension] + MARKDOWN_EXTENSIONS] + \
+        ['%s' % e for e in extra]
+    return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+class StatikCache(object):
+    """A persistent, on-disk cache of parsed model data files. Each entry is
+    keyed by the data file's path, and is only considered valid if the file's
+    modification time, size and content hash match those at the time the
+    entry was stored.
+
+    Instances only hold paths, so they can safely be passed to worker
+    processes.
+    """
+
+    DATA_DIR = 'data'
+
+    def __init__(self, path, signature=None):
+        """Constructor.
+
+        Args:
+            path: The base path of the cache folder (e.g. the project's
+                .statik-cache folder).
+            signature: An optional pre-calculated cache signature.
+        """
+        self.path = path
+        self.signature = signature or calculate_cache_signature()
+        self.data_path = os.path.join(path, StatikCache.DATA_DIR, self.signature)
+
+    def prepare(self):
+        """Makes sure the cache folder exists, removing any cached data left
+        behind by differently configured builds."""
+        base_data_path = os.path.join(self.path, StatikCache.DATA_DIR)
+        if os.path.isdir(base_data_path):
+            for entry in os.listdir(base_data_path):
+                if entry != self.signature:
+                    logger.debug("Removing stale cache folder: %s" % entry)
+                    shutil.rmtree(os.path.join(base_data_path, entry), ignore_errors=True)
+
+        if not os.path.isdir(self.data_path):
+            os.makedirs(self.data_path)
+
+    def entry_path(self, filename, variant=None):
+        key = os.path.abspath(filename) if variant is None else '%s\n%s' % (os.path.abspath(filename), variant)
+        key = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.data_path, key[:2], '%s.pickle' % key)
+
+    def get(self, filename, variant=None):
+        """Attempts to retrieve the cached value for the given data file.
+
+        Args:
+            filename: The full path to the data file.
+            variant: An optional string distinguishing between different
+                ways of parsing the same file (e.g. front matter only).
+
+        Returns:
+            The cached value, or None if there is no valid cache entry for the
+            file in its current state.
+        """
+        entry_path = self.entry_path(filename, variant=variant)
+        try:
+            with open(entry_path, 'rb') as f:
+                entry = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+        stat = os.stat(filename)
+        if entry['mtime'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+            return entry['value']
+
+        # the file's been touched, but its content may still be the same
+        if entry['size'] == stat.st_size and entry['hash'] == calculate_file_hash(filename):
+            logger.debug("Data file modified, but content unchanged: %s" % filename)
+            entry['mtime'] = stat.st_mtime_ns
+            self.write_entry(entry_path, entry)
+            return entry['value']
+
+        return None
+
+    def put(self, filename, value, variant=None):
+        """Stores the given value in the cache for the given data file."""
+        stat = os.stat(filename)
+        self.write_entry(
+            self.entry_path(filename, variant=variant),
+            {
+                'path': os.path.abspath(filename),
+                'mtime': stat.st_mtime_ns,
+                'size': stat.st_size,
+                'hash': calculate_file_hash(filename),
+                'value': value,
+            }
+        )
+
+    def write_entry(self, entry_path, entry):
+        entry_dir = os.path.dirname(entry_path)
+        if not os.path.isdir(entry_dir):
+            os.makedirs(entry_dir, exist_ok=True)
+
+        # write to a temporary file first so that concurrent readers never
+        # see a partially written entry
+        tmp_path = '%s.%d.tmp' % (entry_path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, entry_path)
+
+
+def calculate_file_hash(filename):
+    with open(filename, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
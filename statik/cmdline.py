@@ -33,6 +33,52 @@ def main():
         help="The output path into which to place the built project (default: \"public\" directory in input " +
              "directory).",
     )
+    parser.add_argument(
+        '-j', '--jobs',
+        help="The number of worker processes to use when parsing the project's data files (default: 1).",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        '--cache',
+        help="Cache parsed data files in the project's .statik-cache folder, so that unchanged files need not " +
+             "be parsed again on subsequent builds.",
+        action='store_true',
+    )
+    parser.add_argument(
+        '--lazy-content',
+        help="Only convert Markdown content to HTML when it is actually rendered, instead of when it is loaded.",
+        action='store_true',
+    )
+    parser.add_argument(
+        '--persistent-db',
+        help="Keep the project's database in a file in its .statik-cache folder, only reloading the data for " +
+             "models whose data files have changed since the previous build.",
+        action='store_true',
+    )
+    parser.add_argument(
+        '--low-memory',
+        help="Keep the memory used while loading the project's data to a minimum, at some cost to speed.",
+        action='store_true',
+    )
+    parser.add_argument(
+        '--compress-content',
+        help="Store Content and Text values compressed in the project's database (useful for projects with " +
+             "large amounts of content, especially together with --persistent-db).",
+        action='store_true',
+    )
+    parser.add_argument(
+        '--columnar',
+        help="Execute structured view queries against a columnar (NumPy) copy of the project's data, instead of " +
+             "through the ORM (requires NumPy).",
+        action='store_true',
+    )
+    parser.add_argument(
+        '--profile',
+        help="Profile the database queries executed while processing the project's views, and output a summary " +
+             "of the most expensive ones (and of any N+1 query patterns) at the end of the build.",
+        action='store_true',
+    )
     parser.add_argument(
         '--quickstart',
         help="Statik will generate a basic directory structure for you in the project directory.",
@@ -51,4 +97,16 @@ def main():
     if args.quickstart:
         generate_quickstart(project_path)
     else:
-        generate(project_path, output_path=output_path, in_memory=False)
+        generate(
+            project_path,
+            output_path=output_path,
+            in_memory=False,
+            jobs=args.jobs,
+            cache=args.cache,
+            lazy_content=args.lazy_content,
+            persistent_db=args.persistent_db,
+            low_memory=args.low_memory,
+            compress_content=args.compress_content,
+            columnar=args.columnar,
+            profile=args.profile,
+        )
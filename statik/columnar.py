@@ -0,0 +1,326 @@
+# -*- coding:utf-8 -*-
+
+from datetime import datetime, date
+
+from sqlalchemy import select
+
+from statik.fields import *
+from statik.errors import *
+from statik.query import FILTER_OPERATORS
+from statik.utils import calculate_association_table_name, calculate_related_table_name
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    'StatikColumnarStore',
+    'StatikColumnarTable',
+    'StatikRow',
+]
+
+COLUMNAR_FIELD_TYPES = {'String', 'Integer', 'Boolean', 'DateTime'}
+
+# the precomputed tree columns of tree models (see StatikTreeMixin), other than
+# their paths
+TREE_COLUMNS = ['tree_depth', 'tree_order', 'tree_size']
+
+
+class StatikColumnarStore(object):
+    """A read-only, columnar copy of a loaded StatikDatabase: each model's
+    scalar fields are kept as NumPy arrays, and its relationships as arrays of
+    row indices, so that structured queries can be executed as vectorized
+    operations, and their results rendered through lightweight row proxies
+    instead of ORM instances.
+
+    Requires NumPy.
+    """
+
+    def __init__(self, db):
+        """Constructor.
+
+        Args:
+            db: A loaded StatikDatabase.
+        """
+        if numpy is None:
+            raise MissingDependencyError("NumPy is required for the columnar store (pip install numpy)")
+
+        self.db = db
+        self.tables = dict([
+            (model_name, StatikColumnarTable(self, model)) for model_name, model in db.models.items()
+        ])
+        for table in self.tables.values():
+            table.load_relationships()
+        logger.debug("Built columnar store for %d model(s)" % len(self.tables))
+
+    def execute(self, query):
+        """Executes the given StatikQuery against this store.
+
+        Returns:
+            A list of StatikRow objects.
+        """
+        table = self.tables[query.model_name]
+        mask = numpy.ones(len(table), dtype=bool)
+        for column, op, value in query.filters:
+            values, nulls = table.get_column(column)
+            if value is None:
+                mask &= nulls if op == '==' else ~nulls
+            else:
+                # NULLs never match, and can't be compared with the value
+                matches, present = numpy.zeros(len(table), dtype=bool), ~nulls
+                matches[present] = FILTER_OPERATORS[op](values[present], table.coerce_value(column, value))
+                mask &= matches
+
+        for column, _, filter_values in query.in_filters:
+            values, nulls = table.get_column(column)
+            mask &= ~nulls & numpy.isin(values, [table.coerce_value(column, value) for value in filter_values])
+
+        indices = numpy.nonzero(mask)[0]
+        if len(query.order) > 0 and len(indices) > 1:
+            keys = [table.get_sort_key(column, indices, descending) for column, descending in query.order]
+            # lexsort's primary key is its last one
+            indices = indices[numpy.lexsort(list(reversed(keys)))]
+
+        if query.limit is not None:
+            indices = indices[:query.limit]
+
+        return [StatikRow(table, int(index)) for index in indices]
+
+
+class StatikColumnarTable(object):
+    """The columnar data for a single model."""
+
+    def __init__(self, store, model):
+        self.store = store
+        self.model = model
+        self.db_model = store.db.tables[model.name]
+        table = self.db_model.__table__
+
+        column_names = ['pk'] + [
+            field_name for field_name in model.field_names
+            if getattr(model, field_name).field_type in COLUMNAR_FIELD_TYPES and
+            not isinstance(getattr(model, field_name), (StatikForeignKeyField, StatikManyToManyField))
+        ] + [
+            '%s_id' % field_name for field_name in model.field_names
+            if isinstance(getattr(model, field_name), StatikForeignKeyField)
+        ] + sorted(model.aggregates.keys()) + (TREE_COLUMNS if model.tree is not None else [])
+        rows = store.db.session.execute(select([table.c[column_name] for column_name in column_names])).fetchall()
+
+        self.pks = numpy.array([row[0] for row in rows], dtype=object)
+        # the row index of each primary key
+        self.positions = dict([(pk, i) for i, pk in enumerate(self.pks)])
+        # (values, nulls) arrays, indexed by column name
+        self.columns = {}
+        for i, column_name in enumerate(column_names[1:], start=1):
+            self.columns[column_name] = self.build_column(column_name, [row[i] for row in rows])
+
+        # the row index in the other table of each row's foreign key reference (or -1), per field
+        self.foreign_keys = {}
+        # (other table, offsets, row indices in the other table), per one-to-many/many-to-many relationship
+        self.collections = {}
+        # the row indices of a tree model's instances, in tree order
+        self.tree_rows = numpy.argsort(self.columns['tree_order'][0]) if model.tree is not None else None
+
+    def __len__(self):
+        return len(self.pks)
+
+    def get_field_type(self, column_name):
+        if column_name in self.model.aggregates:
+            return self.model.aggregates[column_name]['field_type']
+        if column_name in TREE_COLUMNS:
+            return 'Integer'
+        if column_name == 'tree_path':
+            return 'Text'
+        if column_name == 'pk' or (column_name.endswith('_id') and column_name not in self.model.field_names):
+            return 'String'
+        return getattr(self.model, column_name).field_type
+
+    def build_column(self, column_name, values):
+        field_type = self.get_field_type(column_name)
+        nulls = numpy.array([value is None for value in values], dtype=bool)
+        if field_type == 'Integer':
+            values = numpy.array([0 if value is None else value for value in values], dtype=numpy.int64)
+        elif field_type == 'Boolean':
+            values = numpy.array([bool(value) for value in values], dtype=bool)
+        elif field_type == 'DateTime':
+            values = numpy.array(values, dtype='datetime64[us]')
+        else:
+            values = numpy.array(values, dtype=object)
+        return values, nulls
+
+    def get_column(self, column_name):
+        """Returns the (values, nulls) arrays for the given column, loading it
+        from the database on first use if it isn't one of the columnar fields
+        (e.g. Content or Text fields)."""
+        if column_name == 'pk':
+            return self.pks, numpy.zeros(len(self), dtype=bool)
+        if column_name not in self.columns:
+            logger.debug("Loading column %s.%s into columnar store" % (self.model.name, column_name))
+            table = self.db_model.__table__
+            values = numpy.empty(len(self), dtype=object)
+            for pk, value in self.store.db.session.execute(select([table.c.pk, table.c[column_name]])):
+                values[self.positions[pk]] = value
+            self.columns[column_name] = values, numpy.array([value is None for value in values], dtype=bool)
+        return self.columns[column_name]
+
+    def coerce_value(self, column_name, value):
+        """Converts the given filter value to one comparable with the given
+        column's values."""
+        if self.get_field_type(column_name) == 'DateTime' and isinstance(value, (datetime, date)):
+            if isinstance(value, datetime) and value.tzinfo is not None:
+                value = value.replace(tzinfo=None)
+            return numpy.datetime64(value, 'us')
+        return value
+
+    def get_sort_key(self, column_name, indices, descending):
+        """Returns an integer array that sorts the given rows by the given
+        column the same way SQLite would: NULLs first in ascending order, and
+        last in descending order."""
+        values, nulls = self.get_column(column_name)
+        values, nulls = values[indices], nulls[indices]
+        if values.dtype == object:
+            values = values.copy()
+            values[nulls] = ''
+        ranks = numpy.unique(values, return_inverse=True)[1].reshape(-1).astype(numpy.int64)
+        ranks[nulls] = -1
+        return -ranks if descending else ranks
+
+    def load_relationships(self):
+        """Builds the index arrays for all of this model's relationships (to be
+        called once the tables for all models have been built)."""
+        tables = self.store.tables
+        for field_name in self.model.field_names:
+            field = getattr(self.model, field_name)
+            if isinstance(field, StatikForeignKeyField):
+                other = tables[field.field_type]
+                ids = self.columns['%s_id' % field_name][0]
+                self.foreign_keys[field_name] = (
+                    other,
+                    numpy.array([other.positions.get(other_pk, -1) for other_pk in ids], dtype=numpy.int64),
+                )
+            elif isinstance(field, StatikManyToManyField):
+                other = tables[field.field_type]
+                sources, targets = self.load_association(self.model.name, field.field_type, self, other)
+                self.collections[field_name] = build_adjacency(other, sources, targets, len(self))
+
+        for rel_name, rel in self.model.additional_rels.items():
+            other = tables[rel['to_model']]
+            if rel.get('secondary', None) is not None:
+                # the other side of a ManyToMany field
+                targets, sources = self.load_association(rel['secondary'][0], rel['secondary'][1], other, self)
+            else:
+                # the other side of a foreign key
+                ids = other.columns['%s_id' % rel['back_populates']][0]
+                targets = numpy.arange(len(other), dtype=numpy.int64)
+                sources = numpy.array([self.positions.get(pk, -1) for pk in ids], dtype=numpy.int64)
+                targets, sources = targets[sources >= 0], sources[sources >= 0]
+                if self.model.tree is not None and rel['to_model'] == self.model.name and \
+                        rel['back_populates'] == self.model.tree['parent']:
+                    # a tree node's children, which are kept in tree order
+                    order = numpy.argsort(self.columns['tree_order'][0][targets], kind='stable')
+                    targets, sources = targets[order], sources[order]
+            self.collections[rel_name] = build_adjacency(other, sources, targets, len(self))
+
+        for rel_name in self.model.related:
+            related_table = self.store.db.Base.metadata.tables[calculate_related_table_name(self.model.name, rel_name)]
+            pairs = self.store.db.session.execute(
+                select([related_table.c.source_pk, related_table.c.target_pk]).order_by(related_table.c.rank)
+            ).fetchall()
+            sources = numpy.array([self.positions[pk] for pk, _ in pairs], dtype=numpy.int64)
+            targets = numpy.array([self.positions[other_pk] for _, other_pk in pairs], dtype=numpy.int64)
+            self.collections[rel_name] = build_adjacency(self, sources, targets, len(self))
+
+    def load_association(self, model_name, other_model_name, table, other_table):
+        """Returns the row indices of the pairs of instances in the given
+        ManyToMany association, in their original order."""
+        association_table = self.store.db.Base.metadata.tables[
+            calculate_association_table_name(model_name, other_model_name)
+        ]
+        pairs = self.store.db.session.execute(select([
+            association_table.c['%s_pk' % model_name.lower()],
+            association_table.c['%s_pk' % other_model_name.lower()],
+        ])).fetchall()
+        return (
+            numpy.array([table.positions[pk] for pk, _ in pairs], dtype=numpy.int64),
+            numpy.array([other_table.positions[other_pk] for _, other_pk in pairs], dtype=numpy.int64),
+        )
+
+    def get_value(self, index, name):
+        """Returns the value of the given field (or relationship) for the row
+        at the given index."""
+        if name == 'pk':
+            return self.pks[index]
+        if name in self.foreign_keys:
+            other, other_indices = self.foreign_keys[name]
+            return StatikRow(other, int(other_indices[index])) if other_indices[index] >= 0 else None
+        if name in self.collections:
+            other, offsets, other_indices = self.collections[name]
+            return [StatikRow(other, int(i)) for i in other_indices[offsets[index]:offsets[index+1]]]
+        if name == 'tree_ancestors' and self.tree_rows is not None:
+            return self.get_tree_ancestors(index)
+        if name == 'tree_descendants' and self.tree_rows is not None:
+            return self.get_tree_descendants(index)
+        if name not in self.columns and name not in self.db_model.__table__.c:
+            raise AttributeError("%s has no field named \"%s\"" % (self.model.name, name))
+
+        values, nulls = self.get_column(name)
+        if nulls[index]:
+            return None
+        value = values[index]
+        return value.item() if isinstance(value, numpy.generic) else value
+
+    def get_tree_ancestors(self, index):
+        """Returns the ancestors of the tree model instance at the given index,
+        from the root down (as with StatikTreeMixin.tree_ancestors)."""
+        parents = self.foreign_keys[self.model.tree['parent']][1]
+        ancestors = []
+        index = parents[index]
+        while index >= 0:
+            ancestors.append(StatikRow(self, int(index)))
+            index = parents[index]
+        return list(reversed(ancestors))
+
+    def get_tree_descendants(self, index):
+        """Returns the descendants of the tree model instance at the given
+        index, in depth-first order (as with StatikTreeMixin.tree_descendants)."""
+        order, size = self.columns['tree_order'][0][index], self.columns['tree_size'][0][index]
+        return [StatikRow(self, int(i)) for i in self.tree_rows[order+1:order+1+size]]
+
+
+class StatikRow(object):
+    """A lightweight, read-only proxy for a single model instance in a
+    StatikColumnarStore, for use in templates in place of an ORM instance."""
+
+    __slots__ = ['_table', '_index']
+
+    def __init__(self, table, index):
+        self._table = table
+        self._index = index
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self._table.get_value(self._index, name)
+
+    def __eq__(self, other):
+        return isinstance(other, StatikRow) and self._table is other._table and self._index == other._index
+
+    def __hash__(self):
+        return hash((id(self._table), self._index))
+
+    def __repr__(self):
+        return '<StatikRow %s pk=%s>' % (self._table.model.name, self._table.pks[self._index])
+
+
+def build_adjacency(other, sources, targets, count):
+    """Builds a compressed sparse row representation of the given (source row
+    index, target row index) pairs, keeping each source's targets in their
+    original order."""
+    order = numpy.argsort(sources, kind='stable')
+    offsets = numpy.zeros(count + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(sources, minlength=count), out=offsets[1:])
+    return other, offsets, targets[order]
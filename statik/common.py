@@ -4,15 +4,89 @@ import os.path
 import yaml
 from markdown import Markdown
 
-from statik.markdownyaml import MarkdownYamlMetaExtension
+from statik.markdownyaml import MarkdownYamlMetaExtension, split_yaml_front_matter, read_yaml_front_matter, \
+    normalize_whitespace
 from statik.utils import *
 from statik.errors import *
 
 __all__ = [
     'YamlLoadable',
     'ContentLoadable',
+    'LazyMarkdownContent',
+    'MARKDOWN_EXTENSIONS',
+    'markdown_to_html',
 ]
 
+# the Markdown extensions used when converting Markdown content to HTML (in
+# addition to the YAML front matter extension, when parsing data files)
+MARKDOWN_EXTENSIONS = []
+
+# shared converter for content that is converted outside of ContentLoadable
+_markdown_converter = None
+
+
+def markdown_to_html(source):
+    """Converts the given Markdown source (without any YAML front matter) to
+    HTML."""
+    global _markdown_converter
+    if _markdown_converter is None:
+        _markdown_converter = Markdown(extensions=[ext() for ext in MARKDOWN_EXTENSIONS])
+    return _markdown_converter.reset().convert(source)
+
+
+class LazyMarkdownContent(object):
+    """Wraps raw Markdown content, only converting it to HTML the first time
+    it is used (e.g. when it is rendered in a template). The HTML is kept from
+    then on. Behaves like the HTML string for most purposes, and templates
+    only ever see the HTML string itself (see StatikEnvironment).
+    """
+
+    __slots__ = ('source', '_html')
+
+    def __init__(self, source):
+        self.source = source
+        self._html = None
+
+    @property
+    def html(self):
+        if self._html is None:
+            self._html = markdown_to_html(self.source)
+        return self._html
+
+    def __str__(self):
+        return self.html
+
+    def __html__(self):
+        return self.html
+
+    def __len__(self):
+        return len(self.html)
+
+    def __contains__(self, item):
+        return item in self.html
+
+    def __eq__(self, other):
+        return self.html == (other.html if isinstance(other, LazyMarkdownContent) else other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.html)
+
+    def __add__(self, other):
+        return self.html + other
+
+    def __radd__(self, other):
+        return other + self.html
+
+    def __getattr__(self, name):
+        # delegate all other string methods to the converted HTML
+        return getattr(self.html, name)
+
+    def __repr__(self):
+        return '<LazyMarkdownContent converted=%s>' % (self._html is not None)
+
 
 class YamlLoadable(object):
     """Base class for objects that can be loaded from a YAML file or a
@@ -38,11 +112,18 @@ class YamlLoadable(object):
 class ContentLoadable(object):
     """Can provide functionality like the YamlLoadable class, but also supports
     loading content and metadata from a Markdown file.
+
+    If the "convert_markdown" keyword argument is False, Markdown content is
+    not converted to HTML, and the raw Markdown body is kept as the content.
+    If the "load_content" keyword argument is False, only the YAML front matter
+    of a Markdown file is read, and the content is left empty.
     """
     def __init__(self, *args, **kwargs):
         self.vars = None
         self.content = None
         self.file_content = None
+        self.convert_markdown = kwargs.get('convert_markdown', True)
+        self.load_content = kwargs.get('load_content', True)
         self.file_type = kwargs.get('file_type', None)
         if self.file_type is not None:
             if self.file_type not in ['yaml', 'markdown']:
@@ -57,7 +138,11 @@ class ContentLoadable(object):
                 self.file_type = 'yaml' if (ext in ['yml', 'yaml']) else 'markdown'
 
             with open(self.filename, 'rt') as f:
-                self.file_content = f.read()
+                if self.file_type == 'markdown' and not self.load_content:
+                    # don't bother reading the body of the file at all
+                    self.vars = load_yaml_lines(read_yaml_front_matter(f))
+                else:
+                    self.file_content = f.read()
 
         elif 'from_string' in kwargs:
             self.filename = None
@@ -85,9 +170,21 @@ class ContentLoadable(object):
             # if it's a YAML file
             if self.file_type == 'yaml':
                 self.vars = yaml.load(self.file_content) if len(self.file_content) else {}
-            else:
+            elif not self.load_content:
+                self.vars = load_yaml_lines(read_yaml_front_matter(self.file_content.splitlines()))
+            elif self.convert_markdown:
                 md = Markdown(
-                    extensions=[MarkdownYamlMetaExtension()],
+                    extensions=[MarkdownYamlMetaExtension()] + [ext() for ext in MARKDOWN_EXTENSIONS],
                 )
                 self.content = md.convert(self.file_content)
                 self.vars = md.meta
+            else:
+                lines = self.file_content.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+                yaml_lines, body_lines = split_yaml_front_matter(lines)
+                self.vars = load_yaml_lines(normalize_whitespace(yaml_lines))
+                self.content = '\n'.join(body_lines)
+
+
+def load_yaml_lines(lines):
+    """Parses the given lines of YAML front matter into a dictionary."""
+    return (yaml.load('\n'.join(lines)) or {}) if len(lines) else {}
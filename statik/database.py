@@ -1,19 +1,34 @@
 # -*- coding:utf-8 -*-
 
 import os.path
+import csv
+import multiprocessing
+import functools
+import json
+import time
+import hashlib
+import zlib
 import yaml
+from collections import OrderedDict
 
-from sqlalchemy import String, Integer, Column, Table, ForeignKey, \
-    Boolean, DateTime, Text, create_engine
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy import String, Integer, Column, Table, ForeignKey, MetaData, Index, \
+    Boolean, DateTime, Text, LargeBinary, TypeDecorator, create_engine, event, select, bindparam, and_, or_, not_, \
+    func, inspect
+from sqlalchemy.orm import sessionmaker, relationship, configure_mappers, aliased, object_session, Query, \
+    deferred, class_mapper
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext import baked
+from sqlalchemy.sql.util import ClauseAdapter
 
-from statik.common import ContentLoadable
+from statik.common import ContentLoadable, LazyMarkdownContent, markdown_to_html
+from statik.cache import calculate_cache_signature
+from statik.query import StatikQuery, FILTER_OPERATORS
+from statik.columnar import StatikColumnarStore
 from statik.fields import *
 from statik.errors import *
 from statik.utils import *
 
-# utility imports for SQLAlchemy code execution
 from datetime import datetime, date, timedelta
 
 import logging
@@ -32,56 +47,493 @@ SQLALCHEMY_FIELD_MAPPER = {
     'Text': Text
 }
 
+# the Boolean values understood in CSV data (case-insensitively)
+BOOLEAN_TRUE_VALUES = {'true', 'yes', 'on', '1'}
+BOOLEAN_FALSE_VALUES = {'false', 'no', 'off', '0'}
+# separates the primary keys in ManyToMany field values in CSV data
+CSV_MANY_TO_MANY_SEPARATOR = ';'
+# the number of distinct parsed DateTime values kept per field while reading CSV/JSON data
+DATETIME_CACHE_SIZE = 4096
+
+
+class LazyMarkdownText(TypeDecorator):
+    """Column type for Content fields in lazy content mode: the raw Markdown
+    is stored, and is only converted to HTML once it is actually used."""
+
+    impl = Text
+
+    def process_bind_param(self, value, dialect):
+        return value.source if isinstance(value, LazyMarkdownContent) else value
+
+    def process_result_value(self, value, dialect):
+        return LazyMarkdownContent(value) if value is not None else None
+
+
+class CompressedText(TypeDecorator):
+    """Column type for Content and Text fields in compressed content mode:
+    values are stored zlib-compressed (if they're long enough to benefit from
+    it), and are decompressed when they're loaded. Such columns can't be
+    meaningfully compared or sorted in SQL."""
+
+    impl = LargeBinary
+
+    # values shorter than this (in bytes) are stored uncompressed
+    COMPRESSION_THRESHOLD = 256
+    UNCOMPRESSED = b'\x00'
+    COMPRESSED = b'\x01'
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        value = '%s' % (value.source if isinstance(value, LazyMarkdownContent) else value)
+        value = value.encode('utf-8')
+        if len(value) < CompressedText.COMPRESSION_THRESHOLD:
+            return CompressedText.UNCOMPRESSED + value
+        return CompressedText.COMPRESSED + zlib.compress(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        value = bytes(value)
+        if value[:1] == CompressedText.COMPRESSED:
+            return zlib.decompress(value[1:]).decode('utf-8')
+        return value[1:].decode('utf-8')
+
+
+class LazyMarkdownCompressedText(CompressedText):
+    """Column type for Content fields in both lazy and compressed content
+    mode."""
+
+    def process_result_value(self, value, dialect):
+        value = super().process_result_value(value, dialect)
+        return LazyMarkdownContent(value) if value is not None else None
+
+
+# utilities available to query strings, in addition to the model classes
+QUERY_UTILITIES = {
+    'datetime': datetime,
+    'date': date,
+    'timedelta': timedelta,
+    'and_': and_,
+    'or_': or_,
+    'not_': not_,
+    'func': func,
+}
+
+# keeps track of what's been loaded into a persistent database file
+STATE_METADATA = MetaData()
+STATE_TABLE = Table(
+    '_statik_state',
+    STATE_METADATA,
+    Column('key', String, primary_key=True),
+    Column('value', String),
+)
+
 
 class StatikDatabase(object):
 
-    def __init__(self, data_path, models):
+    # collection files, in order of preference
+    COLLECTION_FILES = ['_all.csv', '_all.jsonl', '_all.json', '_all.yml']
+    # the maximum number of primary keys per preload query
+    PRELOAD_CHUNK_SIZE = 500
+    # the default number of instances per batch when streaming query results
+    STREAM_BATCH_SIZE = 1000
+    # bulk loader batch and commit sizes, and the maximum number of data files
+    # parsed ahead of insertion, in low memory mode
+    LOW_MEMORY_BATCH_SIZE = 500
+    LOW_MEMORY_COMMIT_SIZE = 10000
+    LOW_MEMORY_PARSE_WINDOW = 200
+
+    def __init__(self, data_path, models, **kwargs):
         """Constructor.
 
         Args:
             data_path: The full path to where the database files can be found.
             models: Loaded model/field data.
+            jobs: The number of worker processes to use when parsing model
+                data files (default: 1, i.e. parse in the current process).
+            cache: An optional StatikCache instance in which to look up and
+                store parsed model data files.
+            lazy_content: If True, Markdown content is only converted to HTML
+                when it is first used, rather than when it is loaded.
+            db_path: If specified, the database is kept in this SQLite file
+                instead of in memory. On subsequent builds, only the data for
+                models whose data files have changed is reloaded.
+            low_memory: If True, the memory used while loading data is kept
+                to a minimum (smaller insert batches, a bounded number of
+                data files parsed ahead of insertion), at some cost to speed.
+            compress_content: If True, Content and Text values are stored
+                zlib-compressed in the database, and decompressed when used.
+            columnar: If True, a columnar copy of the loaded data is kept in
+                NumPy arrays, against which structured queries are executed
+                (their results are StatikRow proxies instead of ORM
+                instances). Requires NumPy.
         """
         self.tables = {}
         self.data_path = data_path
         self.models = models
-        self.engine = create_engine('sqlite:///:memory:')
+        self.jobs = kwargs.get('jobs', None) or 1
+        self.pool = None
+        self.loader = None
+        # the primary keys of the instances loaded so far, per model
+        self.pk_index = {}
+        # references to models that haven't been loaded yet, per referenced
+        # model: {model name: {pk: [(referring model name, pk, field name), ...]}}
+        self.unresolved_references = {}
+        # references to instances that don't exist
+        self.dangling_references = []
+        self.cache = kwargs.get('cache', None)
+        self.lazy_content = kwargs.get('lazy_content', False)
+        self.db_path = kwargs.get('db_path', None)
+        self.low_memory = kwargs.get('low_memory', False)
+        self.compress_content = kwargs.get('compress_content', False)
+        # the names of the models whose data was (re)loaded during this build
+        self.loaded_models = set()
+        # compiled code and results for query strings
+        self.compiled_queries = {}
+        self.query_results = {}
+        self.query_cache_hits = 0
+        self.query_cache_misses = 0
+        # compiled structured queries (see StatikQuery.execute), kept per
+        # database since they refer to this database's model classes
+        self.query_bakery = baked.bakery(size=1000)
+        self.schema_signature = self.calculate_schema_signature()
+        self.engine = self.create_engine()
         self.Base = declarative_base()
-        self.session = sessionmaker(bind=self.engine)()
-        globals()['session'] = self.session
+        self.Session = sessionmaker(bind=self.engine)
+        self.session = self.Session()
+        self.loader = StatikBulkLoader(
+            self.session,
+            batch_size=StatikDatabase.LOW_MEMORY_BATCH_SIZE,
+            commit_size=StatikDatabase.LOW_MEMORY_COMMIT_SIZE,
+        ) if self.low_memory else StatikBulkLoader(self.session)
         self.find_backrefs()
         self.create_db(models)
+        # the names available to query strings
+        self.query_namespace = self.build_query_namespace()
+        self.columnar = StatikColumnarStore(self) if kwargs.get('columnar', False) else None
+
+    def build_query_namespace(self):
+        """Builds the namespace in which query strings are executed: this
+        database's session, model classes and ManyToMany association tables,
+        along with some utilities."""
+        namespace = dict(QUERY_UTILITIES)
+        namespace.update(self.tables)
+        for model in self.models.values():
+            for association_table, _, _ in self.get_association_tables(model).values():
+                namespace[association_table.name] = association_table
+        namespace['session'] = self.session
+        return namespace
+
+    def calculate_schema_signature(self):
+        """Calculates a signature for everything that affects the structure
+        and content of the database, other than the data files themselves."""
+        return calculate_cache_signature(
+            'lazy_content=%s' % self.lazy_content,
+            'compress_content=%s' % self.compress_content,
+            *[
+                '%s=%s' % (model_name, json.dumps(self.models[model_name].vars, sort_keys=True, default=str))
+                for model_name in sorted(self.models.keys())
+            ]
+        )
+
+    def create_engine(self):
+        if self.db_path is None:
+            return create_engine('sqlite:///:memory:')
+
+        if os.path.isfile(self.db_path) and not self.is_reusable_db():
+            logger.info("Rebuilding database from scratch: %s" % self.db_path)
+            os.remove(self.db_path)
+
+        logger.debug("Using database file: %s" % self.db_path)
+        engine = create_engine('sqlite:///%s' % self.db_path)
+        event.listen(engine, 'connect', configure_bulk_write_pragmas)
+        STATE_METADATA.create_all(engine)
+        return engine
+
+    def is_reusable_db(self):
+        """Checks whether the existing database file was created with the same
+        models and configuration, and whether the build that last wrote to it
+        completed successfully."""
+        engine = create_engine('sqlite:///%s' % self.db_path)
+        try:
+            with engine.connect() as conn:
+                if not engine.dialect.has_table(conn, STATE_TABLE.name):
+                    return False
+                state = dict([
+                    (row[0], row[1]) for row in conn.execute(select([STATE_TABLE.c.key, STATE_TABLE.c.value]))
+                ])
+            return state.get('schema', None) == self.schema_signature and state.get('dirty', None) is None
+        finally:
+            engine.dispose()
+
+    def get_state(self, key):
+        return self.session.execute(
+            select([STATE_TABLE.c.value]).where(STATE_TABLE.c.key == key)
+        ).scalar()
+
+    def set_state(self, key, value):
+        self.session.execute(STATE_TABLE.delete().where(STATE_TABLE.c.key == key))
+        if value is not None:
+            self.session.execute(STATE_TABLE.insert(), {'key': key, 'value': value})
 
     def find_backrefs(self):
         for model_name, model in self.models.items():
             logger.debug('Attempting to find backrefs for model: %s' % model_name)
             model.find_additional_rels(self.models)
+        for model in self.models.values():
+            model.resolve_aggregates(self.models)
 
     def create_db(self, models):
         """Creates the in-memory SQLite database from the model
         configuration."""
         # first create the table definitions
         self.tables = dict([(model_name, self.create_model_table(model)) for model_name, model in models.items()])
+        # resolve the relationships between the models while they're all
+        # still referenced (mapper configuration is process-wide)
+        try:
+            configure_mappers()
+        except Exception:
+            # otherwise the broken mappers would stop any other database in
+            # this process from configuring its own
+            self.dispose_mappers()
+            raise
         # now create the tables in memory
         logger.debug("Creating %d database table(s)..." % len(self.tables))
         self.Base.metadata.create_all(self.engine)
         self.load_all_model_data(models)
 
+    def dispose_mappers(self):
+        """Disposes of the mappers of this database's model classes, so that
+        they're no longer considered when configuring mappers."""
+        for db_model in self.tables.values():
+            logger.debug("Disposing of mapper for model: %s" % db_model.__name__)
+            class_mapper(db_model, configure=False).dispose()
+        self.tables = {}
+
     def load_all_model_data(self, models):
+        if self.jobs > 1:
+            logger.debug("Parsing model data files using %d worker process(es)" % self.jobs)
+            with multiprocessing.Pool(processes=self.jobs) as pool:
+                self.pool = pool
+                try:
+                    self.load_all_model_data_in_order(models)
+                finally:
+                    self.pool = None
+        else:
+            self.load_all_model_data_in_order(models)
+
+    def load_all_model_data_in_order(self, models):
+        persistent = self.db_path is not None
+        if persistent:
+            # if we don't get to the end of loading, the database can't be reused
+            self.set_state('dirty', '1')
+            self.set_state('schema', self.schema_signature)
+            self.session.commit()
+        fingerprints = {}
+
         # we load the data now based on the sorted order of our tables, so
         # we can load our foreign key dependencies properly
         for table in self.Base.metadata.sorted_tables:
             model_name = table.name
             # we won't be loading data for many-to-many relationships
             if model_name in models:
-                logger.debug("Loading data for model: %s" % model_name)
                 model = models[model_name]
                 model_data_path = os.path.join(self.data_path, model_name)
+                if persistent:
+                    fingerprints[model_name] = calculate_data_fingerprint(model_data_path)
+                    if self.get_state('model:%s' % model_name) == fingerprints[model_name]:
+                        logger.debug("Data unchanged for model: %s" % model_name)
+                        self.pk_index[model_name] = set([
+                            row[0] for row in self.session.execute(select([table.c.pk]))
+                        ])
+                        continue
+                    self.clear_model_data(model)
+
+                logger.debug("Loading data for model: %s" % model_name)
+                self.loaded_models.add(model_name)
                 if os.path.isdir(model_data_path):
                     self.load_model_data(model_data_path, model)
+                else:
+                    self.pk_index[model_name] = set()
             else:
                 logger.debug("Skipping loading data models for table: %s" % model_name)
 
+        # only now can we check the references to models that were loaded later
+        self.validate_references()
+        for model_name in sorted(self.loaded_models):
+            if models[model_name].tree is not None:
+                self.calculate_tree(models[model_name])
+        for model_name in sorted(models.keys()):
+            # recalculated if either side of the relationship has been reloaded
+            aggregates = [
+                field_name for field_name, aggregate in models[model_name].aggregates.items()
+                if model_name in self.loaded_models or aggregate['to_model'] in self.loaded_models
+            ]
+            if len(aggregates) > 0:
+                self.calculate_aggregates(models[model_name], aggregates)
+            related = [
+                rel_name for rel_name, rel in models[model_name].related.items()
+                if model_name in self.loaded_models or
+                getattr(models[model_name], rel['via']).field_type in self.loaded_models
+            ]
+            if len(related) > 0:
+                self.calculate_related(models[model_name], related)
+        if self.low_memory:
+            # only needed while loading
+            self.pk_index = {}
+
+        if persistent:
+            for model_name, fingerprint in fingerprints.items():
+                self.set_state('model:%s' % model_name, fingerprint)
+            self.set_state('dirty', None)
+            self.session.commit()
+            logger.info("Reloaded data for %d of %d model(s)" % (len(self.loaded_models), len(models)))
+
+    def calculate_tree(self, model):
+        """Precomputes the tree columns (see StatikTreeMixin) for all of the
+        instances of the given tree model."""
+        table = self.tables[model.name].__table__
+        parent_column = '%s_id' % model.tree['parent']
+        order_columns = [column for column, _ in model.tree['order']]
+        children = OrderedDict()
+        # the ordering columns are labelled, so that any of them that are
+        # also selected for the tree itself (e.g. the primary key) are kept
+        rows = self.session.execute(select([table.c.pk, table.c[parent_column]] + [
+            table.c[column].label('order_%d' % i) for i, column in enumerate(order_columns)
+        ])).fetchall()
+        # sort by each of the ordering columns, least significant first
+        # (NULLs first, as in SQLite)
+        for i, (_, descending) in reversed(list(enumerate(model.tree['order']))):
+            rows.sort(key=lambda row: (row[2+i] is not None, row[2+i] if row[2+i] is not None else 0), reverse=descending)
+        for row in rows:
+            children.setdefault(row[1], []).append(row[0])
+
+        values = {}
+        # iterative depth-first traversal from the roots
+        stack = [(pk, []) for pk in reversed(children.get(None, []))]
+        while len(stack) > 0:
+            pk, ancestors = stack.pop()
+            path = ancestors + [pk]
+            values[pk] = {'_pk': pk, 'tree_path': json.dumps(path), 'tree_depth': len(ancestors),
+                          'tree_order': len(values), 'tree_size': 0}
+            for ancestor in ancestors:
+                values[ancestor]['tree_size'] += 1
+            stack.extend([(child, path) for child in reversed(children.get(pk, []))])
+
+        if len(values) < len(rows):
+            raise ValueError("The instances of tree model %s contain a cycle: %s" % (
+                model.name, ', '.join(sorted([str(row[0]) for row in rows if row[0] not in values]))
+            ))
+
+        self.session.execute(
+            table.update().where(table.c.pk == bindparam('_pk')).values(
+                tree_path=bindparam('tree_path'),
+                tree_depth=bindparam('tree_depth'),
+                tree_order=bindparam('tree_order'),
+                tree_size=bindparam('tree_size'),
+            ),
+            list(values.values())
+        )
+        self.session.commit()
+        logger.debug("Calculated tree for %d %s instance(s)" % (len(values), model.name))
+
+    def calculate_aggregates(self, model, field_names):
+        """Calculates the values of the given aggregate fields for all of the
+        instances of the given model, with one GROUP BY query per field."""
+        table = self.tables[model.name].__table__
+        for field_name in field_names:
+            aggregate = model.aggregates[field_name]
+            other_table = self.tables[aggregate['to_model']].__table__
+            if aggregate['secondary'] is not None:
+                association_table = self.Base.metadata.tables[
+                    calculate_association_table_name(*aggregate['secondary'])
+                ]
+                group_column = association_table.c['%s_pk' % model.name.lower()]
+                from_clause = association_table.join(
+                    other_table,
+                    association_table.c['%s_pk' % aggregate['to_model'].lower()] == other_table.c.pk,
+                )
+            else:
+                group_column = other_table.c['%s_id' % aggregate['back_populates']]
+                from_clause = other_table
+
+            self.check_structured_query(aggregate['query'])
+            value_column = other_table.c[aggregate['field'] or 'pk']
+            value = getattr(func, aggregate['function'])(value_column)
+            conditions = [group_column.isnot(None)]
+            for column, op, filter_value in aggregate['query'].filters:
+                if filter_value is None:
+                    conditions.append(
+                        other_table.c[column].is_(None) if op == '==' else other_table.c[column].isnot(None)
+                    )
+                else:
+                    conditions.append(FILTER_OPERATORS[op](other_table.c[column], filter_value))
+            for column, _, filter_values in aggregate['query'].in_filters:
+                conditions.append(other_table.c[column].in_(filter_values))
+
+            rows = self.session.execute(
+                select([group_column, value]).select_from(from_clause).where(and_(*conditions)).group_by(group_column)
+            ).fetchall()
+
+            # instances without any related instances have a count of 0 (and
+            # no value for the other functions)
+            self.session.execute(table.update().values({
+                field_name: 0 if aggregate['function'] == 'count' else None
+            }))
+            if len(rows) > 0:
+                self.session.execute(
+                    table.update().where(table.c.pk == bindparam('_pk')).values({field_name: bindparam('_value')}),
+                    [{'_pk': pk, '_value': row_value} for pk, row_value in rows]
+                )
+            self.session.commit()
+            logger.debug("Calculated aggregate %s.%s for %d instance(s)" % (model.name, field_name, len(rows)))
+
+    def calculate_related(self, model, rel_names):
+        """Calculates the given related content relationships for all of the
+        instances of the given model, each with a single self-join on the
+        association table of the ManyToMany field it's found through."""
+        association_tables = self.get_association_tables(model)
+        for rel_name in rel_names:
+            rel = model.related[rel_name]
+            association_table, column, other_column = association_tables[rel['via']]
+            related_table = self.Base.metadata.tables[calculate_related_table_name(model.name, rel_name)]
+            source, target = association_table.alias('source'), association_table.alias('target')
+            overlap = func.count().label('overlap')
+            rows = self.session.execute(
+                select([source.c[column], target.c[column], overlap]).select_from(
+                    source.join(target, and_(
+                        source.c[other_column] == target.c[other_column],
+                        source.c[column] != target.c[column],
+                    ))
+                ).group_by(source.c[column], target.c[column]).order_by(
+                    source.c[column], overlap.desc(), target.c[column]
+                )
+            )
+
+            values = []
+            rank, last_pk = 0, None
+            for pk, other_pk, count in rows:
+                rank = rank + 1 if pk == last_pk else 0
+                last_pk = pk
+                if rank < rel['limit']:
+                    values.append({'source_pk': pk, 'target_pk': other_pk, 'rank': rank, 'overlap': count})
+
+            self.session.execute(related_table.delete())
+            if len(values) > 0:
+                self.session.execute(related_table.insert(), values)
+            self.session.commit()
+            logger.debug("Calculated %d related %s.%s instance(s)" % (len(values), model.name, rel_name))
+
+    def clear_model_data(self, model):
+        """Removes all of the given model's data from the database, before it
+        is reloaded."""
+        self.set_state('model:%s' % model.name, None)
+        self.session.execute(self.tables[model.name].__table__.delete())
+        for association_table, _, _ in self.get_association_tables(model).values():
+            self.session.execute(association_table.delete())
+        self.session.commit()
+
     def create_model_table(self, model):
         """Creates the table for the given model.
 
@@ -92,106 +544,815 @@ class StatikDatabase(object):
             A SQLAlchemy model instance for the table corresponding to this
             particular model.
         """
-        return db_model_factory(self.Base, model, self.models)
+        return db_model_factory(
+            self.Base,
+            model,
+            self.models,
+            lazy_content=self.lazy_content,
+            compress_content=self.compress_content,
+        )
 
     def load_model_data(self, path, model):
         """Loads the data for the specified model from the given path.
         """
         if os.path.isdir(path):
             # try find a model data collection
-            if os.path.isfile(os.path.join(path, '_all.yml')):
-                self.load_model_data_collection(path, model)
+            collection_files = [
+                filename for filename in StatikDatabase.COLLECTION_FILES
+                if os.path.isfile(os.path.join(path, filename))
+            ]
+            if len(collection_files) > 0:
+                entries = self.read_model_data_collection(os.path.join(path, collection_files[0]), model)
             else:
-                self.load_model_data_from_files(path, model)
-            self.session.commit()
+                entries = self.read_model_data_files(path, model)
+            self.insert_model_instances(model, entries)
 
-    def load_model_data_collection(self, path, model):
-        db_model = globals()[model.name]
-        # load the collection data from the collection file
-        with open(os.path.join(path, '_all.yml'), 'rt') as f:
-            collection = yaml.load(f.read())
+    def read_model_data_collection(self, filename, model):
+        """Reads the instances for the given model from the given collection
+        file. Instances are yielded as they are parsed, so the collection is
+        never held in memory in its entirety.
+        """
+        collection_file = os.path.basename(filename)
+        logger.debug("Loading instances for model %s from collection: %s" % (model.name, filename))
+        if filename.endswith('.csv'):
+            yield from self.read_csv_model_data_collection(filename, model)
+            return
 
-        if not isinstance(collection, list):
-            raise InvalidModelCollectionDataError("Model %s collection _all.yml file must be a list of instances" % (
-                model.name
-            ))
-        seen_entries = set()
-        logger.debug("Loading %d instance(s) for model: %s" % (len(collection), model.name))
-        for item in collection:
+        for item in self.iter_collection_items(filename, model):
             if not isinstance(item, dict) or 'pk' not in item:
-                raise InvalidModelCollectionDataError("Model %s collection _all.yml contains invalid item(s)" % (
-                    model.name
+                raise InvalidModelCollectionDataError("Model %s collection %s contains invalid item(s)" % (
+                    model.name, collection_file
                 ))
 
-            entry = StatikDatabaseInstance(
+            content = None
+            if model.content_field is not None:
+                content = item.pop(model.content_field, None)
+                content = item.pop(model.content_field.replace('-', '_'), content)
+                # as with CSV collections, lazily converted content is kept as Markdown
+                if isinstance(content, str) and not self.lazy_content:
+                    content = markdown_to_html(content)
+
+            yield StatikDatabaseInstance(
                 name=item['pk'],
                 from_dict=item,
+                content=content,
                 model=model,
-                session=self.session,
+                source=filename,
             )
-            # duplicate primary key!
-            if entry.field_values['pk'] in seen_entries:
-                raise DuplicateModelInstanceError("More than one entry with the name \"%s\" exists for model %s" % (
-                    entry.field_values['pk'], model.name
+
+    def iter_collection_items(self, filename, model):
+        """Iterates through the items in the given collection file, parsing
+        them one at a time. Supported formats are JSON Lines (_all.jsonl, one
+        instance per line), JSON (_all.json, a single list of instances) and
+        YAML (_all.yml), which can either be a single list of instances or a
+        stream of documents, one instance per document. (CSV collections are
+        read by read_csv_model_data_collection.)
+
+        JSON values are converted according to the model's field types (see
+        get_field_coercers), to the same values as YAML would produce.
+        """
+        collection_file = os.path.basename(filename)
+        try:
+            with open(filename, 'rt') as f:
+                if filename.endswith('.jsonl') or filename.endswith('.json'):
+                    coercers = get_field_coercers(model)
+                    if filename.endswith('.json'):
+                        items = json.load(f)
+                        if not isinstance(items, list):
+                            raise InvalidModelCollectionDataError("Model %s collection %s must be a list of instances" % (
+                                model.name, collection_file
+                            ))
+                    else:
+                        items = (json.loads(line) for line in f if len(line.strip()) > 0)
+                    for item in items:
+                        yield coerce_field_values(item, coercers)
+                else:
+                    yield from self.iter_yaml_collection_items(f, model, collection_file)
+        except InvalidModelCollectionDataError:
+            raise
+        except ValueError as e:
+            raise InvalidModelCollectionDataError("Model %s collection %s contains an invalid value: %s" % (
+                model.name, collection_file, e
+            ))
+
+    def read_csv_model_data_collection(self, filename, model):
+        """Reads the instances for the given model from the given CSV
+        collection file, which must have a header row of field names (and a
+        "pk" column). Empty cells are treated as missing values.
+
+        This is the bulk loading path: the column and value conversion for each
+        of the header's fields is resolved once for the whole file, and each
+        row is converted straight to a database instance.
+        """
+        collection_file = os.path.basename(filename)
+        # (lazily converted content is kept as Markdown)
+        coercers = get_field_coercers(model, from_strings=True, convert_markdown=not self.lazy_content)
+        with open(filename, 'rt', newline='') as f:
+            reader = csv.reader(f)
+            header = next(reader, None) or []
+            if 'pk' not in header:
+                raise InvalidModelCollectionDataError("Model %s collection %s must have a \"pk\" column" % (
+                    model.name, collection_file
                 ))
-            else:
-                seen_entries.add(entry.field_values['pk'])
+            # (column name, coercer, whether it's a ManyToMany field) for each of the header's fields
+            columns = []
+            for key in header:
+                field_name = key.replace('-', '_')
+                field = getattr(model, field_name) if field_name in model.field_names else None
+                columns.append((
+                    ('%s_id' % field_name) if isinstance(field, StatikForeignKeyField) else field_name,
+                    coercers.get(field_name, None),
+                    isinstance(field, StatikManyToManyField),
+                ))
+
+            for row in reader:
+                if len(row) == 0:
+                    continue
+                if len(row) != len(header):
+                    raise InvalidModelCollectionDataError(
+                        "Model %s collection %s has %d value(s) on line %d, but %d column(s) in its header" % (
+                            model.name, collection_file, len(row), reader.line_num, len(header)
+                        )
+                    )
+                field_values, many_to_many_values = {}, {}
+                try:
+                    for (column, coercer, many_to_many), value in zip(columns, row):
+                        if len(value) > 0:
+                            if coercer is not None:
+                                value = coercer(value)
+                            if many_to_many:
+                                many_to_many_values[column] = value
+                            else:
+                                field_values[column] = value
+                except ValueError as e:
+                    raise InvalidModelCollectionDataError("Model %s collection %s contains an invalid value on line "
+                                                          "%d: %s" % (model.name, collection_file, reader.line_num, e))
+                if 'pk' not in field_values:
+                    raise InvalidModelCollectionDataError("Model %s collection %s is missing a \"pk\" value on line %d" % (
+                        model.name, collection_file, reader.line_num
+                    ))
+                yield StatikDatabaseInstance.from_values(model, field_values, many_to_many_values, source=filename)
 
-            db_entry = db_model(**entry.field_values)
-            self.session.add(db_entry)
+    def iter_yaml_collection_items(self, f, model, collection_file):
+        for doc in yaml.load_all(f):
+            if isinstance(doc, list):
+                yield from doc
+            elif isinstance(doc, dict):
+                yield doc
+            elif doc is not None:
+                raise InvalidModelCollectionDataError(
+                    "Model %s collection %s must be a list of instances or a stream of instance documents" % (
+                        model.name, collection_file
+                    )
+                )
 
-    def load_model_data_from_files(self, path, model):
-        db_model = globals()[model.name]
-        entry_files = list_files(path, ['yml', 'yaml', 'md'])
-        seen_entries = set()
+    def read_model_data_files(self, path, model):
+        """Reads the instances for the given model from the individual data
+        files in the given path."""
+        entry_files = [os.path.join(path, entry_file) for entry_file in list_files(path, ['yml', 'yaml', 'md'])]
         logger.debug("Loading %d instance(s) for model: %s" % (len(entry_files), model.name))
-        for entry_file in entry_files:
-            entry = StatikDatabaseInstance(
-                os.path.join(path, entry_file),
+        # we only need to read the bodies of Markdown files if the model's got a Content field
+        load_content = model.content_field is not None
+        # parsing happens in the worker pool (if any), but rows are always
+        # inserted in the parent process
+        parsed_files = zip(entry_files, self.parse_data_files(entry_files, load_content=load_content))
+        for entry_file, (entry_name, entry_vars, entry_content) in parsed_files:
+            yield StatikDatabaseInstance(
+                name=entry_name,
+                from_dict=entry_vars,
+                content=entry_content,
                 model=model,
-                session=self.session,
+                source=entry_file,
             )
+
+    def insert_model_instances(self, model, entries):
+        """Bulk inserts the given database instances (and their ManyToMany
+        associations) for the specified model."""
+        table = self.tables[model.name].__table__
+        columns = [column.key for column in table.columns]
+        # the columns that can be given values in data files (as opposed to calculated ones)
+        data_columns = set(['pk'] + [
+            ('%s_id' % field_name) if isinstance(getattr(model, field_name), StatikForeignKeyField) else field_name
+            for field_name in model.field_names
+            if not isinstance(getattr(model, field_name), StatikManyToManyField)
+        ])
+        foreign_keys = self.get_foreign_keys(model)
+        association_tables = self.get_association_tables(model)
+        seen_entries = set()
+        rows_before = self.loader.rows_added
+        started = time.time()
+
+        for entry in entries:
+            pk = entry.field_values['pk']
             # duplicate primary key!
-            if entry.field_values['pk'] in seen_entries:
+            if str(pk) in seen_entries:
                 raise DuplicateModelInstanceError("More than one entry with the name \"%s\" exists for model %s" % (
-                    entry.field_values['pk'], model.name
+                    pk, model.name
                 ))
-            else:
-                seen_entries.add(entry.field_values['pk'])
-
-            db_entry = db_model(**entry.field_values)
-            self.session.add(db_entry)
-
-    def query(self, query):
-        """Executes the given SQLAlchemy query string."""
-        logger.debug("Attempting to execute database query: %s" % query)
-        exec(
-            compile(
-                'result = %s' % query.strip(),
-                '<string>',
-                'exec'
-            ),
-            globals(),
-            locals()
+            seen_entries.add(str(pk))
+            if not data_columns.issuperset(entry.field_values):
+                raise UnknownFieldError("Unknown field(s) %s for model %s in: %s" % (
+                    ', '.join(sorted(set(entry.field_values) - data_columns)), model.name, entry.source,
+                ))
+
+            for field_name, column, other_model_name in foreign_keys:
+                other_pk = entry.field_values.get(column, None)
+                if other_pk is not None:
+                    self.check_reference(model.name, pk, field_name, other_model_name, other_pk)
+
+            self.loader.add(table, dict([(column, entry.field_values.get(column, None)) for column in columns]))
+            for field_name, other_pks in entry.many_to_many_values.items():
+                association_table, own_column, other_column = association_tables[field_name]
+                other_model_name = getattr(model, field_name).field_type
+                for other_pk in other_pks:
+                    self.check_reference(model.name, pk, field_name, other_model_name, other_pk)
+                    self.loader.add(association_table, {own_column: pk, other_column: other_pk})
+
+        self.loader.flush()
+        self.loader.commit()
+        self.pk_index[model.name] = seen_entries
+
+        elapsed = time.time() - started
+        rows = self.loader.rows_added - rows_before
+        logger.info("Loaded %d instance(s) for model %s in %.2fs (%d row(s), %.0f rows/sec)" % (
+            len(seen_entries), model.name, elapsed, rows, (rows / elapsed) if elapsed > 0 else 0
+        ))
+
+    def check_reference(self, model_name, pk, field_name, other_model_name, other_pk):
+        """Checks the given reference against the primary key index of the
+        referenced model. If that model hasn't been loaded yet, the check is
+        deferred until all of the data has been loaded."""
+        other_pk = str(other_pk)
+        if other_model_name in self.pk_index:
+            if other_pk not in self.pk_index[other_model_name]:
+                self.dangling_references.append((model_name, pk, field_name, other_model_name, other_pk))
+        else:
+            self.unresolved_references.setdefault(other_model_name, {}).setdefault(other_pk, []).append(
+                (model_name, pk, field_name)
+            )
+
+    def validate_references(self):
+        """Reports all of the references to missing instances in one go."""
+        # data that wasn't reloaded may still refer to instances that have since been removed
+        for model_name, model in self.models.items():
+            if model_name not in self.loaded_models:
+                self.find_dangling_references_in_db(model)
+
+        for other_model_name, references in self.unresolved_references.items():
+            other_pks = self.pk_index.get(other_model_name, set())
+            for other_pk, referrers in references.items():
+                if other_pk not in other_pks:
+                    for model_name, pk, field_name in referrers:
+                        self.dangling_references.append((model_name, pk, field_name, other_model_name, other_pk))
+        self.unresolved_references = {}
+
+        if len(self.dangling_references) > 0:
+            dangling_references, self.dangling_references = self.dangling_references, []
+            lines = ["Found %d reference(s) to missing model instances:" % len(dangling_references)]
+            for model_name, pk, field_name, other_model_name, other_pk in dangling_references[:50]:
+                lines.append("  %s \"%s\" (field \"%s\") -> %s \"%s\"" % (
+                    model_name, pk, field_name, other_model_name, other_pk
+                ))
+            if len(dangling_references) > 50:
+                lines.append("  ... and %d more" % (len(dangling_references) - 50))
+            raise DanglingReferenceError(dangling_references, '\n'.join(lines))
+
+    def find_dangling_references_in_db(self, model):
+        """Looks for references from the given model's existing rows to
+        instances of models that have been reloaded during this build."""
+        table = self.tables[model.name].__table__
+        for field_name, column, other_model_name in self.get_foreign_keys(model):
+            if other_model_name in self.loaded_models:
+                other_table = self.tables[other_model_name].__table__
+                for pk, other_pk in self.session.execute(
+                        select([table.c.pk, table.c[column]]).where(and_(
+                            table.c[column].isnot(None),
+                            ~table.c[column].in_(select([other_table.c.pk]))
+                        ))):
+                    self.dangling_references.append((model.name, pk, field_name, other_model_name, other_pk))
+
+        for field_name, (association_table, own_column, other_column) in self.get_association_tables(model).items():
+            other_model_name = getattr(model, field_name).field_type
+            if other_model_name in self.loaded_models:
+                other_table = self.tables[other_model_name].__table__
+                for pk, other_pk in self.session.execute(
+                        select([association_table.c[own_column], association_table.c[other_column]]).where(
+                            ~association_table.c[other_column].in_(select([other_table.c.pk]))
+                        )):
+                    self.dangling_references.append((model.name, pk, field_name, other_model_name, other_pk))
+
+    def get_foreign_keys(self, model):
+        """Returns a list of (field name, column name, referenced model name)
+        tuples for the given model's ForeignKey fields."""
+        return [
+            (field_name, '%s_id' % field_name, getattr(model, field_name).field_type)
+            for field_name in model.field_names
+            if isinstance(getattr(model, field_name), StatikForeignKeyField)
+        ]
+
+    def get_association_tables(self, model):
+        """Returns the association tables for the given model's ManyToMany
+        fields.
+
+        Returns:
+            A dictionary mapping each ManyToMany field name to a tuple
+            containing the association table, the name of the column referring
+            to this model and the name of the column referring to the other
+            model.
+        """
+        result = {}
+        for field_name in model.field_names:
+            field = getattr(model, field_name)
+            if isinstance(field, StatikManyToManyField):
+                result[field_name] = (
+                    self.Base.metadata.tables[calculate_association_table_name(model.name, field.field_type)],
+                    '%s_pk' % model.name.lower(),
+                    '%s_pk' % field.field_type.lower(),
+                )
+        return result
+
+    def parse_data_files(self, filenames, load_content=True):
+        """Parses the given data files, either in the current process or
+        across the worker pool. Results are yielded in the same order as the
+        given filenames.
+        """
+        parse_fn = functools.partial(
+            parse_data_file,
+            cache=self.cache,
+            convert_markdown=not self.lazy_content,
+            load_content=load_content,
         )
-        return locals()['result']
+        if self.pool is None:
+            return map(parse_fn, filenames)
 
+        if self.low_memory:
+            return self.parse_data_files_in_windows(parse_fn, filenames)
 
-class StatikDatabaseInstance(ContentLoadable):
+        return self.pool.imap(
+            parse_fn,
+            filenames,
+            chunksize=max(1, len(filenames) // (self.jobs * 4)),
+        )
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        if 'model' not in kwargs:
-            raise MissingParameterError("Missing parameter \"model\" for database instance constructor")
-        self.model = kwargs['model']
+    def parse_data_files_in_windows(self, parse_fn, filenames):
+        """Parses the given data files across the worker pool, a window at a
+        time, so that the workers never get too far ahead of insertion (the
+        results of imap are otherwise buffered without limit)."""
+        window = StatikDatabase.LOW_MEMORY_PARSE_WINDOW
+        for i in range(0, len(filenames), window):
+            yield from self.pool.imap(
+                parse_fn,
+                filenames[i:i+window],
+                chunksize=max(1, min(window, len(filenames) - i) // (self.jobs * 4)),
+            )
+
+    def query(self, query, cache_result=True):
+        """Executes the given SQLAlchemy query string or structured query.
+
+        The compiled code for each query string is kept, and so is its result:
+        the database is read-only once it's been loaded, so the same query
+        always produces the same result during a build.
+
+        Args:
+            query: The query string or StatikQuery to execute.
+            cache_result: Whether to look up/store the result in the result
+                cache (default: True).
+        """
+        if not isinstance(query, StatikQuery):
+            query = query.strip()
+        if cache_result and query in self.query_results:
+            logger.debug("Using cached result for database query: %s" % (query, ))
+            self.query_cache_hits += 1
+            return self.query_results[query]
+
+        logger.debug("Attempting to execute database query: %s" % (query, ))
+        self.query_cache_misses += 1
+        if isinstance(query, StatikQuery):
+            if self.columnar is not None:
+                result = self.columnar.execute(query)
+            else:
+                self.check_structured_query(query)
+                result = query.execute(self)
+        else:
+            result = self.execute_query_string(query, self.query_namespace)
+
+        if cache_result:
+            self.query_results[query] = result
+        return result
+
+    def check_structured_query(self, query):
+        """Raises a ValueError if the given structured query filters or orders
+        by (and therefore also paginates by) a compressed column, since the
+        compressed values can't be meaningfully compared in SQL."""
+        if not self.compress_content:
+            return
+        table = self.tables[query.model_name].__table__
+        for column in query.compared_columns:
+            if column in table.c and isinstance(table.c[column].type, CompressedText):
+                raise ValueError(
+                    "Compressed fields cannot be used to filter or order structured queries (%s.%s)" % (
+                        query.model_name, column
+                    )
+                )
+
+    def execute_query_string(self, query, namespace):
+        code = self.compiled_queries.get(query, None)
+        if code is None:
+            code = self.compiled_queries[query] = compile('result = %s' % query, '<string>', 'exec')
+
+        scope = {}
+        exec(code, namespace, scope)
+        return scope['result']
+
+    def paginate(self, query, page_size):
+        """Executes the given structured query page by page, using keyset
+        pagination (see StatikQuery.build_page), so that the cost of finding
+        each page doesn't depend on how many pages come before it. Results are
+        never cached.
+
+        Args:
+            query: The StatikQuery to execute.
+            page_size: The number of instances per page.
+
+        Returns:
+            A tuple containing the total number of results, and a generator of
+            the results' pages (lists of instances).
+        """
+        if self.columnar is not None:
+            results = self.columnar.execute(query)
+            return len(results), (results[i:i+page_size] for i in range(0, len(results), page_size))
+        self.check_structured_query(query)
+        return query.count(self), self.iter_pages(query, page_size)
+
+    def iter_pages(self, query, page_size):
+        db_model = self.tables[query.model_name]
+        after = None
+        while True:
+            page = query.build_page(self.session, db_model, page_size, after=after).all()
+            if len(page) == 0:
+                return
+            yield page
+            if len(page) < page_size:
+                return
+            after = query.get_keyset(page[-1])
+
+    def stream(self, query, batch_size=None):
+        """Executes the given query string or structured query, yielding its
+        results in batches instead of all at once. Results are never cached.
+
+        The query runs in its own session, from which each batch's instances
+        (and anything lazily loaded through them) are removed as soon as the
+        next batch is requested, so only about one batch is kept in memory at
+        a time. For the results to actually be fetched in batches, query
+        strings must evaluate to a query object (i.e. without calling .all()
+        on it).
+
+        Args:
+            query: The query string or StatikQuery to execute.
+            batch_size: The number of instances per batch (default:
+                STREAM_BATCH_SIZE).
+        """
+        batch_size = batch_size or StatikDatabase.STREAM_BATCH_SIZE
+        session = self.Session()
+        try:
+            if isinstance(query, StatikQuery):
+                self.check_structured_query(query)
+                results = query.build(session, self.tables[query.model_name]).params(**query.bound_params)
+            else:
+                logger.debug("Attempting to stream database query: %s" % query)
+                results = self.execute_query_string(
+                    query.strip(),
+                    dict(self.query_namespace, session=session),
+                )
+            if isinstance(results, Query):
+                results = results.yield_per(batch_size)
+
+            batch = []
+            for inst in results:
+                batch.append(inst)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+                    session.expunge_all()
+            if len(batch) > 0:
+                yield batch
+        finally:
+            session.close()
+
+    def preload(self, instances, relationships=None, fields=None):
+        """Eagerly loads the given relationships and deferred fields for all
+        of the given model instances at once, so that accessing them from
+        templates doesn't result in a query per instance.
+
+        Args:
+            instances: A model instance, or a list of model instances (e.g.
+                the result of a query). Other iterable query results (e.g.
+                Query objects) are first turned into lists, and anything
+                else is ignored.
+            relationships: A list of relationship names (or dot-separated
+                paths of relationship names, e.g. "tags.posts") to load.
+            fields: A list of the names of deferred fields to load.
+
+        Returns:
+            The given instances, or the list they were turned into.
+        """
+        relationships = relationships or []
+        fields = fields or []
+        if len(relationships) == 0 and len(fields) == 0:
+            return instances
+        if isinstance(instances, self.Base):
+            return self.preload([instances], relationships=relationships, fields=fields)[0]
+        if isinstance(instances, (str, bytes, dict)) or not hasattr(instances, '__iter__'):
+            logger.debug("Not preloading relationships for non-list query result: %s" % (instances, ))
+            return instances
+        if not isinstance(instances, (list, tuple)):
+            instances = list(instances)
+
+        session = None
+        instances_by_model = OrderedDict()
+        for inst in instances:
+            if isinstance(inst, self.Base):
+                instances_by_model.setdefault(type(inst), OrderedDict())[inst.pk] = inst
+                # the instances may belong to a streaming session
+                session = session or object_session(inst)
+        session = session or self.session
+
+        for db_model, model_instances in instances_by_model.items():
+            columns = []
+            for field_name in fields:
+                attr = getattr(db_model, field_name.replace('-', '_'), None)
+                if attr is None or not hasattr(attr.property, 'columns'):
+                    raise ValueError("%s has no field named \"%s\"" % (db_model.__name__, field_name))
+                columns.append(attr)
+            logger.debug("Preloading %s for %d %s instance(s)" % (
+                ', '.join(list(relationships) + fields), len(model_instances), db_model.__name__,
+            ))
+
+            if len(columns) > 0:
+                self.preload_columns(session, db_model, model_instances, columns)
+            # the instances reached through each (partial) relationship path
+            # loaded so far, e.g. "tags" when loading "tags.posts"
+            loaded = {}
+            for path in relationships:
+                path_model, path_instances = db_model, model_instances
+                rel_names = [rel_name.replace('-', '_') for rel_name in path.split('.')]
+                for i, rel_name in enumerate(rel_names):
+                    partial_path = '.'.join(rel_names[:i+1])
+                    if partial_path not in loaded:
+                        loaded[partial_path] = self.preload_relationship(
+                            session, path_model, path_instances, rel_name,
+                        )
+                    path_model = getattr(path_model, rel_name).property.mapper.class_
+                    path_instances = loaded[partial_path]
+        return instances
+
+    def preload_columns(self, session, db_model, instances, columns):
+        """Loads the given (deferred) columns of the given instances, indexed
+        by primary key, without selecting any of their other columns."""
+        pks = list(instances.keys())
+        for i in range(0, len(pks), StatikDatabase.PRELOAD_CHUNK_SIZE):
+            rows = session.query(db_model.pk, *columns).filter(
+                db_model.pk.in_(pks[i:i+StatikDatabase.PRELOAD_CHUNK_SIZE])
+            )
+            for row in rows:
+                for column, value in zip(columns, row[1:]):
+                    set_committed_value(instances[row[0]], column.key, value)
+
+    def preload_relationship(self, session, db_model, instances, rel_name):
+        """Loads the given relationship of the given instances, indexed by
+        primary key, with a single query (per PRELOAD_CHUNK_SIZE instances)
+        that only selects their primary keys and the related instances.
+
+        Returns:
+            The related instances, indexed by primary key.
+        """
+        attr = getattr(db_model, rel_name, None)
+        if attr is None or not hasattr(attr.property, 'mapper'):
+            raise ValueError("%s has no relationship named \"%s\"" % (db_model.__name__, rel_name))
+
+        # the instances' side is aliased, in case the relationship refers to
+        # the same model, so that the relationship's own ordering (e.g. tree
+        # nodes' children or related content's rank) applies as it is
+        source_model = aliased(db_model)
+        related_model = attr.property.mapper.class_
+        order_by = [source_model.pk] + list(attr.property.order_by or [])
+        if attr.property.secondary is None:
+            joins = [(related_model, getattr(source_model, rel_name))]
+        else:
+            # joining through the relationship itself would alias its
+            # secondary table too, which its ordering may refer to
+            joins = [
+                (
+                    attr.property.secondary,
+                    ClauseAdapter(inspect(source_model).selectable).traverse(attr.property.primaryjoin),
+                ),
+                (related_model, attr.property.secondaryjoin),
+            ]
+        values = dict([(pk, []) for pk in instances.keys()])
+        related = OrderedDict()
+        pks = list(instances.keys())
+        for i in range(0, len(pks), StatikDatabase.PRELOAD_CHUNK_SIZE):
+            rows = session.query(source_model.pk, related_model).join(*joins).filter(
+                source_model.pk.in_(pks[i:i+StatikDatabase.PRELOAD_CHUNK_SIZE])
+            ).order_by(*order_by)
+            for pk, related_inst in rows:
+                values[pk].append(related_inst)
+                related[related_inst.pk] = related_inst
+
+        for pk, inst in instances.items():
+            if attr.property.uselist:
+                set_committed_value(inst, rel_name, values[pk])
+            else:
+                set_committed_value(inst, rel_name, values[pk][0] if len(values[pk]) > 0 else None)
+        return related
+
+    def log_query_stats(self):
+        logger.info("Executed %d database quer%s (%d served from the result cache)" % (
+            self.query_cache_misses,
+            'y' if self.query_cache_misses == 1 else 'ies',
+            self.query_cache_hits,
+        ))
+
+
+def configure_bulk_write_pragmas(dbapi_connection, connection_record):
+    """Tunes SQLite database files for bulk writes. Durability doesn't
+    matter here, since the database can always be rebuilt from the data
+    files."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=OFF')
+    cursor.execute('PRAGMA synchronous=OFF')
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    # in KiB
+    cursor.execute('PRAGMA cache_size=-262144')
+    cursor.close()
+
+
+def calculate_data_fingerprint(path):
+    """Calculates a fingerprint for the data files in the given model data
+    folder, from their names, sizes and modification times."""
+    if not os.path.isdir(path):
+        return 'missing'
+
+    entries = sorted([
+        (entry.name, entry.stat().st_mtime_ns, entry.stat().st_size)
+        for entry in os.scandir(path) if entry.is_file()
+    ])
+    return hashlib.sha1(repr(entries).encode('utf-8')).hexdigest()
+
+
+def parse_data_file(filename, cache=None, convert_markdown=True, load_content=True):
+    """Parses a single YAML or Markdown model data file.
+
+    This is executed in worker processes when loading data in parallel, so it
+    only returns plain, picklable values.
+
+    Args:
+        filename: The full path to the data file to parse.
+        cache: An optional StatikCache instance. If the file hasn't changed
+            since it was last cached, its cached result will be returned.
+        convert_markdown: If False, the raw Markdown body is returned as the
+            content instead of its HTML.
+        load_content: If False, only the front matter of Markdown files is
+            read, and no content is returned.
+
+    Returns:
+        A (name, vars, content) tuple for the instance.
+    """
+    cache_variant = None if load_content else 'front-matter'
+    if cache is not None:
+        result = cache.get(filename, variant=cache_variant)
+        if result is not None:
+            return result
+
+    loadable = ContentLoadable(filename, convert_markdown=convert_markdown, load_content=load_content)
+    result = loadable.name, loadable.vars, loadable.content
+
+    if cache is not None:
+        cache.put(filename, result, variant=cache_variant)
+    return result
+
+
+def parse_boolean(value):
+    """Parses the given Boolean value from CSV data."""
+    value = value.strip().lower()
+    if value in BOOLEAN_TRUE_VALUES:
+        return True
+    if value in BOOLEAN_FALSE_VALUES:
+        return False
+    raise ValueError("Invalid Boolean value: %s" % value)
+
+
+def parse_many_to_many(value):
+    """Parses the given ManyToMany field value from CSV data: the primary keys
+    of the related instances, separated by CSV_MANY_TO_MANY_SEPARATOR."""
+    # ignoring any duplicate references
+    return list(OrderedDict.fromkeys([
+        pk.strip() for pk in value.split(CSV_MANY_TO_MANY_SEPARATOR) if len(pk.strip()) > 0
+    ]))
+
+
+def get_field_coercers(model, from_strings=False, convert_markdown=True):
+    """Returns the functions that convert the given model's field values, as
+    parsed from JSON data, to the values YAML would have produced, indexed by
+    field name. JSON has no date/time type, so DateTime field values come
+    through as ISO 8601 strings. If from_strings is set, the values are from
+    CSV data, where every value is a string, and so Integer, Boolean and
+    ManyToMany field values need to be converted too, as well as Content field
+    values (from Markdown to HTML) if convert_markdown is set."""
+    coercers = {}
+    for field_name in model.field_names:
+        field = getattr(model, field_name)
+        if isinstance(field, StatikDateTimeField):
+            # exports tend to repeat the same dates many times over
+            coercers[field_name] = functools.lru_cache(maxsize=DATETIME_CACHE_SIZE)(parse_iso_datetime)
+        elif not from_strings:
+            continue
+        elif isinstance(field, StatikIntegerField):
+            coercers[field_name] = int
+        elif isinstance(field, StatikBooleanField):
+            coercers[field_name] = parse_boolean
+        elif isinstance(field, StatikManyToManyField):
+            coercers[field_name] = parse_many_to_many
+        elif isinstance(field, StatikContentField) and convert_markdown:
+            coercers[field_name] = markdown_to_html
+    return coercers
+
+
+def coerce_field_values(item, coercers):
+    """Converts the string values in the given item using the given field
+    coercers (see get_field_coercers)."""
+    if isinstance(item, dict):
+        for key, value in item.items():
+            coercer = coercers.get(key.replace('-', '_'), None)
+            if coercer is not None and isinstance(value, str):
+                item[key] = coercer(value)
+    return item
+
+
+class StatikBulkLoader(object):
+    """Batches up rows per table, inserting each batch with a single Core
+    "executemany" insert, and commits in large chunks."""
+
+    def __init__(self, session, batch_size=5000, commit_size=100000):
+        self.session = session
+        self.batch_size = batch_size
+        self.commit_size = commit_size
+        self.pending = {}
+        self.rows_added = 0
+        self.uncommitted_rows = 0
+
+    def add(self, table, row):
+        rows = self.pending.setdefault(table, [])
+        rows.append(row)
+        self.rows_added += 1
+        if len(rows) >= self.batch_size:
+            self.flush_table(table)
+
+    def flush_table(self, table):
+        rows = self.pending.pop(table, [])
+        if len(rows) > 0:
+            self.session.execute(table.insert(), rows)
+            self.uncommitted_rows += len(rows)
+            if self.uncommitted_rows >= self.commit_size:
+                self.commit()
 
-        if 'session' not in kwargs:
-            raise MissingParameterError("Missing parameter \"session\" for database instance constructor")
-        self.session = kwargs['session']
+    def flush(self):
+        for table in list(self.pending.keys()):
+            self.flush_table(table)
+
+    def commit(self):
+        self.session.commit()
+        self.uncommitted_rows = 0
+
+
+class StatikDatabaseInstance(object):
+    """A compact record of a single model instance's column values and
+    ManyToMany references, as read from a data file or collection, ready to
+    be inserted into the database."""
+
+    __slots__ = ['model', 'field_values', 'many_to_many_values', 'source']
+
+    def __init__(self, **kwargs):
+        """Constructor.
+
+        Args:
+            name: The primary key of the instance.
+            from_dict: The instance's field values.
+            content: The instance's (rendered) content, if any.
+            model: The StatikModel of the instance.
+            source: The data file the instance was read from, if any.
+        """
+        for required in ['name', 'model']:
+            if required not in kwargs:
+                raise MissingParameterError("Missing parameter \"%s\" for database instance constructor" % required)
+        self.model = kwargs['model']
+        self.source = kwargs.get('source', None)
 
         # convert the vars to their underscored representation
-        self.field_values = underscore_var_names(self.vars)
-        self.field_values['pk'] = self.name
+        self.field_values = underscore_var_names(kwargs.get('from_dict', None) or {})
+        self.field_values['pk'] = kwargs['name']
+        # the primary keys of the instances related through ManyToMany fields
+        self.many_to_many_values = {}
 
         # run through the foreign key fields to check their assignment
         for field_name in self.model.field_names:
@@ -204,51 +1365,106 @@ class StatikDatabaseInstance(ContentLoadable):
                     del self.field_values[field_name]
 
             elif isinstance(field, StatikManyToManyField):
-                if not isinstance(self.field_values[field_name], list):
+                other_pks = self.field_values.pop(field_name, None) or []
+                if not isinstance(other_pks, list):
                     raise InvalidFieldTypeError("ManyToMany field values are expected to be lists (see %s.%s)" % (
                         self.model.name, field_name
                     ))
-
-                # convert the list of field values to a query to look up the
-                # primary keys of the corresponding table
-                other_model = globals()[field.field_type]
-                self.field_values[field_name] = self.session.query(
-                    other_model
-                ).filter(
-                    other_model.pk.in_(self.field_values[field_name])
-                ).all()
+                # ignore any duplicate references
+                self.many_to_many_values[field_name] = list(OrderedDict.fromkeys(other_pks))
 
         # populate any Content field for this model
         if self.model.content_field is not None:
-            self.field_values[self.model.content_field] = self.content
+            self.field_values[self.model.content_field.replace('-', '_')] = kwargs.get('content', None)
 
-        logger.debug('%s' % self)
+        logger.debug('%s', self)
+
+    @classmethod
+    def from_values(cls, model, field_values, many_to_many_values, source=None):
+        """Creates a database instance directly from its column values
+        (including its primary key) and its ManyToMany references, which must
+        already be in the form the constructor would produce."""
+        inst = cls.__new__(cls)
+        inst.model = model
+        inst.field_values = field_values
+        inst.many_to_many_values = many_to_many_values
+        inst.source = source
+        return inst
 
     def __repr__(self):
         result_lines = ["<StatikDatabaseInstance model=%s" % self.model.name]
         for field_name, field_value in self.field_values.items():
             result_lines.append("                        %s=%s" % (field_name, field_value))
+        for field_name, field_value in self.many_to_many_values.items():
+            result_lines.append("                        %s=%s" % (field_name, field_value))
         result_lines[-1] += '>'
         return '\n'.join(result_lines)
 
 
-def db_model_factory(Base, model, all_models):
+class StatikTreeMixin(object):
+    """Navigation helpers for the instances of models configured as trees,
+    based on their precomputed tree columns:
+
+        tree_path: The primary keys of the instance's ancestors (from the root
+            down) and of the instance itself, as a JSON list.
+        tree_depth: The number of ancestors of the instance.
+        tree_order: The position of the instance in a depth-first traversal
+            of all of the model's instances, in which siblings are ordered as
+            configured.
+        tree_size: The number of descendants of the instance.
+    """
+
+    @property
+    def tree_ancestors(self):
+        """This instance's ancestors, from the root down (e.g. for
+        breadcrumbs), loaded with a single query."""
+        pks = json.loads(self.tree_path)[:-1]
+        if len(pks) == 0:
+            return []
+        cls = type(self)
+        ancestors = dict([
+            (ancestor.pk, ancestor) for ancestor in object_session(self).query(cls).filter(cls.pk.in_(pks))
+        ])
+        return [ancestors[pk] for pk in pks]
+
+    @property
+    def tree_descendants(self):
+        """All of this instance's descendants, in depth-first order (e.g. to
+        render a navigation tree using their tree_depth), loaded with a single
+        query."""
+        if self.tree_size == 0:
+            return []
+        cls = type(self)
+        return object_session(self).query(cls).filter(
+            cls.tree_order > self.tree_order,
+            cls.tree_order <= self.tree_order + self.tree_size,
+        ).order_by(cls.tree_order).all()
+
+
+def get_column_type(field_type, lazy_content=False, compress_content=False):
+    """Returns the SQLAlchemy column type for the given simple field type."""
+    if compress_content and field_type in {'Content', 'Text'}:
+        return LazyMarkdownCompressedText if (lazy_content and field_type == 'Content') else CompressedText
+    if lazy_content and field_type == 'Content':
+        return LazyMarkdownText
+    return SQLALCHEMY_FIELD_MAPPER[field_type]
+
+
+def db_model_factory(Base, model, all_models, lazy_content=False, compress_content=False):
 
     def get_or_create_association_table(model1_name, model2_name):
         _association_table_name = calculate_association_table_name(model1_name, model2_name)
         logger.debug("Creating/getting ManyToMany relationship table: %s" % _association_table_name)
-        if _association_table_name in globals():
-            return globals()[_association_table_name]
+        if _association_table_name in Base.metadata.tables:
+            return Base.metadata.tables[_association_table_name]
 
         # create an association table
         _association_table = Table(
                 _association_table_name,
                 Base.metadata,
-                Column('%s_pk' % model1_name.lower(), String, ForeignKey('%s.pk' % model1_name)),
-                Column('%s_pk' % model2_name.lower(), String, ForeignKey('%s.pk' % model2_name))
+                Column('%s_pk' % model1_name.lower(), String, ForeignKey('%s.pk' % model1_name), index=True),
+                Column('%s_pk' % model2_name.lower(), String, ForeignKey('%s.pk' % model2_name), index=True)
         )
-        # track it in our globals
-        globals()[_association_table_name] = _association_table
         return _association_table
 
     logger.debug('-----')
@@ -265,6 +1481,9 @@ def db_model_factory(Base, model, all_models):
             kwargs['back_populates'] = rel['back_populates']
         if rel.get('secondary', None) is not None:
             kwargs['secondary'] = get_or_create_association_table(*rel['secondary'])
+        elif model.tree is not None and rel['to_model'] == model.name and rel['back_populates'] == model.tree['parent']:
+            # a tree node's children
+            kwargs['order_by'] = '%s.tree_order' % model.name
         logger.debug('Creating additional relationship %s.%s -> %s (%s)' % (
             model.name, field_name, rel['to_model'], kwargs
         ))
@@ -277,17 +1496,23 @@ def db_model_factory(Base, model, all_models):
             # if it's a simple field
             model_fields[field.name] = Column(
                 field.name,
-                SQLALCHEMY_FIELD_MAPPER[field.field_type]
+                get_column_type(field.field_type, lazy_content=lazy_content, compress_content=compress_content)
             )
+            if field.name in model.deferred_fields:
+                model_fields[field.name] = deferred(model_fields[field.name])
 
         elif field.field_type in all_models:
             # if it's a foreign key reference
             if isinstance(field, StatikForeignKeyField):
                 model_fields['%s_id' % field.name] = Column(
                     '%s_id' % field.name,
-                    ForeignKey('%s.pk' % field.field_type)
+                    ForeignKey('%s.pk' % field.field_type),
+                    index=True
                 )
                 kwargs = {}
+                if field.field_type == model.name:
+                    # self-referential foreign key
+                    kwargs['remote_side'] = '%s.pk' % model.name
                 if field.back_populates is not None:
                     kwargs['back_populates'] = field.back_populates
                     logger.debug('Field %s.%s has back-populates field name: %s' % (
@@ -321,14 +1546,60 @@ def db_model_factory(Base, model, all_models):
         else:
             raise InvalidFieldTypeError("Unsupported database field type: %s" % field.field_type)
 
+    # any secondary indexes declared on the model
+    table_args = []
+    for index_fields in model.indexes:
+        columns = [
+            ('%s_id' % field_name) if isinstance(getattr(model, field_name), StatikForeignKeyField) else field_name
+            for field_name in index_fields
+        ]
+        if len(index_fields) == 1 and isinstance(getattr(model, index_fields[0]), StatikForeignKeyField):
+            # foreign key columns are always indexed
+            logger.debug("Foreign key %s.%s is already indexed" % (model.name, index_fields[0]))
+            continue
+        table_args.append(Index('ix_%s_%s' % (model.name, '_'.join(columns)), *columns))
+    if len(table_args) > 0:
+        model_fields['__table_args__'] = tuple(table_args)
+
+    for field_name, aggregate in model.aggregates.items():
+        # calculated by StatikDatabase.calculate_aggregates
+        model_fields[field_name] = Column(field_name, SQLALCHEMY_FIELD_MAPPER[aggregate['field_type']])
+
+    for rel_name, rel in model.related.items():
+        if rel_name in model_fields:
+            raise ReservedFieldNameError(
+                "Related content field name \"%s\" is already in use (%s)" % (rel_name, model.name)
+            )
+        # calculated by StatikDatabase.calculate_related
+        related_table = Table(
+            calculate_related_table_name(model.name, rel_name),
+            Base.metadata,
+            Column('source_pk', String, ForeignKey('%s.pk' % model.name), index=True),
+            Column('target_pk', String, ForeignKey('%s.pk' % model.name)),
+            Column('rank', Integer),
+            Column('overlap', Integer),
+        )
+        model_fields[rel_name] = relationship(
+            model.name,
+            secondary=related_table,
+            primaryjoin=lambda related_table=related_table: Model.pk == related_table.c.source_pk,
+            secondaryjoin=lambda related_table=related_table: Model.pk == related_table.c.target_pk,
+            order_by=related_table.c.rank,
+            viewonly=True,
+        )
+
+    if model.tree is not None:
+        # precomputed by StatikDatabase.calculate_tree
+        model_fields['tree_path'] = Column('tree_path', Text)
+        model_fields['tree_depth'] = Column('tree_depth', Integer)
+        model_fields['tree_order'] = Column('tree_order', Integer, index=True)
+        model_fields['tree_size'] = Column('tree_size', Integer)
+
     Model = type(
         model.name,
-        (Base,),
+        (Base, StatikTreeMixin) if model.tree is not None else (Base,),
         model_fields
     )
 
     logger.debug("Model %s fields = %s" % (model.name, model_fields))
-
-    # add the model class reference to the global scope
-    globals()[model.name] = Model
     return Model
@@ -7,7 +7,10 @@ __all__ = [
     'MissingParameterError',
     'DuplicateModelInstanceError',
     'InvalidModelCollectionDataError',
+    'UnknownFieldError',
+    'DanglingReferenceError',
     'NoViewsError',
+    'MissingDependencyError',
 ]
 
 
@@ -37,5 +40,20 @@ class InvalidModelCollectionDataError(ValueError):
     pass
 
 
+class UnknownFieldError(ValueError):
+    pass
+
+
+class DanglingReferenceError(ValueError):
+    def __init__(self, references, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # a list of (model name, pk, field name, referenced model name, referenced pk) tuples
+        self.references = references
+
+
 class NoViewsError(Exception):
     pass
+
+
+class MissingDependencyError(Exception):
+    pass
@@ -1,14 +1,134 @@
 # -*- coding:utf-8 -*-
 
+import os.path
+import multiprocessing
+import traceback
+
 from statik.project import StatikProject
 
+import logging
+logger = logging.getLogger(__name__)
+
 __all__ = [
     "generate",
+    "StatikBuildFarm",
+    "StatikBuildResult",
 ]
 
 
-def generate(input_path, output_path=None, in_memory=False):
-    """Executes the Statik site generator using the given parameters.
+def generate(input_path, output_path=None, in_memory=False, **kwargs):
+    """Executes the Statik site generator using the given parameters. Any
+    additional keyword arguments are passed through to the StatikProject
+    constructor (e.g. jobs).
     """
-    project = StatikProject(input_path)
+    project = StatikProject(input_path, **kwargs)
     return project.generate(output_path=output_path, in_memory=in_memory)
+
+
+class StatikBuildResult(object):
+    """The outcome of building a single project in a StatikBuildFarm."""
+
+    __slots__ = ['input_path', 'output_path', 'result', 'error']
+
+    def __init__(self, input_path, output_path=None, result=None, error=None):
+        self.input_path = input_path
+        self.output_path = output_path
+        # the file count, or the in-memory output, of the build
+        self.result = result
+        # the formatted traceback of the build's failure, if it failed
+        self.error = error
+
+    def __repr__(self):
+        return '<StatikBuildResult input_path=%s succeeded=%s>' % (self.input_path, self.succeeded)
+
+    @property
+    def succeeded(self):
+        return self.error is None
+
+
+class StatikBuildFarm(object):
+    """Builds many projects in a long-lived pool of worker processes, so that
+    interpreter startup and imports are only paid for once per worker rather
+    than once per project. Each project is built with its own database, and
+    the failure of one project's build doesn't affect the others.
+
+    Example:
+
+        with StatikBuildFarm(processes=4) as farm:
+            for result in farm.build([('/sites/a', '/www/a'), ('/sites/b', '/www/b')]):
+                if not result.succeeded:
+                    print(result.error)
+    """
+
+    def __init__(self, processes=None, builds_per_worker=100, **kwargs):
+        """Constructor.
+
+        Args:
+            processes: The number of worker processes (default: the number of
+                CPUs).
+            builds_per_worker: The number of builds after which a worker
+                process is replaced with a fresh one, to bound the memory held
+                by any one worker (default: 100).
+            kwargs: Default StatikProject options for all builds (e.g. cache).
+        """
+        self.options = kwargs
+        if (self.options.get('jobs') or 1) > 1:
+            # worker processes can't have worker processes of their own
+            logger.warning("Ignoring jobs=%d: each project is built in a single worker process" % self.options['jobs'])
+        self.options['jobs'] = 1
+        self.pool = multiprocessing.Pool(processes=processes, maxtasksperchild=builds_per_worker)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def close(self):
+        """Waits for any outstanding builds, and shuts down the worker pool."""
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def build(self, projects, in_memory=False, **kwargs):
+        """Builds the given projects across the worker pool.
+
+        Args:
+            projects: A list of projects to build, each either a project path
+                (output is written to the "public" folder in the project's
+                folder) or a tuple containing the project path and output
+                path.
+            in_memory: Whether to return each project's output instead of
+                writing it to its output path (default: False).
+            kwargs: StatikProject options for these builds, overriding the
+                farm's defaults.
+
+        Returns:
+            A list of StatikBuildResult objects, in the same order as the given
+            projects.
+        """
+        options = dict(self.options)
+        options.update(kwargs)
+        options['jobs'] = 1
+
+        tasks = []
+        for project in projects:
+            input_path, output_path = project if isinstance(project, tuple) else (project, None)
+            if output_path is None and not in_memory:
+                output_path = os.path.join(input_path, 'public')
+            tasks.append((input_path, output_path, in_memory, options))
+
+        logger.info("Building %d project(s)" % len(tasks))
+        return self.pool.map(build_project, tasks, chunksize=1)
+
+
+def build_project(task):
+    """Builds a single project in a StatikBuildFarm worker process."""
+    input_path, output_path, in_memory, options = task
+    try:
+        result = generate(input_path, output_path=output_path, in_memory=in_memory, **options)
+        return StatikBuildResult(input_path, output_path=output_path, result=result)
+    except Exception:
+        logger.exception("Failed to build project: %s" % input_path)
+        return StatikBuildResult(input_path, output_path=output_path, error=traceback.format_exc())
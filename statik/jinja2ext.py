@@ -1,17 +1,50 @@
 # -*- coding:utf-8 -*-
 
-from jinja2 import nodes
+from jinja2 import nodes, Environment, Template
 from jinja2.ext import Extension
 
+from statik.common import LazyMarkdownContent
 from statik.utils import add_url_path_component
 
 __all__ = [
+    'StatikEnvironment',
+    'StatikTemplate',
     'StatikUrlExtension',
     'StatikAssetExtension',
     'filter_datetime',
 ]
 
 
+def template_value(value):
+    """Converts lazily converted Content field values to their HTML, so that
+    templates (and their filters and tests) only ever see plain strings."""
+    return value.html if isinstance(value, LazyMarkdownContent) else value
+
+
+class StatikTemplate(Template):
+    """Converts any lazily converted content in a template's context when
+    the template is rendered."""
+
+    def render(self, *args, **kwargs):
+        context = dict(*args, **kwargs)
+        return super().render(
+            dict([(name, template_value(value)) for name, value in context.items()])
+        )
+
+
+class StatikEnvironment(Environment):
+    """Converts lazily converted content where templates look it up, e.g.
+    as `{{ post.content }}` or `{{ post['content'] }}`."""
+
+    template_class = StatikTemplate
+
+    def getattr(self, obj, attribute):
+        return template_value(super().getattr(obj, attribute))
+
+    def getitem(self, obj, argument):
+        return template_value(super().getitem(obj, argument))
+
+
 class StatikUrlExtension(Extension):
     """Provides the `{% url %}` extension for reverse-location of URLs from views/data."""
 
@@ -1,14 +1,21 @@
 # -*- coding:utf-8 -*-
 
 import yaml
+from markdown import util
 from markdown.preprocessors import Preprocessor
 from markdown.extensions import Extension
 
 __all__ = [
     'MarkdownYamlMetaExtension',
     'MarkdownYamlMetaPreprocessor',
+    'split_yaml_front_matter',
+    'read_yaml_front_matter',
+    'normalize_whitespace',
 ]
 
+# the tab length Markdown uses by default
+TAB_LENGTH = 4
+
 
 class MarkdownYamlMetaExtension(Extension):
 
@@ -20,28 +27,77 @@ class MarkdownYamlMetaExtension(Extension):
 class MarkdownYamlMetaPreprocessor(Preprocessor):
 
     def run(self, lines):
-        result = []
         self.markdown.meta = {}
+        yaml_lines, result = split_yaml_front_matter(lines)
+        if len(yaml_lines) > 0:
+            self.markdown.meta = yaml.load('\n'.join(yaml_lines))
 
-        if len(lines) > 1:
-            yaml_lines = []
-            if lines[0].strip() == '---':
-                collecting_yaml = True
-                start_line = 1
-            else:
-                collecting_yaml = False
-                start_line = 0
-
-            for line in lines[start_line:]:
-                if collecting_yaml:
-                    if line.strip() == '---':
-                        collecting_yaml = False
-                    else:
-                        yaml_lines.append(line)
+        return result
+
+
+def split_yaml_front_matter(lines):
+    """Splits the given lines of a Markdown document into the lines making up
+    its YAML front matter (if any) and the lines making up its body.
+
+    Returns:
+        A (yaml_lines, body_lines) tuple.
+    """
+    yaml_lines, body_lines = [], []
+    if len(lines) > 1:
+        if lines[0].strip() == '---':
+            collecting_yaml = True
+            start_line = 1
+        else:
+            collecting_yaml = False
+            start_line = 0
+
+        for line in lines[start_line:]:
+            if collecting_yaml:
+                if line.strip() == '---':
+                    collecting_yaml = False
                 else:
-                    result.append(line)
+                    yaml_lines.append(line)
+            else:
+                body_lines.append(line)
 
-            if len(yaml_lines) > 0:
-                self.markdown.meta = yaml.load('\n'.join(yaml_lines))
+    return yaml_lines, body_lines
 
-        return result
+
+def read_yaml_front_matter(lines):
+    """Reads only the YAML front matter lines from the given iterable of lines
+    (e.g. an open file), without consuming anything after the closing "---"
+    delimiter. The Markdown body is therefore never read.
+
+    Returns:
+        A list containing the lines of YAML front matter (which will be empty
+        if the document has no front matter).
+    """
+    yaml_lines = []
+    lines = iter(lines)
+    first_line = next(lines, None)
+    if first_line is None or first_line.strip() != '---':
+        return yaml_lines
+
+    for line in lines:
+        if line.strip() == '---':
+            break
+        yaml_lines.append(line.rstrip('\r\n'))
+
+    return normalize_whitespace(yaml_lines)
+
+
+def normalize_whitespace(lines, tab_length=TAB_LENGTH):
+    """Normalizes the whitespace in the given lines (which must not contain
+    any line endings) the same way Markdown does before any of its
+    preprocessors run, so that YAML front matter read without converting the
+    document parses exactly as it does when the document is converted.
+
+    Returns:
+        A list containing the normalized lines.
+    """
+    result = []
+    for line in lines:
+        line = line.replace(util.STX, '').replace(util.ETX, '').expandtabs(tab_length)
+        # lines containing only spaces are emptied
+        result.append(line if len(line.strip(' ')) > 0 else '')
+    return result
@@ -4,6 +4,7 @@ import yaml
 
 from statik.common import YamlLoadable
 from statik.fields import *
+from statik.query import StatikQuery
 from statik.utils import extract_filename, calculate_association_table_name
 from statik.errors import *
 
@@ -18,7 +19,21 @@ __all__ = [
 class StatikModel(YamlLoadable):
     """Represents a single model in our Statik project."""
 
-    RESERVED_FIELD_NAMES = {'name', 'model_names', 'field_names', 'content_field', 'filename', 'additional_rels'}
+    RESERVED_FIELD_NAMES = {
+        'name', 'model_names', 'field_names', 'content_field', 'filename', 'additional_rels', 'indexes',
+        'deferred_fields', 'tree', 'aggregates', 'related',
+    }
+    # the types of the fields whose columns are only loaded when first used, unless configured otherwise
+    DEFERRED_FIELD_TYPES = {'Content', 'Text'}
+    # the columns precomputed for models configured as trees
+    TREE_FIELD_NAMES = ['tree_path', 'tree_depth', 'tree_order', 'tree_size']
+    AGGREGATE_FUNCTIONS = ['count', 'min', 'max', 'sum']
+    # the types of the fields over which aggregates other than counts can be calculated
+    AGGREGATE_FIELD_TYPES = {'String', 'Integer', 'DateTime'}
+    # the default number of related instances kept for each instance
+    DEFAULT_RELATED_LIMIT = 5
+    # the key in a model's configuration containing model-level (as opposed to field) options
+    META_KEY = '_meta'
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -39,9 +54,29 @@ class StatikModel(YamlLoadable):
         self.content_field = None
         # additional back-reference relationships, indexed by field name
         self.additional_rels = {}
+        # secondary indexes, each of which is a tuple of one or more field names
+        self.indexes = []
+        # the names of the fields whose columns are only loaded when first used
+        self.deferred_fields = []
+        # for models whose instances form a hierarchy: the self-referential
+        # foreign key field and the order of siblings
+        self.tree = None
+        # fields calculated from this model's relationships once all of the
+        # data has been loaded, indexed by field name
+        self.aggregates = {}
+        # relationships to the instances of this model that share the most
+        # related instances through one of its ManyToMany fields, indexed by
+        # relationship name
+        self.related = {}
+        meta = self.vars.get(StatikModel.META_KEY, None) or {}
+        if not isinstance(meta, dict):
+            raise ValueError("Model \"%s\" value must be a dictionary (%s)" % (StatikModel.META_KEY, self.name))
 
         # build up all of our fields from the model configuration
         for field_name, field_type in self.vars.items():
+            if field_name == StatikModel.META_KEY:
+                continue
+
             if field_type == 'Content':
                 if self.content_field is not None:
                     raise ValueError("Only one \"Content\" field is allowed per model (%s)" % self.name)
@@ -62,26 +97,232 @@ class StatikModel(YamlLoadable):
                 construct_field(new_field_name, field_type, self.model_names)
             )
 
+        self.configure_indexes(meta.get('indexes', None) or [])
+        self.configure_deferred_fields(meta.get('deferred', False))
+        self.configure_tree(meta.get('tree', None))
+        self.configure_aggregates(meta.get('aggregates', None) or {})
+        self.configure_related(meta.get('related', None) or {})
+
+    def configure_indexes(self, indexes):
+        """Configures this model's secondary indexes from the given list, where
+        each entry is either a field name or a list of field names (for a
+        composite index)."""
+        for index in indexes:
+            field_names = tuple([
+                field_name.replace('-', '_') for field_name in (index if isinstance(index, list) else [index])
+            ])
+            for field_name in field_names:
+                if field_name not in self.field_names:
+                    raise ValueError("Index on unknown field \"%s\" in model: %s" % (field_name, self.name))
+                if isinstance(getattr(self, field_name), StatikManyToManyField):
+                    raise ValueError("ManyToMany fields cannot be indexed (%s.%s)" % (self.name, field_name))
+            self.indexes.append(field_names)
+
+    def configure_deferred_fields(self, deferred):
+        """Configures which of this model's fields are deferred: either a list
+        of field names, or True for all of its Content and Text fields, or
+        False for none of them (the default). Deferred fields are only loaded
+        when first accessed, with a query per instance, unless the views using
+        them list them under "undefer"."""
+        if deferred is True:
+            self.deferred_fields = [
+                field_name for field_name in self.field_names
+                if getattr(self, field_name).field_type in StatikModel.DEFERRED_FIELD_TYPES
+            ]
+            return
+        if deferred is False or deferred is None:
+            return
+        if not isinstance(deferred, list):
+            raise ValueError("Model \"deferred\" value must be a list of field names or a boolean (%s)" % self.name)
+
+        for field_name in deferred:
+            field_name = field_name.replace('-', '_')
+            if field_name not in self.field_names:
+                raise ValueError("Deferred unknown field \"%s\" in model: %s" % (field_name, self.name))
+            if isinstance(getattr(self, field_name), (StatikForeignKeyField, StatikManyToManyField)):
+                raise ValueError("Relationship fields cannot be deferred (%s.%s)" % (self.name, field_name))
+            self.deferred_fields.append(field_name)
+
+    def configure_tree(self, tree):
+        """Configures this model as a hierarchy of instances, either from the
+        name of its self-referential foreign key field, or from a dictionary
+        containing the name of that field ("parent") and a list of the fields
+        by which siblings are ordered ("order", each prefixed with "-" for
+        descending order, by primary key by default)."""
+        if tree is None:
+            return
+        if isinstance(tree, str):
+            tree = {'parent': tree}
+        if not isinstance(tree, dict) or 'parent' not in tree:
+            raise ValueError("Model \"tree\" value must be a field name or contain a \"parent\" value (%s)" % self.name)
+
+        parent = tree['parent'].replace('-', '_')
+        if parent not in self.field_names or not isinstance(getattr(self, parent), StatikForeignKeyField) or \
+                getattr(self, parent).field_type != self.name:
+            raise ValueError("Tree parent field must be a foreign key to the model itself (%s.%s)" % (self.name, parent))
+
+        order = tree.get('order', None) or ['pk']
+        order = [
+            (field_name.lstrip('-').replace('-', '_'), field_name.startswith('-'))
+            for field_name in (order if isinstance(order, list) else [order])
+        ]
+        for field_name, _ in order:
+            if field_name != 'pk' and (field_name not in self.field_names or
+                                       isinstance(getattr(self, field_name), StatikManyToManyField)):
+                raise ValueError("Tree cannot be ordered by field \"%s\" (%s)" % (field_name, self.name))
+
+        for field_name in StatikModel.TREE_FIELD_NAMES:
+            if field_name in self.field_names:
+                raise ReservedFieldNameError(
+                    "Field name \"%s\" is reserved for tree models (%s)" % (field_name, self.name)
+                )
+        self.tree = {'parent': parent, 'order': order}
+
+    def configure_aggregates(self, aggregates):
+        """Configures this model's aggregate fields from the given dictionary,
+        where each aggregate consists of a function and the relationship (and,
+        other than for counts, the field of the related model) it's calculated
+        over, with an optional filter on the related instances, e.g.:
+
+            post-count:
+              count: posts
+              filter:
+                draft: false
+            latest-post:
+              max: posts.published
+
+        The relationships are only resolved once all of the models' additional
+        relationships are known (see resolve_aggregates).
+        """
+        if not isinstance(aggregates, dict):
+            raise ValueError("Model \"aggregates\" value must be a dictionary (%s)" % self.name)
+
+        for field_name, spec in aggregates.items():
+            field_name = field_name.replace('-', '_')
+            if field_name in self.field_names or field_name in StatikModel.RESERVED_FIELD_NAMES:
+                raise ReservedFieldNameError(
+                    "Aggregate field name \"%s\" is already in use (%s)" % (field_name, self.name)
+                )
+            functions = [function for function in StatikModel.AGGREGATE_FUNCTIONS if function in (spec or {})]
+            if not isinstance(spec, dict) or len(functions) != 1:
+                raise ValueError("Aggregate field must have exactly one of %s (%s.%s)" % (
+                    ', '.join(StatikModel.AGGREGATE_FUNCTIONS), self.name, field_name
+                ))
+
+            function = functions[0]
+            path = spec[function].replace('-', '_').split('.')
+            if len(path) > 2 or (function != 'count' and len(path) != 2):
+                raise ValueError("Aggregate \"%s\" value must be of the form %s (%s.%s)" % (
+                    function, 'relationship' if function == 'count' else 'relationship.field', self.name, field_name
+                ))
+            self.aggregates[field_name] = {
+                'function': function,
+                'relationship': path[0],
+                'field': path[1] if len(path) > 1 else None,
+                'filter': spec.get('filter', None) or {},
+            }
+
+    def configure_related(self, related):
+        """Configures this model's related content relationships from the
+        given dictionary, where each relationship is ranked by the number of
+        instances that each other instance has in common with this one through
+        one of its ManyToMany fields ("via"), and contains at most "limit"
+        instances, e.g.:
+
+            related-posts:
+              via: tags
+              limit: 3
+        """
+        if not isinstance(related, dict):
+            raise ValueError("Model \"related\" value must be a dictionary (%s)" % self.name)
+
+        for rel_name, spec in related.items():
+            rel_name = rel_name.replace('-', '_')
+            if rel_name in self.field_names or rel_name in self.aggregates or \
+                    rel_name in StatikModel.RESERVED_FIELD_NAMES:
+                raise ReservedFieldNameError(
+                    "Related content field name \"%s\" is already in use (%s)" % (rel_name, self.name)
+                )
+            if isinstance(spec, str):
+                spec = {'via': spec}
+            if not isinstance(spec, dict) or 'via' not in spec:
+                raise ValueError("Related content must contain a \"via\" value (%s.%s)" % (self.name, rel_name))
+
+            via = spec['via'].replace('-', '_')
+            if via not in self.field_names or not isinstance(getattr(self, via), StatikManyToManyField):
+                raise ValueError("Related content must be found via a ManyToMany field (%s.%s)" % (
+                    self.name, rel_name
+                ))
+            limit = spec.get('limit', StatikModel.DEFAULT_RELATED_LIMIT)
+            if not isinstance(limit, int) or limit < 1:
+                raise ValueError("Related content \"limit\" value must be a positive integer (%s.%s)" % (
+                    self.name, rel_name
+                ))
+            self.related[rel_name] = {'via': via, 'limit': limit}
+
+    def resolve_aggregates(self, all_models):
+        """Resolves the relationships over which this model's aggregate fields
+        are calculated (to be called once all of the models' additional
+        relationships have been found)."""
+        for field_name, aggregate in self.aggregates.items():
+            if field_name in self.additional_rels:
+                raise ReservedFieldNameError(
+                    "Aggregate field name \"%s\" is already in use (%s)" % (field_name, self.name)
+                )
+            rel_name = aggregate['relationship']
+            if rel_name in self.field_names and isinstance(getattr(self, rel_name), StatikManyToManyField):
+                to_model = getattr(self, rel_name).field_type
+                aggregate['secondary'] = (self.name, to_model)
+                aggregate['back_populates'] = None
+            elif rel_name in self.additional_rels:
+                to_model = self.additional_rels[rel_name]['to_model']
+                aggregate['secondary'] = self.additional_rels[rel_name]['secondary']
+                aggregate['back_populates'] = self.additional_rels[rel_name]['back_populates']
+            else:
+                raise ValueError("Aggregate field must be calculated over a one-to-many or ManyToMany relationship "
+                                 "(%s.%s)" % (self.name, field_name))
+            aggregate['to_model'] = to_model
+
+            if aggregate['field'] is None:
+                aggregate['field_type'] = 'Integer'
+            else:
+                other = all_models[to_model]
+                if aggregate['field'] not in other.field_names or \
+                        getattr(other, aggregate['field']).field_type not in StatikModel.AGGREGATE_FIELD_TYPES or \
+                        isinstance(getattr(other, aggregate['field']), StatikForeignKeyField):
+                    raise ValueError("Aggregate field cannot be calculated over field %s.%s (%s.%s)" % (
+                        to_model, aggregate['field'], self.name, field_name
+                    ))
+                aggregate['field_type'] = 'Integer' if aggregate['function'] == 'count' else \
+                    getattr(other, aggregate['field']).field_type
+                if aggregate['function'] == 'sum' and aggregate['field_type'] != 'Integer':
+                    raise ValueError("Only Integer fields can be summed (%s.%s)" % (self.name, field_name))
+
+            # validates the filter against the related model
+            aggregate['query'] = StatikQuery({'model': to_model, 'filter': aggregate['filter']}, all_models)
+
     def find_additional_rels(self, all_models):
         """Attempts to scan for additional relationship fields for this model based on all of the other models'
         structures and relationships.
         """
         for model_name, model in all_models.items():
-            if model_name != self.name:
-                for field_name in model.field_names:
-                    field = getattr(model, field_name)
-                    # if this field type references the current model
-                    if field.field_type == self.name and field.back_populates is not None and \
-                            (isinstance(field, StatikForeignKeyField) or isinstance(field, StatikManyToManyField)):
-                        self.additional_rels[field.back_populates] = {
-                            'to_model': model_name,
-                            'back_populates': field_name,
-                            'secondary':
-                                (model_name, field.field_type) if isinstance(field, StatikManyToManyField) else None
-                        }
-                        logger.debug('Additional relationship %s.%s -> %s (%s)' % (
-                            self.name,
-                            field.back_populates,
-                            model_name,
-                            self.additional_rels[field.back_populates]
-                        ))
+            for field_name in model.field_names:
+                field = getattr(model, field_name)
+                # self-referential ManyToMany fields aren't supported
+                if model_name == self.name and not isinstance(field, StatikForeignKeyField):
+                    continue
+                # if this field type references the current model
+                if field.field_type == self.name and field.back_populates is not None and \
+                        (isinstance(field, StatikForeignKeyField) or isinstance(field, StatikManyToManyField)):
+                    self.additional_rels[field.back_populates] = {
+                        'to_model': model_name,
+                        'back_populates': field_name,
+                        'secondary':
+                            (model_name, field.field_type) if isinstance(field, StatikManyToManyField) else None
+                    }
+                    logger.debug('Additional relationship %s.%s -> %s (%s)' % (
+                        self.name,
+                        field.back_populates,
+                        model_name,
+                        self.additional_rels[field.back_populates]
+                    ))
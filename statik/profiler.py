@@ -0,0 +1,166 @@
+# -*- coding:utf-8 -*-
+
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event
+
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    'StatikProfiler',
+    'StatikStatementStats',
+]
+
+
+class StatikStatementStats(object):
+    """Execution statistics for a single SQL statement, as executed from a
+    single view."""
+
+    __slots__ = ['statement', 'view', 'template', 'keyset_page', 'count', 'total_time', 'parameters',
+                 'distinct_parameters', 'query_plan']
+
+    def __init__(self, statement, view=None, template=None, keyset_page=False):
+        self.statement = statement
+        self.view = view
+        self.template = template
+        # whether this is a paginated query's keyset page query (see
+        # StatikQuery.build_page), which is executed once per page by design
+        self.keyset_page = keyset_page
+        self.count = 0
+        self.total_time = 0.0
+        # the first set of parameters with which the statement was executed
+        self.parameters = None
+        self.distinct_parameters = set()
+        self.query_plan = None
+
+    def record(self, parameters, elapsed):
+        if self.count == 0:
+            self.parameters = parameters
+        self.count += 1
+        self.total_time += elapsed
+        if len(self.distinct_parameters) <= StatikProfiler.N_PLUS_ONE_THRESHOLD:
+            self.distinct_parameters.add(repr(parameters))
+
+    @property
+    def is_n_plus_one(self):
+        """Whether this looks like the same query being executed once per
+        instance (e.g. a relationship being lazily loaded from a template
+        while iterating over a query's results)."""
+        return self.statement.lstrip().upper().startswith('SELECT') and not self.keyset_page and \
+            len(self.distinct_parameters) > StatikProfiler.N_PLUS_ONE_THRESHOLD
+
+
+class StatikProfiler(object):
+    """Records the number of executions, total execution time and query plan
+    of each SQL statement executed against a database engine, attributed to
+    the view (and template) being processed at the time."""
+
+    # the number of executions of the same statement with different
+    # parameters (from the same view) above which it's reported as an N+1
+    # query pattern
+    N_PLUS_ONE_THRESHOLD = 5
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.stats = OrderedDict()
+        self.view = None
+        self.template = None
+        self.enabled = True
+        event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self.after_cursor_execute)
+
+    def stop(self):
+        """Stops recording statements."""
+        if self.enabled:
+            event.remove(self.engine, 'before_cursor_execute', self.before_cursor_execute)
+            event.remove(self.engine, 'after_cursor_execute', self.after_cursor_execute)
+            self.enabled = False
+
+    def set_view(self, view=None, template=None):
+        """Attributes all subsequently executed statements to the given view
+        and template names."""
+        self.view = view
+        self.template = template
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # kept with the statement's own execution context, so that a statement
+        # that fails (and never gets to after_cursor_execute) doesn't affect
+        # the timing of any other statement
+        if context is not None:
+            context.statik_start_time = time.perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        start_time = getattr(context, 'statik_start_time', None)
+        elapsed = (time.perf_counter() - start_time) if start_time is not None else 0.0
+        key = (statement, self.view)
+        stats = self.stats.get(key, None)
+        if stats is None:
+            stats = self.stats[key] = StatikStatementStats(
+                statement,
+                view=self.view,
+                template=self.template,
+                keyset_page=context is not None and context.execution_options.get('statik_keyset_page', False),
+            )
+        stats.record(parameters, elapsed)
+
+    def explain(self):
+        """Runs EXPLAIN QUERY PLAN for each of the unique SELECT statements
+        recorded so far."""
+        plans = {}
+        self.stop()
+        with self.engine.connect() as conn:
+            # the recorded statements and parameters are in the DBAPI's own
+            # format, so they're explained directly on a DBAPI cursor
+            cursor = conn.connection.cursor()
+            try:
+                for stats in self.stats.values():
+                    if not stats.statement.lstrip().upper().startswith('SELECT'):
+                        continue
+                    if stats.statement not in plans:
+                        try:
+                            cursor.execute('EXPLAIN QUERY PLAN %s' % stats.statement, stats.parameters or ())
+                            plans[stats.statement] = [row[-1] for row in cursor.fetchall()]
+                        except Exception as e:
+                            logger.warning("Unable to explain statement: %s (%s)" % (stats.statement, e))
+                            plans[stats.statement] = []
+                    stats.query_plan = plans[stats.statement]
+            finally:
+                cursor.close()
+
+    def ranked_stats(self):
+        """Returns the recorded statement statistics, from the most to the
+        least total execution time."""
+        return sorted(self.stats.values(), key=lambda stats: stats.total_time, reverse=True)
+
+    def summary(self, limit=20):
+        """Generates a human-readable summary of the (at most limit) most
+        expensive statements."""
+        ranked = self.ranked_stats()
+        lines = ["Database query profile: %d statement(s), %d execution(s), %.3fs total" % (
+            len(ranked),
+            sum([stats.count for stats in ranked]),
+            sum([stats.total_time for stats in ranked]),
+        )]
+        for i, stats in enumerate(ranked[:limit]):
+            lines.append("%3d. %.3fs, %d execution(s)%s, view: %s, template: %s" % (
+                i+1,
+                stats.total_time,
+                stats.count,
+                " [N+1]" if stats.is_n_plus_one else "",
+                stats.view,
+                stats.template,
+            ))
+            lines.append("     %s" % ' '.join(stats.statement.split()))
+            for step in (stats.query_plan or []):
+                lines.append("       plan: %s" % step)
+
+        n_plus_one = [stats for stats in ranked if stats.is_n_plus_one]
+        if len(n_plus_one) > 0:
+            lines.append("Possible N+1 query pattern(s) (consider eager loading these relationships):")
+            for stats in n_plus_one:
+                lines.append("  - %d execution(s) from view %s: %s" % (
+                    stats.count, stats.view, ' '.join(stats.statement.split()),
+                ))
+        return '\n'.join(lines)
@@ -9,8 +9,11 @@ from statik.utils import *
 from statik.errors import *
 from statik.models import StatikModel
 from statik.views import StatikView
+from statik.query import StatikQuery
 from statik.jinja2ext import *
 from statik.database import StatikDatabase
+from statik.cache import StatikCache, calculate_cache_signature
+from statik.profiler import StatikProfiler
 
 import logging
 logger = logging.getLogger(__name__)
@@ -26,20 +29,53 @@ class StatikProject(object):
     MODELS_DIR = "models"
     TEMPLATES_DIR = "templates"
     DATA_DIR = "data"
+    CACHE_DIR = ".statik-cache"
+    DB_FILE = "statik.db"
 
     def __init__(self, path, **kwargs):
         """Constructor.
 
         Args:
             path: The full filesystem path to the base of the project.
+            config: An optional pre-loaded StatikConfig for the project.
+            jobs: The number of worker processes to use when loading the
+                project's data (default: 1).
+            cache: Whether or not to cache parsed data files in the project's
+                cache folder between builds (default: False).
+            lazy_content: Whether or not to defer converting Markdown content
+                to HTML until it is first used (default: False).
+            persistent_db: Whether or not to keep the project's database in a
+                file in the project's cache folder, only reloading the data
+                that has changed between builds (default: False).
+            low_memory: Whether or not to keep the memory used while loading
+                the project's data to a minimum, at some cost to speed
+                (default: False).
+            compress_content: Whether or not to store Content and Text values
+                compressed in the project's database (default: False).
+            columnar: Whether or not to execute structured view queries
+                against a columnar (NumPy) copy of the project's data, instead
+                of through the ORM (default: False).
+            profile: Whether or not to profile the database queries executed
+                while processing the project's views, and log a summary of
+                them at the end of the build (default: False).
         """
         self.path = path
         logger.info("Using project source directory: %s" % path)
         self.config = kwargs.get('config', None)
+        self.jobs = kwargs.get('jobs', 1)
+        self.use_cache = kwargs.get('cache', False)
+        self.lazy_content = kwargs.get('lazy_content', False)
+        self.persistent_db = kwargs.get('persistent_db', False)
+        self.low_memory = kwargs.get('low_memory', False)
+        self.compress_content = kwargs.get('compress_content', False)
+        self.columnar = kwargs.get('columnar', False)
+        self.profile = kwargs.get('profile', False)
+        self.cache_path = os.path.join(self.path, StatikProject.CACHE_DIR)
         self.models = {}
         self.template_env = None
         self.views = {}
         self.db = None
+        self.profiler = None
         self.project_context = {}
 
     def generate(self, output_path=None, in_memory=False):
@@ -62,9 +98,16 @@ class StatikProject(object):
                 self.config.assets_dest_path
         )
         self.db = self.load_db_data(self.models)
+        if self.profile:
+            self.profiler = StatikProfiler(self.db.engine)
+            self.profiler.set_view('(project context)')
         self.project_context = self.load_project_context()
 
         in_memory_result = self.process_views()
+        self.db.log_query_stats()
+        if self.profiler is not None:
+            self.profiler.explain()
+            logger.info(self.profiler.summary())
 
         if in_memory:
             return in_memory_result
@@ -81,7 +124,7 @@ class StatikProject(object):
         if not os.path.isdir(template_path):
             raise MissingProjectFolderError(StatikProject.TEMPLATES_DIR, "Project is missing its templates folder")
 
-        env = jinja2.Environment(
+        env = StatikEnvironment(
             loader=jinja2.FileSystemLoader(template_path),
             extensions=[
                 'statik.jinja2ext.StatikUrlExtension',
@@ -140,7 +183,40 @@ class StatikProject(object):
         if not os.path.isdir(data_path):
             raise MissingProjectFolderError(StatikProject.DATA_DIR, "Project is missing its data folder")
 
-        return StatikDatabase(data_path, models)
+        return StatikDatabase(
+            data_path,
+            models,
+            jobs=self.jobs,
+            cache=self.load_cache(),
+            lazy_content=self.lazy_content,
+            db_path=self.get_db_path(),
+            low_memory=self.low_memory,
+            compress_content=self.compress_content,
+            columnar=self.columnar,
+        )
+
+    def get_db_path(self):
+        """Returns the path to the project's persistent database file, or None
+        if the database is to be kept in memory."""
+        if not self.persistent_db:
+            return None
+
+        ensure_path_exists(self.cache_path)
+        return os.path.join(self.cache_path, StatikProject.DB_FILE)
+
+    def load_cache(self):
+        """Prepares the project's on-disk cache, if caching is enabled."""
+        if not self.use_cache:
+            return None
+
+        logger.debug("Using project cache folder: %s" % self.cache_path)
+        # raw and converted content must never be mixed up in the cache
+        cache = StatikCache(
+            self.cache_path,
+            signature=calculate_cache_signature('lazy_content=%s' % self.lazy_content),
+        )
+        cache.prepare()
+        return cache
 
     def load_project_context(self):
         """Loads the project context (static and dynamic) from the database/models for common use amongst
@@ -158,6 +234,8 @@ class StatikProject(object):
         """Loads the dynamic context for this project, if any."""
         context = {}
         for varname, query in self.config.context_dynamic.items():
+            if isinstance(query, dict):
+                query = StatikQuery(query, self.models)
             context[varname] = self.db.query(query)
         return context
 
@@ -168,7 +246,11 @@ class StatikProject(object):
         for view_name, view in self.views.items():
             # first update the view's context with the project context
             view.context.update(self.project_context)
-            output.update(view.process(self.db))
+            if self.profiler is not None:
+                self.profiler.set_view(view_name, view.template.name)
+            # views may write to the same output folders (e.g. date archives
+            # and posts), so their output is merged rather than replaced
+            output = deep_merge_dict(output, view.process(self.db))
         return output
 
     def dump_in_memory_result(self, result, output_path):
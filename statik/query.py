@@ -0,0 +1,242 @@
+# -*- coding:utf-8 -*-
+
+from sqlalchemy import bindparam, literal, and_, or_, false
+from sqlalchemy.orm import load_only
+
+from statik.fields import *
+from statik.errors import *
+
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    'StatikQuery',
+]
+
+FILTER_OPERATORS = {
+    '==': lambda column, value: column == value,
+    '!=': lambda column, value: column != value,
+    '<': lambda column, value: column < value,
+    '<=': lambda column, value: column <= value,
+    '>': lambda column, value: column > value,
+    '>=': lambda column, value: column >= value,
+}
+
+
+class StatikQuery(object):
+    """A structured query, configured in YAML as an alternative to a query
+    string, e.g.:
+
+        model: Post
+        filter:
+          draft: false
+          published: {">=": 2016-01-01}
+        order: -published
+        limit: 10
+        fields: [title, slug, published]
+
+    The query is validated against the models when it is configured, and
+    compiled (with bound parameters) the first time it is executed against a
+    particular database. The compiled form is kept for subsequent executions.
+    """
+
+    def __init__(self, spec, models):
+        """Constructor.
+
+        Args:
+            spec: The query configuration (a dictionary).
+            models: All of the project's models, indexed by name.
+        """
+        if not isinstance(spec, dict):
+            raise ValueError("Query configuration must be a dictionary")
+        if 'model' not in spec:
+            raise MissingParameterError("Missing \"model\" value in query configuration")
+        if spec['model'] not in models:
+            raise ValueError("Unrecognised model in query configuration: %s" % spec['model'])
+
+        self.model_name = spec['model']
+        self.model = models[self.model_name]
+        # lists of (column name, operator, value) tuples
+        self.filters = []
+        self.in_filters = []
+        # list of (column name, descending) tuples
+        self.order = []
+        self.limit = spec.get('limit', None)
+        # column names of the fields to load (all fields if empty)
+        self.fields = []
+
+        for field_name, value in (spec.get('filter', None) or {}).items():
+            column = self.get_column_name(field_name)
+            conditions = value if isinstance(value, dict) else {'==': value}
+            for op, op_value in conditions.items():
+                if op == 'in':
+                    if not isinstance(op_value, list):
+                        raise ValueError("Query \"in\" filter values must be lists (%s.%s)" % (
+                            self.model_name, field_name
+                        ))
+                    self.in_filters.append((column, op, tuple(op_value)))
+                elif op in FILTER_OPERATORS:
+                    if isinstance(op_value, (list, dict)):
+                        raise ValueError(
+                            "Query \"%s\" filter values must be single values, use \"in\" to match any of a "
+                            "list of values (%s.%s)" % (op, self.model_name, field_name)
+                        )
+                    self.filters.append((column, op, op_value))
+                else:
+                    raise ValueError("Unrecognised query filter operator \"%s\" (%s.%s)" % (
+                        op, self.model_name, field_name
+                    ))
+
+        order = spec.get('order', None) or []
+        for field_name in (order if isinstance(order, list) else [order]):
+            descending = field_name.startswith('-')
+            self.order.append((self.get_column_name(field_name.lstrip('-')), descending))
+
+        if self.limit is not None and not isinstance(self.limit, int):
+            raise ValueError("Query \"limit\" value must be an integer (%s)" % self.model_name)
+
+        self.fields = [self.get_column_name(field_name) for field_name in (spec.get('fields', None) or [])]
+
+        # uniquely identifies the structure of this query (everything but the
+        # values of its bound parameters)
+        self.key = (
+            self.model_name,
+            tuple([(column, op, value is None) for column, op, value in self.filters]),
+            tuple(self.in_filters),
+            tuple(self.order),
+            self.limit,
+            tuple(self.fields),
+        )
+        self.params = dict([('p%d' % i, value) for i, (_, _, value) in enumerate(self.filters)])
+
+    def __repr__(self):
+        return '<StatikQuery %s>' % (self.key, )
+
+    def __eq__(self, other):
+        return isinstance(other, StatikQuery) and self.key == other.key and self.params == other.params
+
+    def __hash__(self):
+        return hash((self.key, tuple(sorted(self.params.items(), key=lambda item: item[0]))))
+
+    @property
+    def bound_params(self):
+        """The values of the query's bound parameters."""
+        return dict([(name, value) for name, value in self.params.items() if value is not None])
+
+    @property
+    def compared_columns(self):
+        """The names of the columns this query filters or orders by."""
+        return [column for column, _, _ in self.filters + self.in_filters] + [column for column, _ in self.order]
+
+    def get_column_name(self, field_name):
+        """Returns the name of the database column for the given field."""
+        field_name = field_name.replace('-', '_')
+        if field_name == 'pk' or field_name in self.model.aggregates:
+            return field_name
+        if field_name not in self.model.field_names:
+            raise ValueError("Unrecognised field in query configuration: %s.%s" % (self.model_name, field_name))
+
+        field = getattr(self.model, field_name)
+        if isinstance(field, StatikManyToManyField):
+            raise ValueError("ManyToMany fields cannot be used in query configuration (%s.%s)" % (
+                self.model_name, field_name
+            ))
+        return ('%s_id' % field_name) if isinstance(field, StatikForeignKeyField) else field_name
+
+    def build(self, session, db_model):
+        """Builds the SQLAlchemy query for the given ORM model class, using
+        bound parameters for the filter values."""
+        query = session.query(db_model)
+        for i, (column, op, value) in enumerate(self.filters):
+            if value is None:
+                # NULL comparisons can't be parameterised
+                query = query.filter(
+                    getattr(db_model, column).is_(None) if op == '==' else getattr(db_model, column).isnot(None)
+                )
+            else:
+                query = query.filter(FILTER_OPERATORS[op](getattr(db_model, column), bindparam('p%d' % i)))
+
+        for column, _, values in self.in_filters:
+            query = query.filter(getattr(db_model, column).in_(values))
+
+        if len(self.order) > 0:
+            query = query.order_by(*[
+                getattr(db_model, column).desc() if descending else getattr(db_model, column)
+                for column, descending in self.order
+            ])
+
+        if len(self.fields) > 0:
+            query = query.options(load_only(*self.fields))
+
+        if self.limit is not None:
+            query = query.limit(self.limit)
+
+        return query
+
+    @property
+    def keyset_order(self):
+        """The query's order, with the primary key appended (if it isn't
+        already ordered by it) so that every instance's position is unique."""
+        if 'pk' in [column for column, _ in self.order]:
+            return list(self.order)
+        return self.order + [('pk', False)]
+
+    def get_keyset(self, inst):
+        """Returns the values of the given instance's keyset_order columns."""
+        return tuple([getattr(inst, column) for column, _ in self.keyset_order])
+
+    def build_page(self, session, db_model, page_size, after=None):
+        """Builds the query for a single page of this query's results, using
+        keyset pagination: the page starts right after the instance whose
+        keyset (see get_keyset) is given, rather than at an offset, so that
+        each page can be found using the ordering columns' indexes."""
+        # marked as such for the profiler, since a page query is expected to
+        # be executed many times
+        query = self.build(session, db_model).params(**self.bound_params).execution_options(statik_keyset_page=True)
+        if 'pk' not in [column for column, _ in self.order]:
+            query = query.order_by(db_model.pk)
+        if after is not None:
+            conditions = []
+            for i, (column, descending) in enumerate(self.keyset_order):
+                conditions.append(and_(*(
+                    [keyset_equal(getattr(db_model, other), value)
+                     for (other, _), value in zip(self.keyset_order[:i], after[:i])] +
+                    [keyset_after(getattr(db_model, column), descending, after[i])]
+                )))
+            query = query.filter(or_(*conditions))
+        return query.limit(page_size)
+
+    def count(self, db):
+        """Returns the number of results of this query against the given
+        StatikDatabase."""
+        query = self.build(db.session, db.tables[self.model_name]).params(**self.bound_params)
+        return query.order_by(None).count()
+
+    def execute(self, db):
+        """Executes this query against the given StatikDatabase.
+
+        Returns:
+            A list of the resulting model instances.
+        """
+        db_model = db.tables[self.model_name]
+        baked_query = db.query_bakery(
+            lambda session: self.build(session, db_model),
+            db_model,
+            self.key,
+        )
+        return baked_query(db.session).params(**self.bound_params).all()
+
+
+def keyset_equal(column, value):
+    return column.is_(None) if value is None else column == literal(value, type_=column.type)
+
+
+def keyset_after(column, descending, value):
+    """Returns the condition for a column's value to come after the given value
+    in the given order, where (as in SQLite) NULLs come first in ascending
+    order and last in descending order."""
+    if value is None:
+        return false() if descending else column.isnot(None)
+    # a literal, since SQLAlchemy only allows equality comparisons with the True/False constants
+    value = literal(value, type_=column.type)
+    return or_(column < value, column.is_(None)) if descending else column > value
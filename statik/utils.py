@@ -2,7 +2,9 @@
 
 import os
 import os.path
+import re
 from copy import deepcopy, copy
+from datetime import datetime, date, timedelta, timezone
 import shutil
 
 import logging
@@ -18,10 +20,22 @@ __all__ = [
     'add_url_path_component',
     'copy_tree',
     'calculate_association_table_name',
+    'calculate_related_table_name',
+    'iter_neighbours',
     'get_url_file_ext',
-    'generate_quickstart'
+    'generate_quickstart',
+    'parse_iso_datetime',
+    'ensure_path_exists',
 ]
 
+# the same timestamp formats that YAML understands
+ISO_DATETIME_RE = re.compile(
+    r'^(?P<year>[0-9]{4})-(?P<month>[0-9]{1,2})-(?P<day>[0-9]{1,2})'
+    r'(?:(?:[Tt]|[ \t]+)(?P<hour>[0-9]{1,2}):(?P<minute>[0-9]{2}):(?P<second>[0-9]{2})'
+    r'(?:\.(?P<fraction>[0-9]*))?'
+    r'(?:[ \t]*(?P<tz>Z|(?P<tz_sign>[-+])(?P<tz_hour>[0-9]{1,2})(?::?(?P<tz_minute>[0-9]{2}))?))?)?$'
+)
+
 DEFAULT_CONFIG_CONTENT = """project-name: Your project name
 base-path: /
 """
@@ -136,6 +150,24 @@ def calculate_association_table_name(model1_name, model2_name):
     return '%s%s' % (tuple(sorted([model1_name, model2_name])))
 
 
+def calculate_related_table_name(model_name, rel_name):
+    return '%s__%s' % (model_name, rel_name)
+
+
+def iter_neighbours(iterable):
+    """Yields a (previous item, item, next item) tuple for each item in the
+    given iterable, in a single pass (the previous item of the first item and
+    the next item of the last item are None)."""
+    prev_item, item, has_item = None, None, False
+    for next_item in iterable:
+        if has_item:
+            yield prev_item, item, next_item
+            prev_item = item
+        item, has_item = next_item, True
+    if has_item:
+        yield prev_item, item, None
+
+
 def get_url_file_ext(url):
     """Attempts to extract the file extension from the given URL."""
     # get the last part of the path component
@@ -167,3 +199,34 @@ def ensure_file_exists(path, default_content):
         logger.info('Creating file: %s' % path)
         with open(path, 'wt') as f:
             f.write(default_content)
+
+
+def parse_iso_datetime(value):
+    """Parses the given ISO 8601 date or date/time string in the same way as
+    YAML would parse a timestamp.
+
+    Returns:
+        A date object if the string only contains a date, otherwise a datetime
+        object (which is timezone-aware if the string contains a timezone).
+    """
+    match = ISO_DATETIME_RE.match(value.strip())
+    if match is None:
+        raise ValueError("Invalid ISO 8601 date/time value: %s" % value)
+
+    values = match.groupdict()
+    if values['hour'] is None:
+        return date(int(values['year']), int(values['month']), int(values['day']))
+
+    fraction = int((values['fraction'] or '0')[:6].ljust(6, '0'))
+    tzinfo = None
+    if values['tz'] == 'Z':
+        tzinfo = timezone.utc
+    elif values['tz'] is not None:
+        delta = timedelta(hours=int(values['tz_hour']), minutes=int(values['tz_minute'] or 0))
+        tzinfo = timezone(-delta if values['tz_sign'] == '-' else delta)
+
+    return datetime(
+        int(values['year']), int(values['month']), int(values['day']),
+        int(values['hour']), int(values['minute']), int(values['second']),
+        fraction, tzinfo=tzinfo
+    )
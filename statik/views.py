@@ -3,9 +3,11 @@
 import os.path
 
 from copy import deepcopy
+from collections import OrderedDict
 
 from statik.common import YamlLoadable
 from statik.errors import MissingParameterError
+from statik.query import StatikQuery
 from statik.utils import *
 
 import logging
@@ -13,9 +15,62 @@ logger = logging.getLogger(__name__)
 
 __all__ = [
     'StatikView',
+    'StatikGroup',
+    'StatikPage',
 ]
 
 
+class StatikGroup(object):
+    """A group of a grouped complex view's for-each instances, which is
+    available to the view's path and page templates as "group"."""
+
+    __slots__ = ['key', 'items']
+
+    def __init__(self, key, items=None):
+        self.key = key
+        # the instances in this group, in the order of the for-each result
+        self.items = items or []
+
+    def __repr__(self):
+        return '<StatikGroup key=%s items=%d>' % (self.key, len(self.items))
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+class StatikPage(object):
+    """A single page of a paginated view, which is available to the view's
+    template as "page"."""
+
+    __slots__ = ['number', 'count', 'page_size', 'total', 'items']
+
+    def __init__(self, number, count, page_size, total, items=None):
+        # the page number, starting from 1
+        self.number = number
+        # the total number of pages
+        self.count = count
+        self.page_size = page_size
+        # the total number of items, across all pages
+        self.total = total
+        self.items = items or []
+
+    def __repr__(self):
+        return '<StatikPage %d of %d>' % (self.number, self.count)
+
+    @property
+    def prev(self):
+        """The previous page number, if any."""
+        return self.number - 1 if self.number > 1 else None
+
+    @property
+    def next(self):
+        """The next page number, if any."""
+        return self.number + 1 if self.number < self.count else None
+
+
 class StatikView(YamlLoadable):
 
     def __init__(self, *args, **kwargs):
@@ -28,9 +83,30 @@ class StatikView(YamlLoadable):
         self.path_template = None
         self.path_variable = None
         self.path_query = None
+        # if set, the for-each query's results are streamed in batches of
+        # this size (or the database's default batch size if True)
+        self.stream = None
+        # whether each for-each instance's template context also contains its
+        # neighbours in the for-each result ("prev" and "next")
+        self.neighbours = False
+        # if set, the compiled template expression that gives the key (or
+        # list of keys) of each for-each instance's group(s), where the
+        # view's pages are rendered per group rather than per instance
+        self.group_by = None
+        # for paginated views: the name of the variable holding each page's
+        # items, the structured query for all of the items, the number of
+        # items per page and the path template for pages after the first
+        self.paginate_variable = None
+        self.paginate_query = None
+        self.page_size = None
+        self.page_path_template = None
         self.context = kwargs.get('initial_context', {})
         self.context_static = {}
         self.context_dynamic = {}
+        # relationships to preload, per context variable
+        self.eager_load = {}
+        # deferred fields to preload, per context variable
+        self.undefer = {}
         self.template_ext = '.html'
         self.default_output_filename = 'index'
 
@@ -87,6 +163,9 @@ class StatikView(YamlLoadable):
         self.template = self.template_env.get_template(template_path)
 
         self.configure_context()
+        self.configure_paginate()
+        self.configure_eager_load()
+        self.configure_undefer()
 
     def configure_complex_view(self, path):
         if 'template' not in path:
@@ -99,18 +178,138 @@ class StatikView(YamlLoadable):
         self.complex = True
         self.path_template = path['template']
         self.path_variable = list(path['for-each'].keys())[0]
-        self.path_query = list(path['for-each'].values())[0]
+        self.path_query = self.configure_query(list(path['for-each'].values())[0])
+
+        self.stream = path.get('stream', None) or None
+        if self.stream is not None and (not isinstance(self.stream, int) or self.stream < 0):
+            raise ValueError("Complex \"path\" variable's \"stream\" value must be true or a batch size in view: %s" % self.name)
+
+        self.neighbours = path.get('neighbours', False)
+        if not isinstance(self.neighbours, bool):
+            raise ValueError("Complex \"path\" variable's \"neighbours\" value must be true or false in view: %s" % self.name)
+        if self.neighbours and self.stream is not None:
+            # streamed instances are detached from the session once their batch has been rendered
+            raise ValueError("Complex \"path\" variable cannot have both \"stream\" and \"neighbours\" values in view: %s" % self.name)
+
+        if path.get('group-by', None) is not None:
+            if not isinstance(path['group-by'], str):
+                raise ValueError("Complex \"path\" variable's \"group-by\" value must be a template expression in view: %s" % self.name)
+            if self.stream is not None:
+                # all of the instances are needed to build the groups
+                raise ValueError("Complex \"path\" variable cannot have both \"stream\" and \"group-by\" values in view: %s" % self.name)
+            self.group_by = self.template_env.compile_expression(path['group-by'])
 
     def configure_simple_view(self, path):
         self.complex = False
 
+    def configure_query(self, query):
+        """Structured (dictionary) queries are validated and prepared up front;
+        query strings are passed through as-is."""
+        if isinstance(query, dict):
+            try:
+                return StatikQuery(query, self.models)
+            except ValueError as e:
+                raise ValueError("%s in view: %s" % (e, self.name))
+        return query
+
     def configure_context(self):
         if 'context' in self.vars:
             if 'static' in self.vars['context'] and isinstance(self.vars['context']['static'], dict):
                 self.context_static = underscore_var_names(deepcopy(self.vars['context']['static']))
 
             if 'dynamic' in self.vars['context'] and isinstance(self.vars['context']['dynamic'], dict):
-                self.context_dynamic = underscore_var_names(deepcopy(self.vars['context']['dynamic']))
+                self.context_dynamic = dict([
+                    (var, self.configure_query(query))
+                    for var, query in underscore_var_names(deepcopy(self.vars['context']['dynamic'])).items()
+                ])
+
+    def configure_paginate(self):
+        """Reads the pagination configuration for a simple view, where the
+        items are given by a structured query, and each page after the first
+        is output at the given path (rendered with its page number), e.g.:
+
+            paginate:
+              items:
+                posts:
+                  model: Post
+                  order: -published
+              page-size: 10
+              path: /page/{{ page }}/
+        """
+        paginate = self.vars.get('paginate', None)
+        if paginate is None:
+            return
+        if self.complex:
+            raise ValueError("Only simple views can be paginated in view: %s" % self.name)
+        if not isinstance(paginate, dict):
+            raise ValueError("\"paginate\" configuration must be a dictionary in view: %s" % self.name)
+        for key in ['items', 'page-size', 'path']:
+            if key not in paginate:
+                raise MissingParameterError("\"paginate\" configuration must contain a \"%s\" value in view: %s" % (
+                    key, self.name
+                ))
+        if not isinstance(paginate['items'], dict) or len(paginate['items']) != 1 or \
+                not isinstance(list(paginate['items'].values())[0], dict):
+            raise ValueError("\"paginate\" configuration's \"items\" value must be a single-valued dictionary " +
+                             "containing a structured query in view: %s" % self.name)
+        if not isinstance(paginate['page-size'], int) or paginate['page-size'] < 1:
+            raise ValueError("\"paginate\" configuration's \"page-size\" value must be a positive integer in view: %s" % self.name)
+
+        self.paginate_variable = list(paginate['items'].keys())[0].replace('-', '_')
+        self.paginate_query = self.configure_query(list(paginate['items'].values())[0])
+        if self.paginate_query.limit is not None:
+            raise ValueError("Paginated queries cannot have a \"limit\" value in view: %s" % self.name)
+        self.page_size = paginate['page-size']
+        self.page_path_template = paginate['path']
+
+    def configure_eager_load(self):
+        """Reads the relationships to preload for this view's for-each and
+        dynamic context variables, e.g.:
+
+            eager-load:
+              post: [author, tags]
+              posts: author
+        """
+        eager_load = self.vars.get('eager-load', None) or {}
+        if not isinstance(eager_load, dict):
+            raise ValueError("\"eager-load\" configuration must be a dictionary in view: %s" % self.name)
+
+        for var, relationships in underscore_var_names(deepcopy(eager_load)).items():
+            self.check_query_variable(var, 'eager-load')
+            if isinstance(relationships, str):
+                relationships = [relationships]
+            if not isinstance(relationships, list):
+                raise ValueError(
+                    "\"eager-load\" configuration for \"%s\" must be a list of relationships in view: %s" % (
+                        var, self.name
+                    )
+                )
+            self.eager_load[var] = relationships
+
+    def configure_undefer(self):
+        """Reads the deferred fields (see the models' "deferred" option) to load
+        up-front for this view's for-each and dynamic context variables,
+        e.g.:
+
+            undefer:
+              post: [content]
+        """
+        undefer = self.vars.get('undefer', None) or {}
+        if not isinstance(undefer, dict):
+            raise ValueError("\"undefer\" configuration must be a dictionary in view: %s" % self.name)
+
+        for var, fields in underscore_var_names(undefer).items():
+            self.check_query_variable(var, 'undefer')
+            fields = [fields] if isinstance(fields, str) else fields
+            if not isinstance(fields, list):
+                raise ValueError("Unrecognised \"undefer\" configuration for \"%s\" in view: %s" % (var, self.name))
+            self.undefer[var] = fields
+
+    def check_query_variable(self, var, config_name):
+        if var != self.path_variable and var != self.paginate_variable and var not in self.context_dynamic:
+            raise ValueError("Unrecognised variable \"%s\" in \"%s\" configuration in view: %s" % (
+                var, config_name, self.name
+            ))
 
     def process(self, db):
         self.context.update(self.context_static)
@@ -119,9 +318,15 @@ class StatikView(YamlLoadable):
 
     def process_complex(self, db):
         rendered_views = {}
-        path_var_instances = db.query(self.path_query)
-        logger.debug("Complex view %s generated %d possible path(s)" % (self.name, len(path_var_instances)))
-        for inst in path_var_instances:
+        instances = self.iter_path_var_instances(db)
+        if self.group_by is not None:
+            instances = self.group_instances(instances)
+        if self.neighbours:
+            instances = iter_neighbours(instances)
+        else:
+            # no lookahead, so that streamed instances are rendered before their batch is released
+            instances = ((None, inst, None) for inst in instances)
+        for prev_inst, inst, next_inst in instances:
             # render the path template to get this instance's view path
             inst_path = self.reverse_url(inst=inst)
             inst_path_ext = get_url_file_ext(inst_path)
@@ -132,8 +337,11 @@ class StatikView(YamlLoadable):
                         '%s%s' % (self.default_output_filename, self.template_ext)
                 )
 
-            # update the context with the current path variable instance
-            self.context[self.path_variable] = inst
+            # update the context with the current path variable instance (or group)
+            self.context[self.page_variable] = inst
+            if self.neighbours:
+                self.context['prev'] = prev_inst
+                self.context['next'] = next_inst
             # render the template itself
             rendered_view = self.template.render(**self.context)
             rendered_views = deep_merge_dict(
@@ -142,29 +350,115 @@ class StatikView(YamlLoadable):
             )
         return rendered_views
 
+    def iter_path_var_instances(self, db):
+        """Yields the instances of this complex view's path variable, either
+        from the (cached) query result or, when streaming, batch by batch."""
+        if self.stream is not None:
+            batches = db.stream(self.path_query, batch_size=None if self.stream is True else self.stream)
+        else:
+            batches = [db.query(self.path_query)]
+
+        instance_count = 0
+        for batch in batches:
+            batch = db.preload(
+                batch,
+                relationships=self.eager_load.get(self.path_variable, None),
+                fields=self.undefer.get(self.path_variable, None),
+            )
+            for inst in batch:
+                instance_count += 1
+                yield inst
+        logger.debug("Complex view %s generated %d possible path(s)" % (self.name, instance_count))
+
+    def group_instances(self, instances):
+        """Partitions the given for-each instances into groups in a single
+        pass, where an instance whose group-by expression gives a list of keys
+        belongs to the group of each of those keys.
+
+        Returns:
+            A list of StatikGroup objects, in the order in which their first
+            instances appear.
+        """
+        groups = OrderedDict()
+        for inst in instances:
+            keys = self.group_by(**{self.path_variable: inst})
+            for key in (keys if isinstance(keys, (list, tuple)) else [keys]):
+                if key is None:
+                    continue
+                if key not in groups:
+                    groups[key] = StatikGroup(key)
+                groups[key].items.append(inst)
+        logger.debug("Complex view %s has %d group(s)" % (self.name, len(groups)))
+        return list(groups.values())
+
+    @property
+    def page_variable(self):
+        """The name of the variable for each of a complex view's pages: its
+        for-each variable, or "group" for grouped views."""
+        return 'group' if self.group_by is not None else self.path_variable
+
     def process_simple(self, db):
-        inst_path_ext = get_url_file_ext(self.path)
+        if self.paginate_query is not None:
+            return self.process_paginated(db)
+        return self.render_simple(self.path)
+
+    def render_simple(self, path):
+        inst_path_ext = get_url_file_ext(path)
         if inst_path_ext is None or len(inst_path_ext) == 0:
-            path = add_url_path_component(self.path, '%s%s' % (self.default_output_filename, self.template_ext))
-        else:
-            path = self.path
+            path = add_url_path_component(path, '%s%s' % (self.default_output_filename, self.template_ext))
         return dict_from_path(
             path,
             final_value=self.template.render(**self.context),
         )
 
+    def process_paginated(self, db):
+        """Renders each page of a paginated view, fetching one page of items
+        at a time."""
+        total, pages = db.paginate(self.paginate_query, self.page_size)
+        count = max(1, (total + self.page_size - 1) // self.page_size)
+        rendered_views = {}
+        for number, items in enumerate(pages, start=1):
+            items = db.preload(
+                items,
+                relationships=self.eager_load.get(self.paginate_variable, None),
+                fields=self.undefer.get(self.paginate_variable, None),
+            )
+            rendered_views = deep_merge_dict(
+                rendered_views,
+                self.render_page(StatikPage(number, count, self.page_size, total, items=items)),
+            )
+        if total == 0:
+            rendered_views = self.render_page(StatikPage(1, count, self.page_size, total))
+        logger.debug("Paginated view %s generated %d page(s)" % (self.name, count))
+        return rendered_views
+
+    def render_page(self, page):
+        self.context[self.paginate_variable] = page.items
+        self.context['page'] = page
+        return self.render_simple(self.reverse_url(page.number) if page.number > 1 else self.path)
+
     def process_context_dynamic(self, db):
         result = {}
         for var, query in self.context_dynamic.items():
-            result[var] = db.query(query)
+            result[var] = db.preload(
+                db.query(query),
+                relationships=self.eager_load.get(var, None),
+                fields=self.undefer.get(var, None),
+            )
         return result
 
     def reverse_url(self, inst=None):
-        """Returns the reverse lookup URL for this view."""
-        result = self.template_env.from_string(
-            self.path_template
-        ).render(
-            **{self.path_variable: inst}
-        ) if self.complex else self.path
+        """Returns the reverse lookup URL for this view (or, for paginated
+        views, the URL of the given page number). For grouped views, inst is
+        either a StatikGroup or a group key: to link to the group of an
+        instance, pass its key (e.g. {% url "tags", chapter.tags[0] %})."""
+        if self.complex and self.group_by is not None and not isinstance(inst, StatikGroup):
+            result = self.template_env.from_string(self.path_template).render(group=StatikGroup(inst))
+        elif self.complex:
+            result = self.template_env.from_string(self.path_template).render(**{self.page_variable: inst})
+        elif self.paginate_query is not None and isinstance(inst, int) and inst > 1:
+            result = self.template_env.from_string(self.page_path_template).render(page=inst)
+        else:
+            result = self.path
 
         return result if result.endswith('/') else ('%s/' % result)
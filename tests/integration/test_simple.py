@@ -1,11 +1,18 @@
 # -*- coding:utf-8 -*-
 
 import os.path
+import shutil
+import tempfile
 import xml.etree.ElementTree as ET
 import unittest
 
 import statik
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 class TestSimpleStatikIntegration(unittest.TestCase):
 
@@ -71,6 +78,14 @@ class TestSimpleStatikIntegration(unittest.TestCase):
                 post_content_text
         )
 
+        # Structured queries, eager loading and undeferred columns must not
+        # change the rendered posts
+        for prefix in ['structured', 'eager', 'undeferred']:
+            self.assertEqual(
+                output_data['2016']['06']['15']['my-first-post']['index.html'],
+                output_data[prefix]['2016']['06']['15']['my-first-post']['index.html'],
+            )
+
         bio = ET.fromstring(output_data['bios']['michael']['index.html'])
         self.assertEqual('html', bio.findall('.')[0].tag)
         self.assertEqual('Michael Anderson', bio.findall('./head/title')[0].text.strip())
@@ -94,6 +109,116 @@ class TestSimpleStatikIntegration(unittest.TestCase):
         bio_content_text = get_plain_text_in_el(bio_content)
         self.assertEqual("Here's Andrew's bio!", bio_content_text)
 
+        # Streaming the query's results must not change the rendered bios
+        for author in ['andrew', 'michael']:
+            self.assertEqual(
+                output_data['bios'][author]['index.html'],
+                output_data['bios-streamed'][author]['index.html'],
+            )
+
+        # Test the paginated view
+        authors = ET.fromstring(output_data['authors']['index.html'])
+        self.assertEqual('Authors (page 1 of 2)', authors.findall('./head/title')[0].text.strip())
+        self.assertEqual('/bios/michael/', authors.findall('./body/ul/li/a')[0].attrib['href'])
+        self.assertEqual([], authors.findall(".//a[@class='prev']"))
+        self.assertEqual('/authors/page/2/', authors.findall(".//a[@class='next']")[0].attrib['href'])
+        authors = ET.fromstring(output_data['authors']['page']['2']['index.html'])
+        self.assertEqual('Authors (page 2 of 2)', authors.findall('./head/title')[0].text.strip())
+        self.assertEqual('/bios/andrew/', authors.findall('./body/ul/li/a')[0].attrib['href'])
+        self.assertEqual('/authors/', authors.findall(".//a[@class='prev']")[0].attrib['href'])
+        self.assertEqual([], authors.findall(".//a[@class='next']"))
+
+    def test_in_memory_parallel(self):
+        test_path = os.path.dirname(os.path.realpath(__file__))
+        project_path = os.path.join(test_path, 'data-simple')
+
+        # Parsing the data files across worker processes must produce exactly
+        # the same output as parsing them in the current process
+        self.assertEqual(
+            statik.generate(project_path, in_memory=True),
+            statik.generate(project_path, in_memory=True, jobs=2),
+        )
+
+    def test_in_memory_lazy_content(self):
+        test_path = os.path.dirname(os.path.realpath(__file__))
+        project_path = os.path.join(test_path, 'data-simple')
+
+        # Deferring the conversion of Markdown content until it is rendered
+        # must not change the output
+        self.assertEqual(
+            statik.generate(project_path, in_memory=True),
+            statik.generate(project_path, in_memory=True, lazy_content=True),
+        )
+
+    def test_in_memory_low_memory(self):
+        test_path = os.path.dirname(os.path.realpath(__file__))
+        project_path = os.path.join(test_path, 'data-simple')
+
+        # Loading data in low memory mode, and compressing content, must not
+        # change the output
+        expected = statik.generate(project_path, in_memory=True)
+        self.assertEqual(
+            expected,
+            statik.generate(project_path, in_memory=True, jobs=2, low_memory=True, compress_content=True),
+        )
+        self.assertEqual(
+            expected,
+            statik.generate(project_path, in_memory=True, lazy_content=True, compress_content=True),
+        )
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_in_memory_columnar(self):
+        test_path = os.path.dirname(os.path.realpath(__file__))
+        project_path = os.path.join(test_path, 'data-simple')
+
+        # Executing structured queries against the columnar store must not
+        # change the output
+        self.assertEqual(
+            statik.generate(project_path, in_memory=True),
+            statik.generate(project_path, in_memory=True, columnar=True),
+        )
+
+    def test_build_farm(self):
+        test_path = os.path.dirname(os.path.realpath(__file__))
+        project_path = os.path.join(test_path, 'data-simple')
+        expected = statik.generate(project_path, in_memory=True)
+
+        # Projects built by the same worker processes must not interfere with
+        # each other, and a failed build must not affect the others
+        with statik.StatikBuildFarm(processes=2, builds_per_worker=2) as farm:
+            results = farm.build(
+                [project_path, os.path.join(test_path, 'missing-project'), project_path, project_path],
+                in_memory=True,
+            )
+        self.assertEqual([True, False, True, True], [result.succeeded for result in results])
+        self.assertIn('missing-project', results[1].input_path)
+        for result in [results[0], results[2], results[3]]:
+            self.assertEqual(expected, result.result)
+
+    def test_build_farm_after_mapper_failure(self):
+        test_path = os.path.dirname(os.path.realpath(__file__))
+        project_path = os.path.join(test_path, 'data-simple')
+        expected = statik.generate(project_path, in_memory=True)
+
+        temp_path = tempfile.mkdtemp()
+        try:
+            # both of the foreign keys to Author claim the same "posts"
+            # relationship, so the project's mappers can't be configured
+            broken_path = os.path.join(temp_path, 'broken-project')
+            shutil.copytree(project_path, broken_path)
+            with open(os.path.join(broken_path, 'models', 'Post.yml'), 'rt') as f:
+                post_model = f.read().replace("author:    Author", "author:    Author -> posts")
+            with open(os.path.join(broken_path, 'models', 'Post.yml'), 'wt') as f:
+                f.write(post_model + "editor:    Author -> posts\n")
+
+            # a single worker process builds both projects
+            with statik.StatikBuildFarm(processes=1) as farm:
+                results = farm.build([broken_path, project_path], in_memory=True)
+        finally:
+            shutil.rmtree(temp_path)
+        self.assertEqual([False, True], [result.succeeded for result in results])
+        self.assertEqual(expected, results[1].result)
+
 
 def strip_str(s):
     """Strips out newlines and whitespace from the given string."""
@@ -0,0 +1,79 @@
+# -*- coding:utf-8 -*-
+
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from statik.cache import StatikCache
+from statik.database import parse_data_file
+
+TEST_DATA_FILE = """---
+title: Cached post
+---
+This is the **cached** content.
+"""
+
+TEST_DATA_FILE_CHANGED = """---
+title: Changed post
+---
+This is the **changed** content.
+"""
+
+
+class TestStatikCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_path = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.temp_path, '.statik-cache')
+        self.data_file = os.path.join(self.temp_path, 'cached-post.md')
+        write_file(self.data_file, TEST_DATA_FILE)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_path)
+
+    def test_cache(self):
+        cache = StatikCache(self.cache_path)
+        cache.prepare()
+        self.assertIsNone(cache.get(self.data_file))
+
+        name, data_vars, content = parse_data_file(self.data_file, cache=cache)
+        self.assertEqual('cached-post', name)
+        self.assertEqual({'title': 'Cached post'}, data_vars)
+        self.assertEqual(
+            (name, data_vars, content),
+            StatikCache(self.cache_path).get(self.data_file)
+        )
+
+        # touching the file without changing its content must not invalidate
+        # its cache entry
+        stat = os.stat(self.data_file)
+        os.utime(self.data_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+        self.assertEqual((name, data_vars, content), cache.get(self.data_file))
+
+        write_file(self.data_file, TEST_DATA_FILE_CHANGED)
+        os.utime(self.data_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2000000000))
+        self.assertIsNone(cache.get(self.data_file))
+        self.assertEqual({'title': 'Changed post'}, parse_data_file(self.data_file, cache=cache)[1])
+
+    def test_cache_signature(self):
+        cache = StatikCache(self.cache_path)
+        cache.prepare()
+        parse_data_file(self.data_file, cache=cache)
+
+        # a cache with a different signature must not see the old entries,
+        # which must be cleaned up
+        other_cache = StatikCache(self.cache_path, signature='other')
+        other_cache.prepare()
+        self.assertIsNone(other_cache.get(self.data_file))
+        self.assertFalse(os.path.isdir(cache.data_path))
+
+
+def write_file(filename, content):
+    with open(filename, 'wt') as f:
+        f.write(content)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,158 @@
+# -*- coding:utf-8 -*-
+
+import os.path
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+from statik.models import *
+from statik.database import *
+from statik.query import *
+from statik.columnar import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MODEL_NAMES = ['Shop', 'Product', 'Category', 'Section']
+
+MODELS = {
+    'Shop': StatikModel(
+        name='Shop',
+        from_string="title: String\n_meta:\n  aggregates:\n    product-count: {count: products}\n",
+        model_names=MODEL_NAMES,
+    ),
+    'Category': StatikModel(name='Category', from_string="title: String\n", model_names=MODEL_NAMES),
+    'Product': StatikModel(
+        name='Product',
+        from_string="shop: Shop -> products\ncategories: Category[] -> products\ntitle: String\n" +
+                    "price: Integer\nin-stock: Boolean\nlisted: DateTime\ndescription: Text\n" +
+                    "_meta:\n  related:\n    similar: categories\n",
+        model_names=MODEL_NAMES,
+    ),
+    'Section': StatikModel(
+        name='Section',
+        from_string="parent: Section -> children\ntitle: String\nposition: Integer\n" +
+                    "_meta:\n  tree:\n    parent: parent\n    order: [-position]\n",
+        model_names=MODEL_NAMES,
+    ),
+}
+
+QUERIES = [
+    {'model': 'Product'},
+    {'model': 'Product', 'order': 'title'},
+    {'model': 'Product', 'order': ['-price', 'title']},
+    {'model': 'Product', 'order': 'price'},
+    {'model': 'Product', 'order': '-listed', 'limit': 3},
+    {'model': 'Product', 'filter': {'in-stock': True}, 'order': 'pk'},
+    {'model': 'Product', 'filter': {'price': {'>=': 10, '<': 40}}, 'order': 'price'},
+    {'model': 'Product', 'filter': {'price': None}},
+    {'model': 'Product', 'filter': {'price': {'!=': None}}, 'order': '-pk'},
+    {'model': 'Product', 'filter': {'shop': 'north'}, 'order': 'pk'},
+    {'model': 'Product', 'filter': {'listed': {'>': datetime(2016, 3, 1)}}, 'order': 'listed'},
+    {'model': 'Product', 'filter': {'pk': {'in': ['p1', 'p3', 'p9']}}, 'order': 'pk'},
+    {'model': 'Product', 'filter': {'title': {'<': 'Product 3'}}, 'order': 'title'},
+    {'model': 'Shop', 'order': '-title'},
+    {'model': 'Shop', 'filter': {'title': {'<': 'South'}}, 'order': 'pk'},
+    {'model': 'Shop', 'filter': {'title': {'>=': 'North'}}, 'order': 'pk'},
+    {'model': 'Shop', 'filter': {'product-count': {'>': 0}}, 'order': ['-product-count', 'pk']},
+]
+
+
+@unittest.skipIf(numpy is None, "NumPy is not installed")
+class TestStatikColumnarStore(unittest.TestCase):
+
+    def setUp(self):
+        self.data_path = tempfile.mkdtemp()
+        for model_name in MODEL_NAMES:
+            os.makedirs(os.path.join(self.data_path, model_name))
+        with open(os.path.join(self.data_path, 'Shop', '_all.yml'), 'wt') as f:
+            f.write("- pk: north\n  title: North\n- pk: south\n  title: South\n- pk: empty\n")
+        with open(os.path.join(self.data_path, 'Category', '_all.yml'), 'wt') as f:
+            f.write("- pk: tools\n  title: Tools\n- pk: toys\n  title: Toys\n")
+        with open(os.path.join(self.data_path, 'Product', '_all.yml'), 'wt') as f:
+            for i in range(8):
+                f.write("- pk: p%d\n  title: Product %d\n  description: Describing product %d\n" % (i, i % 5, i))
+                if i % 3 != 0:
+                    f.write("  shop: %s\n  price: %d\n  listed: 2016-%02d-01\n" % (
+                        'north' if i % 2 else 'south', (i * 7) % 50, i + 1,
+                    ))
+                f.write("  in-stock: %s\n  categories: %s\n" % (
+                    'true' if i % 2 else 'false', ['toys', 'tools'][:i % 3],
+                ))
+        with open(os.path.join(self.data_path, 'Section', '_all.yml'), 'wt') as f:
+            f.write(
+                "- pk: root\n"
+                "- pk: a\n  parent: root\n  position: 1\n"
+                "- pk: b\n  parent: root\n  position: 3\n"
+                "- pk: a1\n  parent: a\n  position: 1\n"
+                "- pk: b1\n  parent: b\n  position: 1\n"
+                "- pk: b2\n  parent: b\n  position: 2\n"
+                "- pk: b21\n  parent: b2\n"
+                "- pk: other\n  position: 5\n"
+            )
+        self.db = StatikDatabase(self.data_path, MODELS, columnar=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.data_path)
+
+    def test_queries(self):
+        for spec in QUERIES:
+            query = StatikQuery(spec, MODELS)
+            rows = self.db.columnar.execute(query)
+            instances = query.execute(self.db)
+            self.assertTrue(all([isinstance(row, StatikRow) for row in rows]))
+            if 'order' in spec:
+                self.assertEqual([inst.pk for inst in instances], [row.pk for row in rows], spec)
+            else:
+                self.assertEqual(set([inst.pk for inst in instances]), set([row.pk for row in rows]), spec)
+
+        # structured queries are executed against the columnar store
+        self.assertIsInstance(self.db.query(StatikQuery({'model': 'Product'}, MODELS))[0], StatikRow)
+
+    def test_rows(self):
+        rows = self.db.columnar.execute(StatikQuery({'model': 'Product', 'order': 'pk'}, MODELS))
+        instances = StatikQuery({'model': 'Product', 'order': 'pk'}, MODELS).execute(self.db)
+        for row, inst in zip(rows, instances):
+            for field_name in ['pk', 'title', 'price', 'in_stock', 'listed', 'description', 'shop_id']:
+                self.assertEqual(getattr(inst, field_name), getattr(row, field_name))
+            self.assertEqual(inst.shop.pk if inst.shop else None, row.shop.pk if row.shop else None)
+            self.assertEqual([c.pk for c in inst.categories], [c.pk for c in row.categories])
+            self.assertEqual([p.pk for p in inst.similar], [p.pk for p in row.similar])
+
+        shops = self.db.columnar.execute(StatikQuery({'model': 'Shop', 'order': 'pk'}, MODELS))
+        self.assertEqual(['empty', 'north', 'south'], [shop.pk for shop in shops])
+        self.assertEqual([], shops[0].products)
+        self.assertEqual(['p1', 'p5', 'p7'], sorted([product.pk for product in shops[1].products]))
+        categories = self.db.columnar.execute(StatikQuery({'model': 'Category', 'order': 'pk'}, MODELS))
+        self.assertEqual(['p2', 'p5'], sorted([product.pk for product in categories[0].products]))
+        self.assertEqual(rows[2].shop, shops[2])
+        self.assertIsNone(shops[0].title)
+        self.assertEqual([0, 3, 2], [shop.product_count for shop in shops])
+
+        with self.assertRaises(AttributeError):
+            rows[0].missing_field
+
+    def test_tree(self):
+        rows = self.db.columnar.execute(StatikQuery({'model': 'Section', 'order': 'pk'}, MODELS))
+        instances = StatikQuery({'model': 'Section', 'order': 'pk'}, MODELS).execute(self.db)
+        self.assertEqual(8, len(rows))
+        for row, inst in zip(rows, instances):
+            for field_name in ['pk', 'parent_id', 'tree_depth', 'tree_order', 'tree_size', 'tree_path']:
+                self.assertEqual(getattr(inst, field_name), getattr(row, field_name))
+            # relationship order matters for navigation
+            for rel_name in ['children', 'tree_ancestors', 'tree_descendants']:
+                self.assertEqual(
+                    [other.pk for other in getattr(inst, rel_name)],
+                    [other.pk for other in getattr(row, rel_name)],
+                    (inst.pk, rel_name),
+                )
+        root = [row for row in rows if row.pk == 'root'][0]
+        self.assertEqual(['b', 'a'], [child.pk for child in root.children])
+        self.assertEqual(['b', 'b2', 'b21', 'b1', 'a', 'a1'], [row.pk for row in root.tree_descendants])
+
+
+if __name__ == "__main__":
+    unittest.main()
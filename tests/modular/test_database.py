@@ -1,11 +1,23 @@
 # -*- coding:utf-8 -*-
 
 import os.path
+import shutil
+import tempfile
+import functools
 import unittest
 import logging
+from datetime import datetime
+
+from unittest.mock import patch
+
+from sqlalchemy import inspect, event
+from sqlalchemy.engine import Engine
 
 from statik.models import *
 from statik.database import *
+from statik.database import StatikBulkLoader
+from statik.query import StatikQuery
+from statik.errors import DanglingReferenceError, InvalidModelCollectionDataError, UnknownFieldError
 
 GUEST_MODEL = """first-name: String
 last-name: String
@@ -48,6 +60,18 @@ class TestStatikDatabase(unittest.TestCase):
             level=logging.DEBUG,
             format='%(asctime)s\t%(name)s\t%(levelname)s\t%(message)s',
         )
+        # a scratch folder for tests' own data (and database) files
+        self.temp_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_path)
+        self.data_path = os.path.join(self.temp_path, 'data')
+
+    def write_data_file(self, model_name, filename, content):
+        """Writes the given content to a data file for the given model in
+        the scratch data folder."""
+        model_data_path = os.path.join(self.data_path, model_name)
+        os.makedirs(model_data_path, exist_ok=True)
+        with open(os.path.join(model_data_path, filename), 'wt') as f:
+            f.write(content)
 
     def test_database(self):
         data_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data_test_database')
@@ -129,6 +153,628 @@ class TestStatikDatabase(unittest.TestCase):
         self.assertIn('single-bed', redroom_tags)
         self.assertIn('shower', redroom_tags)
 
+    def test_independent_databases(self):
+        data_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data_test_database')
+        db = StatikDatabase(data_path, MOCK_MODELS)
+        GuesthouseRoom = db.tables['GuesthouseRoom']
+        rooms = db.query("session.query(GuesthouseRoom).order_by(GuesthouseRoom.room_name).all()")
+
+        # another database built from the same models must be independent of
+        # this one
+        other_db = StatikDatabase(data_path, MOCK_MODELS)
+        self.assertIsNot(GuesthouseRoom, other_db.tables['GuesthouseRoom'])
+        other_rooms = other_db.query("session.query(GuesthouseRoom).order_by(GuesthouseRoom.room_name).all()")
+        self.assertEqual([room.pk for room in rooms], [room.pk for room in other_rooms])
+        self.assertIsInstance(rooms[0], GuesthouseRoom)
+        self.assertIsInstance(other_rooms[0], other_db.tables['GuesthouseRoom'])
+        self.assertEqual(set([tag.pk for tag in rooms[0].tags]), set([tag.pk for tag in other_rooms[0].tags]))
+        self.assertEqual(5, len(db.query("session.query(RoomTag).all()")))
+
+        # query strings can join through ManyToMany association tables
+        fireplace_rooms = db.query(
+            "session.query(GuesthouseRoom).join(GuesthouseRoomRoomTag)"
+            ".filter(GuesthouseRoomRoomTag.c.roomtag_pk == 'fireplace').order_by(GuesthouseRoom.pk).all()"
+        )
+        self.assertEqual([room.pk for room in rooms], [room.pk for room in fireplace_rooms])
+        self.assertEqual(1, len(db.query(
+            "session.query(GuesthouseRoom).join(GuesthouseRoomRoomTag)"
+            ".filter(GuesthouseRoomRoomTag.c.roomtag_pk == 'balcony').all()"
+        )))
+
+    def test_query_cache(self):
+        data_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data_test_database')
+        db = StatikDatabase(data_path, MOCK_MODELS)
+        Guest = db.tables['Guest']
+        guests = db.session.query(Guest).order_by(Guest.last_name).all()
+
+        # identical queries must only be executed once
+        query = "session.query(Guest).order_by(Guest.last_name).all()"
+        self.assertEqual(guests, db.query(query))
+        self.assertIs(db.query(query), db.query(' %s ' % query))
+        self.assertEqual((2, 1), (db.query_cache_hits, db.query_cache_misses))
+        self.assertIsNot(db.query(query), db.query(query, cache_result=False))
+
+    def test_indexes(self):
+        model_names = ['Visitor', 'Suite', 'Feature', 'Stay']
+        models = {
+            'Visitor': StatikModel(name='Visitor', from_string="full-name: String\n", model_names=model_names),
+            'Suite': StatikModel(
+                name='Suite', from_string="title: String\nfeatures: Feature[] -> suites\n", model_names=model_names,
+            ),
+            'Feature': StatikModel(name='Feature', from_string="title: String\n", model_names=model_names),
+            'Stay': StatikModel(
+                name='Stay',
+                from_string="visitor: Visitor\nsuite: Suite -> stays\narrival: DateTime\ndeparture: DateTime\n" +
+                            "_meta:\n  indexes:\n    - arrival\n    - [suite, arrival]\n    - visitor\n",
+                model_names=model_names,
+            ),
+        }
+        db = StatikDatabase(self.data_path, models)
+
+        # declared and automatic indexes
+        stay_indexes = dict([
+            (index['name'], index['column_names']) for index in inspect(db.engine).get_indexes('Stay')
+        ])
+        self.assertEqual(['arrival'], stay_indexes['ix_Stay_arrival'])
+        self.assertEqual(['suite_id', 'arrival'], stay_indexes['ix_Stay_suite_id_arrival'])
+        # foreign keys are already indexed
+        self.assertEqual(1, list(stay_indexes.values()).count(['visitor_id']))
+        self.assertEqual(2, len(inspect(db.engine).get_indexes('FeatureSuite')))
+
+    def test_collection_formats(self):
+        model_names = ['Lodge', 'Amenity', 'Rating']
+        models = {
+            'Lodge': StatikModel(name='Lodge', from_string="title: String\n", model_names=model_names),
+            'Amenity': StatikModel(
+                name='Amenity', from_string="lodge: Lodge -> amenities\ndescription: String\n", model_names=model_names,
+            ),
+            'Rating': StatikModel(
+                name='Rating', from_string="lodge: Lodge -> ratings\nscore: Integer\nposted: DateTime\n",
+                model_names=model_names,
+            ),
+        }
+        self.write_data_file('Lodge', 'firefly.yml', "title: Firefly\n")
+        self.write_data_file('Lodge', 'redcottage.yml', "title: Red Cottage\n")
+        self.write_data_file('Amenity', '_all.yml', (
+            "# a stream of documents, one instance per document\n" +
+            "pk: firefly-pool\nlodge: firefly\ndescription: Swimming pool\n---\n" +
+            "pk: redcottage-garden\nlodge: redcottage\ndescription: Garden\n---\n" +
+            "pk: redcottage-parking\nlodge: redcottage\ndescription: Parking\n"
+        ))
+        self.write_data_file('Rating', '_all.jsonl', (
+            '{"pk": "1", "lodge": "redcottage", "score": 4, "posted": "2016-08-05T10:15:00"}\n' +
+            '{"pk": "2", "lodge": "firefly", "score": 5, "posted": "2016-08-04"}\n'
+        ))
+        db = StatikDatabase(self.data_path, models)
+        Lodge, Amenity, Rating = db.tables['Lodge'], db.tables['Amenity'], db.tables['Rating']
+        firefly, redcottage = db.session.query(Lodge).order_by(Lodge.pk).all()
+
+        # amenities are loaded from a YAML stream, one instance per document
+        amenities = db.session.query(Amenity).order_by(Amenity.pk).all()
+        self.assertEqual(['firefly-pool', 'redcottage-garden', 'redcottage-parking'], [a.pk for a in amenities])
+        self.assertInstanceEqual({'lodge': firefly, 'description': 'Swimming pool'}, amenities[0])
+        self.assertEqual(['Garden', 'Parking'], sorted([a.description for a in redcottage.amenities]))
+
+        # ratings are loaded from a JSON Lines collection
+        ratings = db.session.query(Rating).order_by(Rating.pk).all()
+        self.assertEqual(2, len(ratings))
+        self.assertInstanceEqual({
+            'lodge': redcottage,
+            'score': 4,
+            'posted': datetime(2016, 8, 5, 10, 15),
+        }, ratings[0])
+        self.assertEqual([ratings[1]], firefly.ratings)
+
+    def test_dangling_references(self):
+        model_names = ['Article', 'Writer', 'Label', 'Series']
+        models = {
+            'Article': StatikModel(
+                name='Article',
+                from_string="writer: Writer\nlabels: Label[]\nseries: Series[]\n",
+                model_names=model_names,
+            ),
+            'Writer': StatikModel(name='Writer', from_string="full-name: String\n", model_names=model_names),
+            'Label': StatikModel(name='Label', from_string="title: String\n", model_names=model_names),
+            # loaded after Article (which it refers to), so references to it are only checked once all of the
+            # data has been loaded
+            'Series': StatikModel(name='Series', from_string="title: String\npilot: Article\n",
+                                  model_names=model_names),
+        }
+        self.write_data_file('Writer', 'jane.yml', "full-name: Jane\n")
+        self.write_data_file('Label', '_all.yml', "- pk: news\n  title: News\n")
+        self.write_data_file('Article', '_all.yml', (
+            "- pk: first\n  writer: jane\n  labels: [news, missing-label]\n  series: [missing-series]\n" +
+            "- pk: second\n  writer: missing-writer\n  labels: [news]\n  series: [missing-series]\n" +
+            "- pk: third\n  writer: jane\n  series: [missing-series]\n"
+        ))
+
+        # all of the dangling references must be reported together
+        with self.assertRaises(DanglingReferenceError) as cm:
+            StatikDatabase(self.data_path, models)
+        self.assertEqual(
+            {
+                ('Article', 'first', 'labels', 'Label', 'missing-label'),
+                ('Article', 'second', 'writer', 'Writer', 'missing-writer'),
+                ('Article', 'first', 'series', 'Series', 'missing-series'),
+                ('Article', 'second', 'series', 'Series', 'missing-series'),
+                ('Article', 'third', 'series', 'Series', 'missing-series'),
+            },
+            set(cm.exception.references)
+        )
+
+    def test_unknown_fields(self):
+        model_names = ['Essay', 'Critic']
+        models = {
+            'Essay': StatikModel(
+                name='Essay',
+                from_string="title: String\ncritic: Critic\n",
+                model_names=model_names,
+            ),
+            'Critic': StatikModel(name='Critic', from_string="full-name: String\n", model_names=model_names),
+        }
+        self.write_data_file('Critic', '_all.csv', "pk,full-name\njane,Jane\n")
+        self.write_data_file('Essay', 'first.yml', "title: First\ncritic: jane\n")
+        self.write_data_file('Essay', 'second.yml', "titel: Second\ncritic: jane\n")
+
+        # misspelled fields must be reported, naming the model and the file they came from
+        with self.assertRaises(UnknownFieldError) as cm:
+            StatikDatabase(self.data_path, models)
+        self.assertIn('titel', str(cm.exception))
+        self.assertIn('Essay', str(cm.exception))
+        self.assertIn('second.yml', str(cm.exception))
+
+        os.remove(os.path.join(self.data_path, 'Essay', 'second.yml'))
+        self.write_data_file('Critic', '_all.csv', "pk,full-name,nickname\njane,Jane,JJ\n")
+        with self.assertRaises(UnknownFieldError) as cm:
+            StatikDatabase(self.data_path, models)
+        self.assertIn('nickname', str(cm.exception))
+        self.assertIn('_all.csv', str(cm.exception))
+
+    def test_bulk_loading(self):
+        model_names = ['Record', 'Style', 'Imprint']
+        models = {
+            'Record': StatikModel(
+                name='Record', from_string="imprint: Imprint\nstyles: Style[] -> records\n", model_names=model_names,
+            ),
+            'Style': StatikModel(name='Style', from_string="title: String\n", model_names=model_names),
+            'Imprint': StatikModel(name='Imprint', from_string="title: String\n", model_names=model_names),
+        }
+        # one fewer than, exactly and one more than a multiple of the batch size
+        self.write_data_file('Imprint', '_all.yml', ''.join([
+            "- pk: imprint%d\n  title: Imprint\n" % i for i in range(5)
+        ]))
+        self.write_data_file('Style', '_all.yml', ''.join(["- pk: style%d\n  title: Style\n" % i for i in range(6)]))
+        self.write_data_file('Record', '_all.yml', ''.join([
+            "- pk: record%d\n  imprint: imprint%d\n  styles: [%s]\n" % (
+                i, i % 5, ', '.join(['style%d' % j for j in range(i % 3)])
+            )
+            for i in range(7)
+        ]))
+
+        executed = []
+
+        def record_insert(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith('INSERT'):
+                executed.append((statement.split()[2].strip('"'), len(parameters) if executemany else 1))
+
+        def record_commit(conn):
+            executed.append('commit')
+
+        event.listen(Engine, 'before_cursor_execute', record_insert)
+        self.addCleanup(event.remove, Engine, 'before_cursor_execute', record_insert)
+        event.listen(Engine, 'commit', record_commit)
+        self.addCleanup(event.remove, Engine, 'commit', record_commit)
+        with patch('statik.database.StatikBulkLoader',
+                   functools.partial(StatikBulkLoader, batch_size=3, commit_size=7)):
+            db = StatikDatabase(self.data_path, models)
+
+        # full batches are inserted as they fill up, and the remainder once each model is loaded; association
+        # rows (0 + 1 + 2 + 0 + 1 + 2 + 0 of them) are batched separately, and commits happen every 7 rows
+        start = executed.index(('Imprint', 3))
+        self.assertEqual([
+            ('Imprint', 3), ('Imprint', 2), 'commit',
+            ('Style', 3), ('Style', 3), 'commit',
+            ('Record', 3), ('RecordStyle', 3), ('Record', 3), 'commit', ('RecordStyle', 3), ('Record', 1), 'commit',
+        ], executed[start:start+13])
+
+        Record, Style = db.tables['Record'], db.tables['Style']
+        self.assertEqual(5, db.session.query(db.tables['Imprint']).count())
+        self.assertEqual(6, db.session.query(Style).count())
+        records = db.session.query(Record).order_by(Record.pk).all()
+        self.assertEqual(['imprint%d' % (i % 5) for i in range(7)], [record.imprint.pk for record in records])
+        self.assertEqual(
+            [['style%d' % j for j in range(i % 3)] for i in range(7)],
+            [sorted([style.pk for style in record.styles]) for record in records],
+        )
+        style = db.session.query(Style).get('style1')
+        self.assertEqual(['record2', 'record5'], sorted([record.pk for record in style.records]))
+
+    def test_preload(self):
+        model_names = ['Album', 'Artist', 'Genre']
+        models = {
+            'Album': StatikModel(
+                name='Album',
+                from_string="artist: Artist -> albums\ngenres: Genre[] -> albums\nnotes: Text\n" +
+                            "_meta:\n  deferred: true\n",
+                model_names=model_names,
+            ),
+            'Artist': StatikModel(name='Artist', from_string="title: String\n", model_names=model_names),
+            'Genre': StatikModel(name='Genre', from_string="title: String\n", model_names=model_names),
+        }
+        self.write_data_file('Artist', '_all.yml', ''.join(["- pk: artist%d\n  title: Artist\n" % i for i in range(5)]))
+        self.write_data_file('Genre', '_all.yml', "- pk: rock\n  title: Rock\n- pk: jazz\n  title: Jazz\n")
+        self.write_data_file('Album', '_all.yml', ''.join([
+            "- pk: album%d\n  artist: artist%d\n  genres: [rock, jazz]\n  notes: Notes %d\n" % (i, i % 5, i)
+            for i in range(20)
+        ]))
+
+        db = StatikDatabase(self.data_path, models)
+        statements = []
+        event.listen(
+            db.engine,
+            'before_cursor_execute',
+            lambda conn, cursor, statement, *args: statements.append(statement),
+        )
+
+        albums = db.query('session.query(Album).all()')
+        # the Text field is deferred
+        self.assertIn('notes', inspect(albums[0]).unloaded)
+        db.preload(albums, ['artist', 'genres.albums'], fields=['notes'])
+        query_count = len(statements)
+        # after the albums themselves: their notes, their artists, their genres, then the genres' albums
+        self.assertEqual(5, query_count)
+        # the albums' own rows aren't selected again
+        self.assertEqual(1, len([
+            statement for statement in statements if statement.startswith('SELECT "Album".pk AS "Album_pk", "Album".artist_id')
+        ]))
+        for album in albums:
+            self.assertEqual(album.artist_id, album.artist.pk)
+            self.assertEqual({'rock', 'jazz'}, set([genre.pk for genre in album.genres]))
+            self.assertEqual(20, len(album.genres[0].albums))
+            self.assertEqual('Notes %s' % album.pk[5:], album.notes)
+        self.assertEqual(query_count, len(statements))
+
+        # each query covers at most PRELOAD_CHUNK_SIZE instances
+        with patch.object(StatikDatabase, 'PRELOAD_CHUNK_SIZE', 7):
+            db.preload(albums, ['artist', 'genres'], fields=['notes'])
+        self.assertEqual(query_count + 9, len(statements))
+
+        with self.assertRaises(ValueError):
+            db.preload(albums, ['title'])
+        with self.assertRaises(ValueError):
+            db.preload(albums, fields=['artist'])
+
+    def test_compressed_content(self):
+        model_names = ['Essay']
+        models = {
+            'Essay': StatikModel(name='Essay', from_string="title: String\nbody: Text\nsummary: Content\n",
+                                 model_names=model_names),
+        }
+        long_body = ' '.join(['word'] * 1000)
+        self.write_data_file('Essay', '_all.jsonl', (
+            '{"pk": "long", "title": "Long", "body": "%s"}\n' % long_body +
+            '{"pk": "short", "title": "Short", "body": "A few words", "summary": "*Brief*"}\n' +
+            '{"pk": "empty", "title": "Empty"}\n'
+        ))
+
+        db = StatikDatabase(self.data_path, models, compress_content=True, low_memory=True)
+        raw = dict(db.session.execute('SELECT pk, body FROM "Essay"').fetchall())
+        self.assertLess(len(raw['long']), len(long_body) // 10)
+        self.assertEqual(b'\x00A few words', bytes(raw['short']))
+        self.assertIsNone(raw['empty'])
+
+        essays = db.query("session.query(Essay).order_by(Essay.pk).all()")
+        self.assertEqual([None, long_body, 'A few words'], [essay.body for essay in essays])
+        self.assertEqual([None, None, '<p><em>Brief</em></p>'], [essay.summary for essay in essays])
+
+        # compressed values can't be compared in structured queries
+        self.assertEqual(['long'], [essay.pk for essay in db.query(StatikQuery(
+            {'model': 'Essay', 'filter': {'title': 'Long'}}, models,
+        ))])
+        for spec in [
+            {'model': 'Essay', 'filter': {'body': 'A few words'}},
+            {'model': 'Essay', 'filter': {'summary': {'in': ['*Brief*']}}},
+            {'model': 'Essay', 'order': '-body'},
+        ]:
+            with self.assertRaises(ValueError):
+                db.query(StatikQuery(spec, models))
+            with self.assertRaises(ValueError):
+                db.paginate(StatikQuery(spec, models), 2)
+        # only needed while loading
+        self.assertEqual({}, db.pk_index)
+
+    def test_tree(self):
+        model_names = ['Page']
+        models = {
+            'Page': StatikModel(
+                name='Page',
+                from_string="parent: Page -> children\ntitle: String\nposition: Integer\n" +
+                            "_meta:\n  tree:\n    parent: parent\n    order: [position]\n",
+                model_names=model_names,
+            ),
+        }
+        self.write_data_file('Page', '_all.yml', (
+            "- pk: docs\n  title: Docs\n  position: 1\n"
+            "- pk: install\n  parent: docs\n  title: Install\n  position: 1\n"
+            "- pk: usage\n  parent: docs\n  title: Usage\n  position: 0\n"
+            "- pk: models\n  parent: usage\n  title: Models\n"
+            "- pk: views\n  parent: usage\n  title: Views\n  position: 2\n"
+            "- pk: about\n  title: About\n  position: 0\n"
+        ))
+
+        db = StatikDatabase(self.data_path, models)
+        Page = db.tables['Page']
+        pages = db.session.query(Page).order_by(Page.tree_order).all()
+        self.assertEqual(['about', 'docs', 'usage', 'models', 'views', 'install'], [page.pk for page in pages])
+        self.assertEqual([0, 0, 1, 2, 2, 1], [page.tree_depth for page in pages])
+        self.assertEqual([0, 4, 2, 0, 0, 0], [page.tree_size for page in pages])
+
+        views = db.session.query(Page).filter(Page.pk == 'views').one()
+        self.assertEqual('usage', views.parent.pk)
+        self.assertEqual(['docs', 'usage'], [page.pk for page in views.tree_ancestors])
+        self.assertEqual([], views.tree_descendants)
+
+        docs = views.tree_ancestors[0]
+        self.assertIsNone(docs.parent)
+        self.assertEqual([], docs.tree_ancestors)
+        self.assertEqual(['usage', 'install'], [page.pk for page in docs.children])
+        self.assertEqual(['usage', 'models', 'views', 'install'], [page.pk for page in docs.tree_descendants])
+
+        # preloading keeps the children's order
+        lazy_children = dict([
+            (page.pk, [child.pk for child in page.children]) for page in db.session.query(Page).order_by(Page.pk)
+        ])
+        preload_db = StatikDatabase(self.data_path, models)
+        pages = preload_db.query("session.query(Page).order_by(Page.pk).all()")
+        preload_db.preload(pages, ['children'])
+        self.assertEqual(['usage', 'install'], [child.pk for child in pages[1].children])
+        self.assertEqual(lazy_children, dict([(page.pk, [child.pk for child in page.children]) for page in pages]))
+
+        # ordered by primary key by default, and the primary key can be one of several ordering fields
+        for tree_config, expected_order in [
+            ("    parent: parent\n", ['about', 'docs', 'install', 'usage', 'models', 'views']),
+            ("    parent: parent\n    order: [-position, pk]\n", ['docs', 'install', 'usage', 'views', 'models', 'about']),
+            ("    parent: parent\n    order: [-pk]\n", ['docs', 'usage', 'views', 'models', 'install', 'about']),
+        ]:
+            db = StatikDatabase(self.data_path, {
+                'Page': StatikModel(
+                    name='Page',
+                    from_string="parent: Page -> children\ntitle: String\nposition: Integer\n" +
+                                "_meta:\n  tree:\n" + tree_config,
+                    model_names=model_names,
+                ),
+            })
+            Page = db.tables['Page']
+            self.assertEqual(expected_order, [page.pk for page in db.session.query(Page).order_by(Page.tree_order)])
+
+        # cycles can't be arranged into a tree
+        self.write_data_file('Page', '_all.yml', (
+            "- pk: chicken\n  parent: egg\n- pk: egg\n  parent: chicken\n- pk: root\n"
+        ))
+        with self.assertRaises(ValueError):
+            StatikDatabase(self.data_path, models)
+
+    def test_aggregates(self):
+        model_names = ['Writer', 'Story', 'Label']
+        models = {
+            'Writer': StatikModel(
+                name='Writer',
+                from_string="surname: String\n_meta:\n  aggregates:\n" +
+                            "    story-count: {count: stories}\n" +
+                            "    published-count: {count: stories, filter: {draft: false}}\n" +
+                            "    latest-story: {max: stories.published}\n" +
+                            "    total-words: {sum: stories.words}\n",
+                model_names=model_names,
+            ),
+            'Label': StatikModel(
+                name='Label',
+                from_string="title: String\n_meta:\n  aggregates:\n" +
+                            "    story-count: {count: stories}\n" +
+                            "    first-title: {min: stories.title}\n",
+                model_names=model_names,
+            ),
+            'Story': StatikModel(
+                name='Story',
+                from_string="writer: Writer -> stories\nlabels: Label[] -> stories\ntitle: String\n" +
+                            "published: DateTime\nwords: Integer\ndraft: Boolean\n",
+                model_names=model_names,
+            ),
+        }
+        self.write_data_file('Writer', '_all.yml', (
+            "- pk: ann\n  surname: Ann\n- pk: bob\n  surname: Bob\n- pk: cat\n  surname: Cat\n"
+        ))
+        self.write_data_file('Label', '_all.yml', "- pk: fiction\n- pk: poetry\n- pk: unused\n")
+        self.write_data_file('Story', '_all.yml', (
+            "- pk: s1\n  writer: ann\n  labels: [fiction]\n  title: Zebra\n  published: 2016-01-01\n"
+            "  words: 100\n  draft: false\n"
+            "- pk: s2\n  writer: ann\n  labels: [fiction, poetry]\n  title: Aardvark\n"
+            "  published: 2016-03-01\n  words: 50\n  draft: true\n"
+            "- pk: s3\n  writer: bob\n  labels: [poetry]\n  title: Mongoose\n  published: 2016-02-01\n"
+            "  draft: false\n"
+            "- pk: s4\n  title: Orphan\n"
+        ))
+
+        db = StatikDatabase(self.data_path, models)
+        Writer, Label = db.tables['Writer'], db.tables['Label']
+        writers = db.session.query(Writer).order_by(Writer.pk).all()
+        self.assertEqual([2, 1, 0], [writer.story_count for writer in writers])
+        self.assertEqual([1, 1, 0], [writer.published_count for writer in writers])
+        self.assertEqual([datetime(2016, 3, 1), datetime(2016, 2, 1), None],
+                         [writer.latest_story for writer in writers])
+        self.assertEqual([150, None, None], [writer.total_words for writer in writers])
+
+        labels = db.session.query(Label).order_by(Label.pk).all()
+        self.assertEqual([2, 2, 0], [label.story_count for label in labels])
+        self.assertEqual(['Aardvark', 'Aardvark', None], [label.first_title for label in labels])
+
+        # aggregates can be used in structured queries
+        writers = db.query(StatikQuery({'model': 'Writer', 'order': '-story-count', 'limit': 2}, models))
+        self.assertEqual(['ann', 'bob'], [writer.pk for writer in writers])
+
+        with self.assertRaises(ValueError):
+            StatikDatabase(self.data_path, {
+                'Writer': StatikModel(
+                    name='Writer',
+                    from_string="surname: String\n_meta:\n  aggregates:\n    total: {sum: stories.title}\n",
+                    model_names=model_names,
+                ),
+                'Label': models['Label'],
+                'Story': models['Story'],
+            })
+
+    def test_related(self):
+        model_names = ['Article', 'Topic']
+        models = {
+            'Article': StatikModel(
+                name='Article',
+                from_string="topics: Topic[] -> articles\n_meta:\n  related:\n" +
+                            "    related-articles:\n      via: topics\n      limit: 2\n",
+                model_names=model_names,
+            ),
+            'Topic': StatikModel(name='Topic', from_string="title: String\n", model_names=model_names),
+        }
+        self.write_data_file('Topic', '_all.yml', "- pk: a\n- pk: b\n- pk: c\n- pk: d\n")
+        self.write_data_file('Article', '_all.yml', (
+            "- pk: one\n  topics: [a, b, c]\n"
+            "- pk: two\n  topics: [a]\n"
+            "- pk: three\n  topics: [b, c]\n"
+            "- pk: four\n  topics: [a, c]\n"
+            "- pk: five\n  topics: [d]\n"
+        ))
+
+        db = StatikDatabase(self.data_path, models)
+        Article = db.tables['Article']
+        related = dict([
+            (article.pk, [other.pk for other in article.related_articles])
+            for article in db.session.query(Article)
+        ])
+        self.assertEqual({
+            # ranked by the number of topics in common, then by primary key
+            'one': ['four', 'three'],
+            'two': ['four', 'one'],
+            'three': ['one', 'four'],
+            'four': ['one', 'three'],
+            'five': [],
+        }, related)
+
+        # preloading keeps the ranking
+        articles = db.preload(db.query("session.query(Article)"), ['related-articles'])
+        self.assertIsInstance(articles, list)
+        self.assertEqual(related, dict([
+            (article.pk, [other.pk for other in article.related_articles]) for article in articles
+        ]))
+
+    def test_csv_and_json_collections(self):
+        model_names = ['Supplier', 'Part', 'Feature']
+        models = {
+            'Supplier': StatikModel(
+                name='Supplier',
+                from_string="title: String\nfounded: DateTime\nactive: Boolean\nprofile: Content\n",
+                model_names=model_names,
+            ),
+            'Feature': StatikModel(name='Feature', from_string="title: String\nblurb: Content\n",
+                                   model_names=model_names),
+            'Part': StatikModel(
+                name='Part',
+                from_string="supplier: Supplier\nfeatures: Feature[]\ntitle: String\nstock: Integer\n" +
+                            "in-stock: Boolean\nlisted: DateTime\n",
+                model_names=model_names,
+            ),
+        }
+        self.write_data_file('Supplier', '_all.json', (
+            '[{"pk": "acme", "title": "Acme", "founded": "1999-12-31", "active": true, "profile": "*Acme* Inc."},\n' +
+            ' {"pk": "globex", "title": "Globex", "founded": "2001-02-03T04:05:06", "active": false}]\n'
+        ))
+        self.write_data_file('Feature', '_all.csv', "pk,title,blurb\nsmall,Small,A **small** one\nshiny,\"Shiny, very\",\n")
+        self.write_data_file('Part', '_all.csv', (
+            "pk,supplier,features,title,stock,in-stock,listed\n"
+            "bolt,acme,small;shiny;small,Bolt,10,true,2016-01-02\n"
+            "\n"
+            "nut,,,,0,No,2016-01-02 03:04:05\n"
+            "washer,globex,shiny,Washer,,,\n"
+        ))
+
+        db = StatikDatabase(self.data_path, models)
+        Supplier, Part = db.tables['Supplier'], db.tables['Part']
+        suppliers = db.session.query(Supplier).order_by(Supplier.pk).all()
+        self.assertEqual([datetime(1999, 12, 31), datetime(2001, 2, 3, 4, 5, 6)],
+                         [supplier.founded for supplier in suppliers])
+        self.assertEqual([True, False], [supplier.active for supplier in suppliers])
+
+        bolt, nut, washer = db.session.query(Part).order_by(Part.pk).all()
+        self.assertEqual(('bolt', 'Bolt', 10, True, datetime(2016, 1, 2)),
+                         (bolt.pk, bolt.title, bolt.stock, bolt.in_stock, bolt.listed))
+        self.assertEqual('Acme', bolt.supplier.title)
+        self.assertEqual(['shiny', 'small'], sorted([feature.pk for feature in bolt.features]))
+        self.assertEqual('Shiny, very', [feature for feature in bolt.features if feature.pk == 'shiny'][0].title)
+        self.assertEqual((None, None, 0, False, datetime(2016, 1, 2, 3, 4, 5), []),
+                         (nut.supplier, nut.title, nut.stock, nut.in_stock, nut.listed, nut.features))
+        self.assertEqual((None, None, None), (washer.stock, washer.in_stock, washer.listed))
+        self.assertEqual('globex', washer.supplier.pk)
+
+        # Content fields' Markdown is converted, either while loading or lazily
+        Feature = db.tables['Feature']
+        self.assertEqual(['<p>A <strong>small</strong> one</p>', None],
+                         [feature.blurb for feature in db.session.query(Feature).order_by(Feature.pk.desc())])
+        self.assertEqual(['<p><em>Acme</em> Inc.</p>', None], [supplier.profile for supplier in suppliers])
+        lazy_db = StatikDatabase(self.data_path, models, lazy_content=True)
+        Feature, Supplier = lazy_db.tables['Feature'], lazy_db.tables['Supplier']
+        self.assertEqual('<p>A <strong>small</strong> one</p>',
+                         str(lazy_db.session.query(Feature).filter(Feature.pk == 'small').one().blurb))
+        self.assertEqual('<p><em>Acme</em> Inc.</p>',
+                         str(lazy_db.session.query(Supplier).filter(Supplier.pk == 'acme').one().profile))
+
+        # values that can't be converted to their fields' types are reported
+        self.write_data_file('Part', '_all.csv', "pk,stock\nbolt,ten\n")
+        with self.assertRaises(InvalidModelCollectionDataError):
+            StatikDatabase(self.data_path, models)
+        self.write_data_file('Part', '_all.csv', "title\nBolt\n")
+        with self.assertRaises(InvalidModelCollectionDataError):
+            StatikDatabase(self.data_path, models)
+        # as are rows with more or fewer values than the header has columns
+        for rows in ["bolt,Bolt,10\nnut,Nut,5,extra\n", "bolt,Bolt,10\nnut,Nut\n"]:
+            self.write_data_file('Part', '_all.csv', "pk,title,stock\n" + rows)
+            with self.assertRaises(InvalidModelCollectionDataError) as cm:
+                StatikDatabase(self.data_path, models)
+            self.assertIn('_all.csv', str(cm.exception))
+            self.assertIn('line 3', str(cm.exception))
+
+    def test_persistent_db(self):
+        model_names = ['Shelf', 'Volume']
+        models = {
+            'Shelf': StatikModel(name='Shelf', from_string="label: String\n", model_names=model_names),
+            'Volume': StatikModel(name='Volume', from_string="shelf: Shelf\ntitle: String\n", model_names=model_names),
+        }
+        db_path = os.path.join(self.temp_path, 'statik.db')
+        self.write_data_file('Shelf', 'top.yml', "label: Top shelf\n")
+        self.write_data_file('Volume', 'first.yml', "shelf: top\ntitle: First volume\n")
+
+        db = StatikDatabase(self.data_path, models, db_path=db_path)
+        self.assertEqual({'Shelf', 'Volume'}, db.loaded_models)
+        db.session.close()
+        self.assertTrue(os.path.isfile(db_path))
+
+        # only the changed model's data must be reloaded
+        self.write_data_file('Volume', 'second.yml', "shelf: top\ntitle: Second volume\n")
+        db = StatikDatabase(self.data_path, models, db_path=db_path)
+        self.assertEqual({'Volume'}, db.loaded_models)
+        Volume = db.tables['Volume']
+        volumes = db.session.query(Volume).order_by(Volume.pk).all()
+        self.assertEqual(['first', 'second'], [volume.pk for volume in volumes])
+        self.assertEqual('Top shelf', volumes[1].shelf.label)
+        db.session.close()
+
+        # existing data referring to removed instances must still be caught
+        os.remove(os.path.join(self.data_path, 'Shelf', 'top.yml'))
+        with self.assertRaises(DanglingReferenceError) as cm:
+            StatikDatabase(self.data_path, models, db_path=db_path)
+        self.assertEqual(2, len(cm.exception.references))
+
+        # a failed build must not leave a reusable database behind
+        self.write_data_file('Shelf', 'top.yml', "label: New top shelf\n")
+        db = StatikDatabase(self.data_path, models, db_path=db_path)
+        self.assertEqual({'Shelf', 'Volume'}, db.loaded_models)
+        db.session.close()
 
     def assertInstanceEqual(self, expected, inst):
         for field_name, field_value in expected.items():
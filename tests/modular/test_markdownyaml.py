@@ -1,9 +1,14 @@
 # -*- coding:utf-8 -*-
 
+import io
+import os.path
+import shutil
+import tempfile
 import unittest
 from markdown import Markdown
 
-from statik.markdownyaml import MarkdownYamlMetaExtension
+from statik.markdownyaml import MarkdownYamlMetaExtension, read_yaml_front_matter
+from statik.common import ContentLoadable
 
 
 TEST_VALID_CONTENT1 = """---
@@ -18,6 +23,19 @@ yet-another:
 This is where the **Markdown** content will go.
 """
 
+# tab-indented front matter, with Windows line endings
+TEST_VALID_CONTENT3 = (
+    "---\r\n" +
+    "some-variable: Value\r\n" +
+    "yet-another:\r\n" +
+    "\t- this\r\n" +
+    "\t- is a list\r\n" +
+    "nested:\r\n" +
+    "\tsome-key: Some value\r\n" +
+    "---\r\n" +
+    "This is where the **Markdown** content will go.\r\n"
+)
+
 TEST_VALID_CONTENT2 = """
 This is just some plain old **Markdown** content, without metadata.
 """
@@ -42,3 +60,53 @@ class TestMarkdownYamlExtension(unittest.TestCase):
         self.assertEqual("<p>This is just some plain old <strong>Markdown</strong> content, without metadata.</p>", html.strip())
         # no metadata
         self.assertEqual({}, md.meta)
+
+    def test_raw_content(self):
+        loadable = ContentLoadable(
+            from_string=TEST_VALID_CONTENT1,
+            name='test',
+            file_type='markdown',
+            convert_markdown=False,
+        )
+        self.assertEqual('Value', loadable.vars['some-variable'])
+        self.assertEqual("This is where the **Markdown** content will go.", loadable.content.strip())
+
+    def test_front_matter_only(self):
+        f = io.StringIO(TEST_VALID_CONTENT1)
+        self.assertEqual(7, len(read_yaml_front_matter(f)))
+        # the body must not have been consumed
+        self.assertEqual("This is where the **Markdown** content will go.\n", f.read())
+        self.assertEqual([], read_yaml_front_matter(io.StringIO(TEST_VALID_CONTENT2)))
+
+        loadable = ContentLoadable(
+            from_string=TEST_VALID_CONTENT1,
+            name='test',
+            file_type='markdown',
+            load_content=False,
+        )
+        self.assertEqual(['this', 'is', 'a', 'list'], loadable.vars['yet-another'])
+        self.assertIsNone(loadable.content)
+
+    def test_front_matter_whitespace(self):
+        expected_vars = {
+            'some-variable': 'Value',
+            'yet-another': ['this', 'is a list'],
+            'nested': {'some-key': 'Some value'},
+        }
+        for options in [{}, {'load_content': False}, {'convert_markdown': False}]:
+            loadable = ContentLoadable(from_string=TEST_VALID_CONTENT3, name='test', file_type='markdown', **options)
+            self.assertEqual(expected_vars, loadable.vars, options)
+
+        temp_path = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(temp_path, 'test.md')
+            with open(filename, 'wb') as f:
+                f.write(TEST_VALID_CONTENT3.encode('utf-8'))
+            for options in [{}, {'load_content': False}, {'convert_markdown': False}]:
+                self.assertEqual(expected_vars, ContentLoadable(filename, **options).vars, options)
+        finally:
+            shutil.rmtree(temp_path)
+
+
+if __name__ == "__main__":
+    unittest.main()
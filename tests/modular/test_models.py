@@ -23,6 +23,27 @@ TEST_MODEL_VALID_FK = """string-field: String
 other-field: OtherModel
 """
 
+TEST_MODEL_INDEXES = """string-field: String
+other-field: OtherModel
+_meta:
+  indexes:
+    - string-field
+    - [other-field, string-field]
+"""
+
+TEST_MODEL_INVALID_INDEX = """string-field: String
+_meta:
+  indexes:
+    - missing-field
+"""
+
+TEST_MODEL_DEFERRED = """string-field: String
+text-field: Text
+body-field: Content
+_meta:
+  deferred: [string-field, text-field]
+"""
+
 
 class TestStatikModels(unittest.TestCase):
 
@@ -43,6 +64,8 @@ class TestStatikModels(unittest.TestCase):
         self.assertIsInstance(getattr(model, 'bool_field'), StatikBooleanField)
         self.assertIsInstance(getattr(model, 'some_content_field'), StatikContentField)
         self.assertIsInstance(getattr(model, 'text_field'), StatikTextField)
+        # fields are only deferred if configured to be
+        self.assertEqual([], model.deferred_fields)
 
     def test_model_invalid_fk(self):
         with self.assertRaises(InvalidFieldTypeError):
@@ -63,6 +86,139 @@ class TestStatikModels(unittest.TestCase):
         self.assertIsInstance(getattr(model, 'other_field'), StatikForeignKeyField)
         self.assertEqual('OtherModel', model.other_field.field_type)
 
+    def test_model_indexes(self):
+        model = StatikModel(
+            name='TestModel',
+            from_string=TEST_MODEL_INDEXES,
+            model_names=['TestModel', 'OtherModel']
+        )
+        self.assertEqual(['string_field', 'other_field'], model.field_names)
+        self.assertEqual([('string_field',), ('other_field', 'string_field')], model.indexes)
+
+        with self.assertRaises(ValueError):
+            StatikModel(
+                name='TestModel',
+                from_string=TEST_MODEL_INVALID_INDEX,
+                model_names=['TestModel']
+            )
+
+    def test_model_deferred_fields(self):
+        model = StatikModel(
+            name='TestModel',
+            from_string=TEST_MODEL_DEFERRED,
+            model_names=['TestModel']
+        )
+        self.assertEqual(['string_field', 'text_field'], model.deferred_fields)
+
+        model = StatikModel(
+            name='TestModel',
+            from_string="text-field: Text\n_meta:\n  deferred: false\n",
+            model_names=['TestModel']
+        )
+        self.assertEqual([], model.deferred_fields)
+
+        # all of the Content and Text fields
+        model = StatikModel(
+            name='TestModel',
+            from_string="string-field: String\ntext-field: Text\nbody-field: Content\n_meta:\n  deferred: true\n",
+            model_names=['TestModel']
+        )
+        self.assertEqual(['text_field', 'body_field'], model.deferred_fields)
+
+        with self.assertRaises(ValueError):
+            StatikModel(
+                name='TestModel',
+                from_string="other-field: OtherModel\n_meta:\n  deferred: [other-field]\n",
+                model_names=['TestModel', 'OtherModel']
+            )
+
+    def test_model_tree(self):
+        model = StatikModel(
+            name='TestModel',
+            from_string="parent-node: TestModel -> children\nposition: Integer\n" +
+                        "_meta:\n  tree:\n    parent: parent-node\n    order: [-position, pk]\n",
+            model_names=['TestModel']
+        )
+        self.assertEqual({'parent': 'parent_node', 'order': [('position', True), ('pk', False)]}, model.tree)
+        model.find_additional_rels({'TestModel': model})
+        self.assertEqual('parent_node', model.additional_rels['children']['back_populates'])
+
+        model = StatikModel(
+            name='TestModel',
+            from_string="parent: TestModel\n_meta:\n  tree: parent\n",
+            model_names=['TestModel']
+        )
+        self.assertEqual({'parent': 'parent', 'order': [('pk', False)]}, model.tree)
+
+        with self.assertRaises(ValueError):
+            StatikModel(
+                name='TestModel',
+                from_string="parent: OtherModel\n_meta:\n  tree: parent\n",
+                model_names=['TestModel', 'OtherModel']
+            )
+
+        with self.assertRaises(ReservedFieldNameError):
+            StatikModel(
+                name='TestModel',
+                from_string="parent: TestModel\ntree-depth: Integer\n_meta:\n  tree: parent\n",
+                model_names=['TestModel']
+            )
+
+    def test_model_aggregates(self):
+        model = StatikModel(
+            name='TestModel',
+            from_string="_meta:\n  aggregates:\n    other-count: {count: others, filter: {flag: true}}\n" +
+                        "    latest-other: {max: others.created}\n",
+            model_names=['TestModel', 'OtherModel']
+        )
+        other_model = StatikModel(
+            name='OtherModel',
+            from_string="test-model: TestModel -> others\nflag: Boolean\ncreated: DateTime\n",
+            model_names=['TestModel', 'OtherModel']
+        )
+        models = {'TestModel': model, 'OtherModel': other_model}
+        model.find_additional_rels(models)
+        model.resolve_aggregates(models)
+        self.assertEqual('Integer', model.aggregates['other_count']['field_type'])
+        self.assertEqual('DateTime', model.aggregates['latest_other']['field_type'])
+        self.assertEqual('test_model', model.aggregates['latest_other']['back_populates'])
+
+        for aggregates in ["other-count: {count: others.flag.created}\n", "total: {sum: others}\n",
+                           "total: {sum: others.created, max: others.created}\n"]:
+            with self.assertRaises(ValueError):
+                StatikModel(
+                    name='TestModel',
+                    from_string="_meta:\n  aggregates:\n    " + aggregates,
+                    model_names=['TestModel']
+                )
+
+        with self.assertRaises(ReservedFieldNameError):
+            StatikModel(
+                name='TestModel',
+                from_string="count: Integer\n_meta:\n  aggregates:\n    count: {count: others}\n",
+                model_names=['TestModel']
+            )
+
+    def test_model_related(self):
+        model = StatikModel(
+            name='TestModel',
+            from_string="others: OtherModel[]\n_meta:\n  related:\n    similar: others\n" +
+                        "    most-similar: {via: others, limit: 1}\n",
+            model_names=['TestModel', 'OtherModel']
+        )
+        self.assertEqual({
+            'similar': {'via': 'others', 'limit': StatikModel.DEFAULT_RELATED_LIMIT},
+            'most_similar': {'via': 'others', 'limit': 1},
+        }, model.related)
+
+        for related in ["similar: other\n", "similar: {limit: 2}\n", "similar: {via: others, limit: 0}\n"]:
+            with self.assertRaises(ValueError):
+                StatikModel(
+                    name='TestModel',
+                    from_string="other: OtherModel\nothers: OtherModel[]\n_meta:\n  related:\n    " + related,
+                    model_names=['TestModel', 'OtherModel']
+                )
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,96 @@
+# -*- coding:utf-8 -*-
+
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from sqlalchemy.exc import OperationalError
+
+from statik.models import *
+from statik.database import *
+from statik.profiler import *
+from statik.query import StatikQuery
+
+MODEL_NAMES = ['Team', 'Player']
+
+MODELS = {
+    'Team': StatikModel(name='Team', from_string="title: String\n", model_names=MODEL_NAMES),
+    'Player': StatikModel(name='Player', from_string="team: Team -> players\nsurname: String\n", model_names=MODEL_NAMES),
+}
+
+
+class TestStatikProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.data_path = tempfile.mkdtemp()
+        for model_name in MODEL_NAMES:
+            os.makedirs(os.path.join(self.data_path, model_name))
+        with open(os.path.join(self.data_path, 'Team', '_all.yml'), 'wt') as f:
+            f.write(''.join(["- pk: team%d\n  title: Team %d\n" % (i, i) for i in range(10)]))
+        with open(os.path.join(self.data_path, 'Player', '_all.yml'), 'wt') as f:
+            f.write(''.join(["- pk: player%d\n  team: team%d\n  surname: Surname\n" % (i, i) for i in range(10)]))
+        self.db = StatikDatabase(self.data_path, MODELS)
+
+    def tearDown(self):
+        shutil.rmtree(self.data_path)
+
+    def test_profiler(self):
+        profiler = StatikProfiler(self.db.engine)
+        profiler.set_view('players', 'player.html')
+        # lazily loads each player's team, one at a time
+        teams = [player.team.title for player in self.db.query('session.query(Player).all()')]
+        self.assertEqual(10, len(teams))
+        profiler.explain()
+        self.assertFalse(profiler.enabled)
+
+        ranked = profiler.ranked_stats()
+        self.assertEqual(2, len(ranked))
+        self.assertEqual(11, sum([stats.count for stats in ranked]))
+        for stats in ranked:
+            self.assertEqual('players', stats.view)
+            self.assertEqual('player.html', stats.template)
+            self.assertGreater(len(stats.query_plan), 0)
+
+        n_plus_one = [stats for stats in ranked if stats.is_n_plus_one]
+        self.assertEqual(1, len(n_plus_one))
+        self.assertEqual(10, n_plus_one[0].count)
+        self.assertIn('FROM "Team"', n_plus_one[0].statement)
+        self.assertIn('N+1', profiler.summary())
+
+        # statements executed after the profiler has stopped aren't recorded
+        self.db.session.query(self.db.tables['Team']).count()
+        self.assertEqual(11, sum([stats.count for stats in profiler.ranked_stats()]))
+
+    def test_failed_statement(self):
+        profiler = StatikProfiler(self.db.engine)
+        with self.assertRaises(OperationalError):
+            self.db.session.execute('SELECT * FROM "Coach"')
+        self.db.session.rollback()
+        self.assertEqual(10, self.db.session.query(self.db.tables['Team']).count())
+        profiler.stop()
+
+        # the failed statement isn't recorded, and doesn't affect the timing of the next one
+        ranked = profiler.ranked_stats()
+        self.assertEqual(1, len(ranked))
+        self.assertIn('FROM "Team"', ranked[0].statement)
+        self.assertEqual(1, ranked[0].count)
+        self.assertGreater(ranked[0].total_time, 0)
+
+    def test_paginated_view(self):
+        profiler = StatikProfiler(self.db.engine)
+        profiler.set_view('players', 'players.html')
+        total, pages = self.db.paginate(StatikQuery({'model': 'Player', 'order': 'surname'}, MODELS), 1)
+        self.assertEqual(10, total)
+        self.assertEqual(['player%d' % i for i in range(10)], [page[0].pk for page in pages])
+        profiler.explain()
+
+        # the same page query, executed once per page with each page's keyset, isn't an N+1 pattern
+        ranked = profiler.ranked_stats()
+        self.assertIn(10, [stats.count for stats in ranked])
+        self.assertEqual([], [stats for stats in ranked if stats.is_n_plus_one])
+        self.assertNotIn('N+1', profiler.summary())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,178 @@
+# -*- coding:utf-8 -*-
+
+import os.path
+import gc
+import shutil
+import tempfile
+import unittest
+import weakref
+from datetime import datetime
+
+from sqlalchemy import inspect
+
+from statik.models import *
+from statik.database import *
+from statik.query import *
+
+MODEL_NAMES = ['Notebook', 'Note']
+
+MODELS = {
+    'Notebook': StatikModel(name='Notebook', from_string="label: String\n", model_names=MODEL_NAMES),
+    'Note': StatikModel(
+        name='Note',
+        from_string="notebook: Notebook\ntitle: String\npriority: Integer\nwritten: DateTime\npinned: Boolean\n",
+        model_names=MODEL_NAMES,
+    ),
+}
+
+NOTES = """- pk: one
+  notebook: work
+  title: First
+  priority: 1
+  written: 2016-01-01
+  pinned: true
+- pk: two
+  notebook: work
+  title: Second
+  priority: 3
+  written: 2016-02-01
+- pk: three
+  notebook: home
+  title: Third
+  priority: 2
+  written: 2016-03-01
+  pinned: false
+- pk: four
+  notebook: home
+  title: Fourth
+  written: 2016-04-01
+"""
+
+
+class TestStatikQuery(unittest.TestCase):
+
+    def setUp(self):
+        self.data_path = tempfile.mkdtemp()
+        for model_name in MODEL_NAMES:
+            os.makedirs(os.path.join(self.data_path, model_name))
+        with open(os.path.join(self.data_path, 'Notebook', '_all.yml'), 'wt') as f:
+            f.write("- pk: work\n  label: Work\n- pk: home\n  label: Home\n")
+        with open(os.path.join(self.data_path, 'Note', '_all.yml'), 'wt') as f:
+            f.write(NOTES)
+        self.db = StatikDatabase(self.data_path, MODELS)
+
+    def tearDown(self):
+        shutil.rmtree(self.data_path)
+
+    def query_pks(self, spec):
+        return [note.pk for note in self.db.query(StatikQuery(spec, MODELS))]
+
+    def test_query(self):
+        self.assertEqual(['four', 'three', 'two', 'one'], self.query_pks({'model': 'Note', 'order': '-written'}))
+        self.assertEqual(
+            ['two', 'one'],
+            self.query_pks({'model': 'Note', 'filter': {'notebook': 'work'}, 'order': ['-priority']}),
+        )
+        self.assertEqual(
+            ['three', 'four'],
+            self.query_pks({
+                'model': 'Note',
+                'filter': {'written': {'>=': datetime(2016, 3, 1)}},
+                'order': 'written',
+            }),
+        )
+        self.assertEqual(
+            ['one', 'two'],
+            self.query_pks({'model': 'Note', 'filter': {'pk': {'in': ['one', 'two', 'five']}}, 'order': 'pk', 'limit': 2}),
+        )
+        self.assertEqual(['four'], self.query_pks({'model': 'Note', 'filter': {'priority': None}}))
+        self.assertEqual(['one'], self.query_pks({'model': 'Note', 'filter': {'priority': {'<': 2, '!=': None}}}))
+
+        # the same structure with different parameter values reuses the compiled query
+        self.assertEqual(['one', 'two'], self.query_pks({'model': 'Note', 'filter': {'notebook': 'work'}, 'order': 'pk'}))
+        self.assertEqual(['four', 'three'], self.query_pks({'model': 'Note', 'filter': {'notebook': 'home'}, 'order': 'pk'}))
+
+        # only the requested fields are loaded
+        self.db.session.expunge_all()
+        notes = self.db.query(StatikQuery({'model': 'Note', 'fields': ['title'], 'order': 'pk'}, MODELS))
+        self.assertEqual(['Fourth', 'First', 'Third', 'Second'], [note.title for note in notes])
+        self.assertIn('priority', inspect(notes[0]).unloaded)
+
+        # identical queries are served from the result cache
+        hits = self.db.query_cache_hits
+        self.query_pks({'model': 'Note', 'order': '-written'})
+        self.assertEqual(hits + 1, self.db.query_cache_hits)
+
+    def test_stream(self):
+        cached_notes = self.db.query('session.query(Note).all()')
+
+        batches = self.db.stream(StatikQuery({'model': 'Note', 'order': 'written'}, MODELS), batch_size=3)
+        first_batch = next(batches)
+        self.assertEqual(['one', 'two', 'three'], [note.pk for note in first_batch])
+        # streamed instances are separate from those in the main session
+        self.assertNotIn(first_batch[0], cached_notes)
+        self.assertEqual('work', first_batch[0].notebook.pk)
+        second_batch = next(batches)
+        self.assertEqual(['four'], [note.pk for note in second_batch])
+        # the previous batch is released once the next one is requested
+        self.assertTrue(inspect(first_batch[0]).detached)
+        self.assertTrue(inspect(first_batch[0].notebook).detached)
+        self.assertEqual([], list(batches))
+
+        batches = list(self.db.stream('session.query(Note).filter(Note.notebook_id == "home").order_by(Note.pk)', 1))
+        self.assertEqual([['four'], ['three']], [[note.pk for note in batch] for batch in batches])
+
+        # the main session's instances are unaffected
+        self.assertTrue(all([inspect(note).persistent for note in cached_notes]))
+
+    def test_paginate(self):
+        for spec in [
+            {'model': 'Note'},
+            {'model': 'Note', 'order': 'priority'},
+            {'model': 'Note', 'order': '-priority'},
+            {'model': 'Note', 'order': ['notebook', '-priority']},
+            {'model': 'Note', 'order': ['-notebook', 'written']},
+            {'model': 'Note', 'filter': {'priority': {'!=': None}}, 'order': '-written'},
+            {'model': 'Note', 'order': ['-pinned', '-written']},
+            {'model': 'Note', 'order': ['pinned', 'priority']},
+        ]:
+            query = StatikQuery(spec, MODELS)
+            expected = [note.pk for note in query.build(self.db.session, self.db.tables['Note']).order_by(
+                self.db.tables['Note'].pk
+            ).params(**query.bound_params)]
+            for page_size in [1, 2, 3, 4, 5]:
+                total, pages = self.db.paginate(query, page_size)
+                pages = [[note.pk for note in page] for page in pages]
+                self.assertEqual(len(expected), total)
+                self.assertEqual(expected, sum(pages, []), (spec, page_size))
+                self.assertTrue(all([len(page) == page_size for page in pages[:-1]]))
+
+    def test_compiled_query_lifetime(self):
+        # a database's compiled queries (and so its model classes) go away with the database
+        db = StatikDatabase(self.data_path, MODELS)
+        self.assertEqual(4, len(db.query(StatikQuery({'model': 'Note', 'order': '-written'}, MODELS))))
+        db_model = weakref.ref(db.tables['Note'])
+        del db
+        gc.collect()
+        self.assertIsNone(db_model())
+
+    def test_invalid_query(self):
+        with self.assertRaises(ValueError):
+            StatikQuery({'model': 'Missing'}, MODELS)
+        with self.assertRaises(ValueError):
+            StatikQuery({'model': 'Note', 'filter': {'missing': 1}}, MODELS)
+        with self.assertRaises(ValueError):
+            StatikQuery({'model': 'Note', 'filter': {'priority': {'~': 1}}}, MODELS)
+        with self.assertRaises(ValueError):
+            StatikQuery({'model': 'Note', 'order': '-missing'}, MODELS)
+        with self.assertRaises(ValueError):
+            StatikQuery({'model': 'Note', 'limit': 'ten'}, MODELS)
+        with self.assertRaises(ValueError) as cm:
+            StatikQuery({'model': 'Note', 'filter': {'priority': [1, 2]}}, MODELS)
+        self.assertIn('"in"', str(cm.exception))
+        with self.assertRaises(ValueError):
+            StatikQuery({'model': 'Note', 'filter': {'priority': {'>=': [1, 2]}}}, MODELS)
+
+
+if __name__ == "__main__":
+    unittest.main()
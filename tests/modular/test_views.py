@@ -6,8 +6,9 @@ import xml.etree.ElementTree as ET
 from statik.views import *
 from statik.jinja2ext import *
 from statik.utils import add_url_path_component
+from statik.common import LazyMarkdownContent, markdown_to_html
 
-from jinja2 import Environment, DictLoader
+from jinja2 import DictLoader
 
 TEST_SIMPLE_VIEW = """path: /
 template: home
@@ -49,6 +50,52 @@ TEST_TEMPLATES = {
 """
 }
 
+TEST_NEIGHBOURS_VIEW = """path:
+  template: /chapters/{{ chapter.pk }}/
+  for-each:
+    chapter: session.query(Chapter).order_by(Chapter.pk)
+  neighbours: true
+template: chapter
+"""
+
+TEST_NEIGHBOURS_TEMPLATES = {
+    'chapter.html': """{% if prev %}{% url "chapters", prev %}{% endif %}|{% if next %}{% url "chapters", next %}{% endif %}""",
+}
+
+
+TEST_GROUPED_VIEW = """path:
+  template: /tags/{{ group.key }}/
+  for-each:
+    chapter: session.query(Chapter).order_by(Chapter.pk)
+  group-by: chapter.tags
+template: tag
+"""
+
+TEST_GROUPED_TEMPLATES = {
+    'tag.html': """{{ group.key }}:{% for chapter in group %}{{ chapter.pk }},{% endfor %}""",
+}
+
+
+class MockInstance(object):
+
+    def __init__(self, pk, tags=None):
+        self.pk = pk
+        self.tags = tags
+
+
+class MockDatabase(object):
+    """Returns the same instances for any query."""
+
+    def __init__(self, instances):
+        self.instances = instances
+
+    def query(self, query):
+        return self.instances
+
+    def preload(self, instances, relationships=None, fields=None):
+        return instances
+
+
 TEST_XML_VIEW = """path: /index.xml
 template: rss.xml
 context:
@@ -60,7 +107,7 @@ context:
 class TestStatikViews(unittest.TestCase):
 
     def configure_env(self, templates_dict=TEST_TEMPLATES, base_path='/'):
-        env = Environment(
+        env = StatikEnvironment(
                 loader=DictLoader(templates_dict),
                 extensions=[
                     'statik.jinja2ext.StatikUrlExtension',
@@ -139,6 +186,108 @@ class TestStatikViews(unittest.TestCase):
         self.assertEqual('rss', parsed.findall('.')[0].tag)
         self.assertEqual('My RSS Feed', parsed.findall('./channel/title')[0].text.strip())
 
+    def test_neighbours(self):
+        env = self.configure_env(templates_dict=TEST_NEIGHBOURS_TEMPLATES)
+        view = StatikView(
+                from_string=TEST_NEIGHBOURS_VIEW,
+                name='chapters',
+                models={},
+                template_env=env,
+        )
+        env.statik_views = {'chapters': view}
+        processed = view.process(MockDatabase([MockInstance('one'), MockInstance('two'), MockInstance('three')]))
+        self.assertEqual('|/chapters/two/', processed['chapters']['one']['index.html'])
+        self.assertEqual('/chapters/one/|/chapters/three/', processed['chapters']['two']['index.html'])
+        self.assertEqual('/chapters/two/|', processed['chapters']['three']['index.html'])
+
+        processed = view.process(MockDatabase([MockInstance('only')]))
+        self.assertEqual('|', processed['chapters']['only']['index.html'])
+
+        with self.assertRaises(ValueError):
+            StatikView(
+                    from_string=TEST_NEIGHBOURS_VIEW.replace("neighbours: true", "neighbours: true\n  stream: true"),
+                    name='chapters',
+                    models={},
+                    template_env=env,
+            )
+
+        # eager loading takes a list of relationships
+        view = StatikView(
+                from_string=TEST_NEIGHBOURS_VIEW + "eager-load:\n  chapter: [book, authors]\n",
+                name='chapters',
+                models={},
+                template_env=env,
+        )
+        self.assertEqual({'chapter': ['book', 'authors']}, view.eager_load)
+        with self.assertRaises(ValueError):
+            StatikView(
+                    from_string=TEST_NEIGHBOURS_VIEW + "eager-load:\n  chapter:\n    book: joined\n",
+                    name='chapters',
+                    models={},
+                    template_env=env,
+            )
+
+    def test_group_by(self):
+        env = self.configure_env(templates_dict=TEST_GROUPED_TEMPLATES)
+        view = StatikView(
+                from_string=TEST_GROUPED_VIEW,
+                name='tags',
+                models={},
+                template_env=env,
+        )
+        env.statik_views = {'tags': view}
+        processed = view.process(MockDatabase([
+            MockInstance('one', ['a', 'b']),
+            MockInstance('two', 'b'),
+            MockInstance('three', None),
+            MockInstance('four', ['c', 'a']),
+        ]))
+        self.assertEqual(['a', 'b', 'c'], list(processed['tags'].keys()))
+        self.assertEqual('a:one,four,', processed['tags']['a']['index.html'])
+        self.assertEqual('b:one,two,', processed['tags']['b']['index.html'])
+        self.assertEqual('c:four,', processed['tags']['c']['index.html'])
+        # groups can also be linked to by their keys
+        self.assertEqual('/tags/b/', env.from_string('{% url "tags", "b" %}').render())
+
+        with self.assertRaises(ValueError):
+            StatikView(
+                    from_string=TEST_GROUPED_VIEW.replace("group-by: chapter.tags", "group-by: [a]"),
+                    name='tags',
+                    models={},
+                    template_env=env,
+            )
+
+    def test_lazy_content_string_filters(self):
+        env = self.configure_env()
+        source = "Some *Markdown* content, which is long enough to need truncating when it's summarised."
+        html = markdown_to_html(source)
+        for template in [
+            "{{ content|truncate(30) }}",
+            "{{ content[:20] }}",
+            "{{ content|wordcount }}",
+            "{{ content|length }}",
+            "{{ content|upper }}",
+            "{{ content|reverse }}",
+            "{{ content|striptags }}",
+            "{{ content|replace('Markdown', 'plain') }}",
+            "{{ content is string }}",
+            "{{ content ~ '!' }}",
+            "{{ content.startswith('<p>') }}",
+            "{% for c in content %}{{ c }}{% endfor %}",
+            "{{ content == content_html }}",
+            "{{ [content, 'a']|sort|first == 'a' }}",
+            "{{ post.content|wordcount }}",
+            "{{ post['content']|reverse }}",
+        ]:
+            self.assertEqual(
+                env.from_string(template).render(content=html, content_html=html, post={'content': html}),
+                env.from_string(template).render(
+                    content=LazyMarkdownContent(source),
+                    content_html=html,
+                    post={'content': LazyMarkdownContent(source)},
+                ),
+                template,
+            )
 
 if __name__ == "__main__":
     unittest.main()